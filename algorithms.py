@@ -1,9 +1,13 @@
+import asyncio
+import re
 import string
+from collections import Counter
 import numpy as np
 import utils
-from utils import AnswerMapping
-from nltk.corpus import stopwords
-from models import OpenAIGPT
+from utils import AnswerMapping, AnswerParser, AnswerStream
+from ratelimit import estimate_tokens
+from alignment import SpanAligner
+from budget import TokenBudget
 
 
 class BaseAlgorithm:
@@ -12,12 +16,17 @@ class BaseAlgorithm:
            "adverbs, abstract concepts are not entities. Dates, years and times are not entities"
 
     chatbot_init = "You are an entity recognition system. "
+    packed_task = "Answer for each of the [n] paragraphs above separately, in the same format as before. " \
+                  "Start the answer for paragraph i with 'Answer i:'"
     entity_token_task = "In the sentence '[sent]'. The phrase '[token]' is an entity of type [type]. In one line explain why. \nAnswer: The phrase '[token]' is an entity of type [type] because"
     nonentity_token_task = "In the sentence '[sent]'. The phrase '[token]' is not an entity. In one line explain why. \nAnswer: The phrase '[token]' is not an entity because"
 
     # if [] = n then there are O(n^2) phrase groupings
 
-    def __init__(self, model_fn=None, split_phrases=False, identify_types=True, resolve_disputes=True):
+    def __init__(self, model_fn=None, split_phrases=False, identify_types=True, resolve_disputes=True, budget=None):
+        """
+        budget: a TokenBudget to size the max tokens of every answer to the paragraph, instead of the model's fixed one
+        """
         self.defn = self.defn
         self.para = None
         self.model_fn = model_fn
@@ -25,8 +34,11 @@ class BaseAlgorithm:
         self.exemplar_task = None
         self.format_task = None
         self.whole_task = None
+        self.prompt = None
         self.identify_types = identify_types
         self.resolve_disputes = resolve_disputes
+        self.budget = budget
+        self.answer_parser = AnswerParser()
 
     def set_para(self, para):
         self.para = para
@@ -36,27 +48,18 @@ class BaseAlgorithm:
 
     @staticmethod
     def clean_output(answers, typestrings=None):
+        """
+        Drops trivial answers and strips type annotations and punctuation from the answers.
+        With typestrings the answers are cleaned in place and returned alongside the unchanged typestrings
+        """
         if typestrings is None:
-            answers = list(set(answers))
-            for trivial in ["", " ", ".", "-"] + stopwords.words('english'):
-                while trivial in answers:
-                    answers.remove(trivial)
-        else:
-            new_answers = []
-            new_typestrings = []
-            for i, ans in enumerate(answers):
-                if ans in new_answers:
-                    continue
-                if ans in ["", " ", ".", "-"] + stopwords.words('english'):
-                    continue
-                new_answers.append(ans)
-                new_typestrings.append(typestrings[i])
+            trivial = utils.get_trivial_answers()
+            answers = [ans for ans in set(answers) if ans not in trivial]
         for i in range(len(answers)):
             ans = answers[i]
             if "(" in ans:
                 ans = ans[:ans.find("(")]
-            ans = ans.strip().strip(''.join(string.punctuation)).strip()
-            answers[i] = ans
+            answers[i] = ans.strip().strip(string.punctuation).strip()
         if typestrings is None:
             return answers
         else:
@@ -69,66 +72,105 @@ class Algorithm(BaseAlgorithm):
         answers, typestrings, metadata = self.perform(verbose=verbose, deduplicate=False)
         return self.parse_span(answers, typestrings, metadata, true_tokens=true_tokens)
 
-    def parse_span(self, answers, typestrings, metadata, true_tokens=None):
-        para = self.para.lower()
-        if true_tokens is not None:
-            para_words = [token.lower() for token in true_tokens]
+    async def perform_span_async(self, true_tokens=None, verbose=False):
+        """
+        Same as perform_span but awaits the model, model_fn must provide an async acall (e.g. AsyncOpenAIGPT).
+        set_para mutates the algorithm, so concurrent callers should each use their own copy (see run.eval_dataset)
+        """
+        assert self.identify_types and not self.split_phrases
+        output = await self.model_fn.acall(self.query_input(), **self.budget_kwargs())
+        return self.span_from_output(output, true_tokens=true_tokens, verbose=verbose)
+
+    def span_from_output(self, output, true_tokens=None, verbose=False):
+        """
+        The second half of perform_span, for when the model output for self.para was obtained elsewhere
+        (async or batched queries)
+        """
+        answers, typestrings, metadata = self.process_output(output, verbose=verbose)
+        return self.parse_span(answers, typestrings, metadata, true_tokens=true_tokens)
+
+    def model_stream(self, inputs):
+        """
+        The model output for inputs piece by piece, in one piece if model_fn can not stream
+        """
+        if hasattr(self.model_fn, "stream"):
+            yield from self.model_fn.stream(inputs, **self.budget_kwargs())
         else:
-            para_words = para.split(" ")
-        span_pred = ["O" for word in para_words]
-        completed_answers = []
-        split_tokens = ["'s", ":"]
+            yield self.query_model(inputs)
+
+    def stream_span(self, true_tokens=None, stop_early=True, verbose=False):
+        """
+        perform_span on a streamed model output: yields (answer, types, span_pred) for every entity as soon as its
+        numbered line is complete, span_pred being the (live) tags of all entities so far, and returns
+        (span_pred, metadata) like perform_span. With stop_early the generation is cancelled once the model moves
+        on from the list (see AnswerStream.finished), anything it would have listed after that is not used
+        """
+        assert self.identify_types and not self.split_phrases
+        aligner = SpanAligner(self.para, true_tokens=true_tokens)
+        parser = AnswerStream()
+        answers, typestrings = [], []
+        stream = self.model_stream(self.query_input())
+        try:
+            for piece in stream:
+                records = parser.feed(piece)
+                yield from self.align_records(aligner, records, answers, typestrings)
+                if stop_early and parser.finished:
+                    break
+            else:
+                yield from self.align_records(aligner, parser.close(), answers, typestrings)
+        finally:
+            stream.close()
+        if len(answers) > len(typestrings):
+            raise IndexError("list index out of range")  # what parse_span raises on an answer without a typestring
+        if verbose:
+            print(parser.output().strip())
+        return aligner.span_pred, parser.output()
+
+    @staticmethod
+    def align_records(aligner, records, answers, typestrings):
+        """
+        Adds the entities of new records to aligner, pairing answers and typestrings by position like parse_span
+        """
+        aligned = min(len(answers), len(typestrings))
+        for entity, true, explanation, entity_type in records:
+            if true:
+                answers.append(entity)
+                if explanation is not None:
+                    typestrings.append(explanation)
+        for i in range(aligned, min(len(answers), len(typestrings))):
+            answer = SpanAligner.normalize(answers[i])
+            types = typestrings[i]
+            if "(" in types and ")" in types:
+                types = types[types.find("(") + 1:types.find(")")]
+                aligner.add(answer, types)
+                yield answer, types, aligner.span_pred
+
+    def perform_span_stream(self, true_tokens=None, stop_early=True, on_entity=None, verbose=False):
+        """
+        stream_span run to the end, calling on_entity(answer, types, span_pred) for every entity as it arrives.
+        Returns (span_pred, metadata) like perform_span
+        """
+        stream = self.stream_span(true_tokens=true_tokens, stop_early=stop_early, verbose=verbose)
+        while True:
+            try:
+                answer, types, span_pred = next(stream)
+            except StopIteration as stop:
+                return stop.value
+            if on_entity is not None:
+                on_entity(answer, types, span_pred)
+
+    def parse_span(self, answers, typestrings, metadata, true_tokens=None):
+        aligner = SpanAligner(self.para, true_tokens=true_tokens)
+        answers = [SpanAligner.normalize(answer) for answer in answers]
+        aligner.index_phrases(answers)
         for i, answer in enumerate(answers):
-            answer = answer.strip().lower()  # take any whitespace out and lowercase for matching
-            if "(" in answer:
-                answer = answer[:answer.find("(")].strip()  # in case some type annotation is stuck here
             types = typestrings[i]
             if "(" in types and ")" in types:
                 types = types[types.find("(") + 1:types.find(")")]
             else:
                 continue
-            answer_token_split = answer
-            for token in split_tokens:
-                answer_token_split = (" "+token).join(answer_token_split.split(token))
-            exists = answer in para or answer_token_split in para
-            answer_multi_word = len(answer.split(" ")) > 1
-            if not exists:
-                continue
-            if not answer_multi_word:
-                if answer not in para_words:
-                    continue
-                multiple = para.count(answer) > 1
-                if not multiple:  # easiest case word should be in para_words only once
-                    index = para_words.index(answer)
-                else:  # must find which occurance this is
-                    n_th = completed_answers.count(answer.strip()) + 1
-                    index = utils.find_nth_list(para_words, answer, n_th)
-                if span_pred[index] == "O":
-                    if "-" in types:  # then its FEWNERD
-                        span_pred[index] = types
-                    else:
-                        span_pred[index] = "B-" + types
-                completed_answers.append(answer)
-            else:
-                for token in split_tokens:
-                    if token in answer:
-                        answer = (" "+token).join(answer.split(token))
-                answer_words = answer.split(" ")
-                multiple = para.count(answer) > 1
-                n_th = completed_answers.count(answer.strip()) + 1
-                index = utils.find_nth_list_subset(para_words, answer, n_th)
-                end_index = index + len(answer_words)
-                if "-" in types:  # then its FEWNERD
-                    span_pred[index] = types
-                else:
-                    span_pred[index] = "B-" + types
-                for j in range(index+1, end_index):
-                    if "-" in types:  # then its FEWNERD
-                        span_pred[j] = types
-                    else:
-                        span_pred[j] = "I-" + types
-                completed_answers.append(answer)
-        return span_pred, metadata
+            aligner.add(answer, types)
+        return aligner.span_pred, metadata
 
     def perform(self, verbose=True, deduplicate=True):
         """
@@ -137,17 +179,11 @@ class Algorithm(BaseAlgorithm):
         :param paragraph:
         :return:
         """
-        if isinstance(self.model_fn, OpenAIGPT):
+        if self.is_chat_model():
             if not self.identify_types:
-                if self.model_fn.is_chat():
-                    answers, metadata = self.perform_chat_query(verbose=verbose)
-                else:
-                    answers, metadata = self.perform_single_query(verbose=verbose)
+                answers, metadata = self.perform_chat_query(verbose=verbose)
             else:
-                if self.model_fn.is_chat():
-                    answers, typestrings, metadata = self.perform_chat_query(verbose=verbose)
-                else:
-                    answers, typestrings, metadata = self.perform_single_query(verbose=verbose)
+                answers, typestrings, metadata = self.perform_chat_query(verbose=verbose)
         else:
             if not self.identify_types:
                 answers, metadata = self.perform_single_query(verbose=verbose)
@@ -184,39 +220,129 @@ class Algorithm(BaseAlgorithm):
             return answers, typestrings, metadata
 
     def perform_single_query(self, verbose=True):
-        if self.exemplar_task is not None:
-            task = self.defn + "\n" + self.exemplar_task + f" '{self.para}' \nAnswer:"
-            output = self.model_fn(task)
-            final = AnswerMapping.exemplar_format_list(output, identify_types=self.identify_types, verbose=verbose)
-        else:
-            task = self.defn + "\n" + self.format_task + f"\nParagraph: {self.para} \nAnswer:"
-            output = self.model_fn(task)
-            final = AnswerMapping.exemplar_format_list(output, identify_types=self.identify_types, verbose=verbose)
-        if self.identify_types:
-            final, typestrings = final
-        if not self.identify_types:
-            return final, output
-        else:
-            return final, typestrings, output
+        output = self.query_model(self.single_query_input())
+        return self.process_output(output, verbose=verbose)
 
     def perform_chat_query(self, verbose=True):
-        if self.exemplar_task is not None:
-            system_msg = self.chatbot_init + self.defn + " " + self.whole_task
-            msgs = [(system_msg, "system")]
-            for exemplar in self.exemplars:
-                if "Answer:" not in exemplar:
-                    raise ValueError(f"Something is wrong, exemplar: \n{exemplar} \n Does not have an 'Answer:'")
-                ans_index = exemplar.index("Answer:")
-                msgs.append((exemplar[:ans_index+7].strip(), "user"))
-                msgs.append((exemplar[ans_index+7:].strip(), "assistant"))
-            msgs.append((f"\nParagraph: {self.para} \nAnswer:", "user"))
-            output = self.model_fn(msgs)
-            final = AnswerMapping.exemplar_format_list(output, identify_types=self.identify_types, verbose=verbose)
+        output = self.query_model(self.chat_query_input())
+        return self.process_output(output, verbose=verbose)
+
+    def is_chat_model(self):
+        return hasattr(self.model_fn, "is_chat") and self.model_fn.is_chat()
+
+    def answer_budget(self, paras=None):
+        """
+        Max tokens of the answer to self.para (or to all of paras) from self.budget, None if there is no budget or
+        model_fn does not take one
+        """
+        if self.budget is None or not getattr(self.model_fn, "supports_budget", False):
+            return None
+        return self.budget.take([self.para] if paras is None else paras, self.compiled_prompt().answer_format)
+
+    def budget_kwargs(self, paras=None):
+        budget = self.answer_budget(paras)
+        return {} if budget is None else {"budget": budget}
+
+    def query_model(self, inputs, paras=None):
+        """
+        model_fn(inputs) for an answer list, limited to the answer budget of the paragraph(s)
+        """
+        return self.model_fn(inputs, **self.budget_kwargs(paras))
+
+    def query_input(self):
+        if self.is_chat_model():
+            return self.chat_query_input()
         else:
-            system_msg = self.chatbot_init + self.defn + " " + self.format_task
-            msgs = [(system_msg, "system"), (f"\nParagraph: {self.para} \nAnswer:", "user")]
-            output = self.model_fn(msgs)
-            final = AnswerMapping.exemplar_format_list(output, identify_types=self.identify_types, verbose=verbose)
+            return self.single_query_input()
+
+    def compiled_prompt(self):
+        """
+        The CompiledPrompt installed by Config.set_config, or one built from the current task attributes if the
+        algorithm was configured by hand
+        """
+        if self.prompt is not None:
+            return self.prompt
+        return CompiledPrompt(self.chatbot_init, self.defn, self.exemplar_task, self.format_task, self.whole_task,
+                              getattr(self, "exemplars", None))  # answer format unknown, budgeted like coT
+
+    def single_query_input(self, suffix=None):
+        if suffix is None:
+            if self.exemplar_task is not None:
+                suffix = f" '{self.para}' \nAnswer:"
+            else:
+                suffix = f"\nParagraph: {self.para} \nAnswer:"
+        return self.compiled_prompt().single(suffix)
+
+    def chat_query_input(self, user_msg=None):
+        if user_msg is None:
+            user_msg = f"\nParagraph: {self.para} \nAnswer:"
+        return self.compiled_prompt().chat(user_msg)
+
+    def packed_query_input(self, paras):
+        """
+        One request asking for the answers to several numbered paragraphs, see perform_packed
+        """
+        listed = "\n".join([f"Paragraph {i+1}: {para}" for i, para in enumerate(paras)])
+        packed = f"\n{listed} \n{self.packed_task.replace('[n]', str(len(paras)))} \nAnswer 1:"
+        if self.is_chat_model():
+            return self.chat_query_input(user_msg=packed)
+        else:
+            return self.single_query_input(suffix=packed)
+
+    @staticmethod
+    def split_packed_output(output, n):
+        """
+        Splits a packed response into the answer blocks of the n paragraphs, None for blocks that are missing
+        """
+        if re.match(r"\s*Answer\s*1\s*:", output) is None:
+            output = "Answer 1:" + output
+        pieces = re.split(r"(?:^|\n)\s*Answer\s*(\d+)\s*:", output)
+        blocks = [None for i in range(n)]
+        for number, block in zip(pieces[1::2], pieces[2::2]):
+            number = int(number)
+            if 1 <= number <= n and blocks[number-1] is None:
+                blocks[number-1] = block
+        return blocks
+
+    def packed_block_complete(self, block):
+        """
+        Whether the answer block of a packed response parses to the end, i.e. its last item has its type
+        """
+        records = self.answer_parser.parse(block)
+        if len(records) == 0 or not self.identify_types:
+            return True
+        return records[-1][3] is not None
+
+    def perform_packed(self, paras, answer_tokens=150):
+        """
+        Queries the model once for all of paras and returns the raw answer block of each paragraph, ready for
+        span_from_output. The request may use the answer budget of every paragraph (answer_tokens each without a
+        budget, for models with a fixed output limit). Paragraphs whose block can not be found in the response are
+        queried again on their own, as is the last block when the response was cut off at the limit or that block
+        does not parse to the end
+        """
+        if len(paras) == 1:
+            self.set_para(paras[0])
+            return [self.query_model(self.query_input())]
+        budget = self.answer_budget(paras)
+        if budget is None and getattr(self.model_fn, "supports_budget", False) and not self.is_chat_model():
+            budget = answer_tokens * len(paras)
+        output = self.model_fn(self.packed_query_input(paras), **({} if budget is None else {"budget": budget}))
+        blocks = Algorithm.split_packed_output(output, len(paras))
+        found = [i for i, block in enumerate(blocks) if block is not None]
+        if len(found) > 0:
+            last = found[-1]
+            if getattr(output, "finish_reason", None) == "length" or \
+                    not self.packed_block_complete(blocks[last]):
+                blocks[last] = None
+        for i, block in enumerate(blocks):
+            if block is None:
+                self.set_para(paras[i])
+                blocks[i] = self.query_model(self.query_input())
+        return blocks
+
+    def process_output(self, output, verbose=True):
+        final = AnswerMapping.exemplar_format_list(output, identify_types=self.identify_types, verbose=verbose)
         if self.identify_types:
             final, typestrings = final
         if not self.identify_types:
@@ -249,7 +375,7 @@ class Algorithm(BaseAlgorithm):
                 annots.append(annot)
             else:
                 if token.strip().strip(string.punctuation).strip() == '' \
-                        or token.strip() in stopwords.words('english') or token.isnumeric():
+                        or token.strip() in utils.get_stopwords() or token.isnumeric():
                     annots.append(None)
                 else:
                     false_indices.append(i)
@@ -280,6 +406,15 @@ class Algorithm(BaseAlgorithm):
 
 
 class MultiAlgorithm(Algorithm):
+    def __init__(self, *args, type_memo=None, batch_queries=False, **kwargs):
+        """
+        type_memo: a typememo.TypeMemo, phrases it is confident about are typed from it instead of by the model
+        batch_queries: one type query (and one dispute query) per paragraph instead of one per entity
+        """
+        super().__init__(*args, **kwargs)
+        self.type_memo = type_memo
+        self.batch_queries = batch_queries
+        self.diagnostics = Counter()  # batched queries, the phrases in them and those asked again on their own
 
     def perform_span(self, true_tokens=None, resolve_disputes=False, verbose=False):
         assert self.identify_types and not self.split_phrases
@@ -287,86 +422,75 @@ class MultiAlgorithm(Algorithm):
         span_pred, metadata = self.parse_span(answers, typestrings, metadata, query=True, true_tokens=true_tokens, verbose=verbose)
         return span_pred, metadata
 
+    async def perform_span_async(self, true_tokens=None, resolve_disputes=False, verbose=False):
+        assert self.identify_types and not self.split_phrases
+        output = await self.model_fn.acall(self.query_input(), **self.budget_kwargs())
+        # the type and dispute queries are still blocking, keep them off the event loop
+        return await asyncio.to_thread(self.span_from_output, output, true_tokens=true_tokens, verbose=verbose)
+
+    def span_from_output(self, output, true_tokens=None, verbose=False):
+        answers, typestrings, metadata = self.process_output(output, verbose=verbose)
+        return self.parse_span(answers, typestrings, metadata, query=True, true_tokens=true_tokens, verbose=verbose)
+
+    def stream_span(self, true_tokens=None, stop_early=True, verbose=False):
+        """
+        The types of the answers come from further queries about all of them, so no entity is final before the
+        whole answer has been read and typed. Runs the queries of perform_span, then yields (answer, types,
+        span_pred) for each entity and returns (span_pred, metadata) like Algorithm.stream_span. stop_early is unused
+        """
+        assert self.identify_types and not self.split_phrases
+        answers, typestrings, metadata = self.perform(verbose=verbose, deduplicate=False)
+        aligner = SpanAligner(self.para, true_tokens=true_tokens)
+        answers = [SpanAligner.normalize(answer) for answer in answers]
+        aligner.index_phrases(answers)
+        for answer, types in self.typed_answers(answers, typestrings, query=True, verbose=verbose):
+            aligner.add(answer, types)
+            yield answer, types, aligner.span_pred
+        return aligner.span_pred, metadata
+
     def parse_span(self, answers, typestrings, metadata, true_tokens=None, query=False, verbose=False):
-        para = self.para.lower()
-        if true_tokens is not None:
-            para_words = [token.lower() for token in true_tokens]
-        else:
-            para_words = para.split(" ")
-        span_pred = ["O" for word in para_words]
-        completed_answers = []
-        split_tokens = ["'s", ":"]
+        aligner = SpanAligner(self.para, true_tokens=true_tokens)
+        answers = [SpanAligner.normalize(answer) for answer in answers]
+        aligner.index_phrases(answers)
+        for answer, types in self.typed_answers(answers, typestrings, query=query, verbose=verbose):
+            aligner.add(answer, types)
+        return aligner.span_pred, metadata
+
+    def typed_answers(self, answers, typestrings, query=False, verbose=False):
+        """
+        (answer, type) of every answer that ends up with a type, in order
+        """
+        typed = []
+        if self.resolve_disputes:
+            given = [MultiAlgorithm.bracketed(typestrings[i]) for i in range(len(answers))]
+            other = self.get_types([answer for answer, types in zip(answers, given) if types is not None],
+                                   verbose=verbose)
+            disputes = [(answer, types, other[answer]) for answer, types in zip(answers, given)
+                        if types is not None and types != other[answer]]
+            resolved = self.resolve_all_disputes(disputes, verbose=verbose)
+        elif query:
+            queried = self.get_types(answers, verbose=verbose)
         for i, answer in enumerate(answers):
-            answer = answer.strip().lower()  # take any whitespace out and lowercase for matching
-            if "(" in answer:
-                answer = answer[:answer.find("(")].strip()  # in case some type annotation is stuck here
             if not self.resolve_disputes and query:
-                types = self.get_type(answer, verbose=verbose)
+                types = queried[answer]
                 if types == -1:
-                    types = typestrings[i]
-                    if "(" in types and ")" in types:
-                        types = types[types.find("(") + 1:types.find(")")]
-                    else:
-                        continue
+                    types = MultiAlgorithm.bracketed(typestrings[i])
             else:
-                types = typestrings[i]
-                if "(" in types and ")" in types:
-                    types = types[types.find("(") + 1:types.find(")")]
-                else:
-                    continue
-                if self.resolve_disputes:
-                    other_types = self.get_type(answer, verbose=verbose)
-                    if types != other_types:
-                        types = self.resolve_dispute(answer, types, other_types, verbose=verbose)
-                        if types == -1:
-                            types = typestrings[i]
-                            if "(" in types and ")" in types:
-                                types = types[types.find("(") + 1:types.find(")")]
-                            else:
-                                continue
-
-            answer_token_split = answer
-            for token in split_tokens:
-                answer_token_split = (" "+token).join(answer_token_split.split(token))
-            exists = answer in para or answer_token_split in para
-            answer_multi_word = len(answer.split(" ")) > 1
-            if not exists:
+                types = MultiAlgorithm.bracketed(typestrings[i])
+                if types is not None and self.resolve_disputes and types != other[answer]:
+                    types = resolved[(answer, types, other[answer])]
+                    if types == -1:
+                        types = MultiAlgorithm.bracketed(typestrings[i])
+            if types is None:
                 continue
-            if not answer_multi_word:
-                if answer not in para_words:
-                    continue
-                multiple = para.count(answer) > 1
-                if not multiple:  # easiest case word should be in para_words only once
-                    index = para_words.index(answer)
-                else:  # must find which occurance this is
-                    n_th = completed_answers.count(answer.strip()) + 1
-                    index = utils.find_nth_list(para_words, answer, n_th)
-                if span_pred[index] == "O":
-                    if "-" in types:  # then its FEWNERD
-                        span_pred[index] = types
-                    else:
-                        span_pred[index] = "B-" + types
-                completed_answers.append(answer)
-            else:
-                for token in split_tokens:
-                    if token in answer:
-                        answer = (" "+token).join(answer.split(token))
-                answer_words = answer.split(" ")
-                multiple = para.count(answer) > 1
-                n_th = completed_answers.count(answer.strip()) + 1
-                index = utils.find_nth_list_subset(para_words, answer, n_th)
-                end_index = index + len(answer_words)
-                if "-" in types:  # then its FEWNERD
-                    span_pred[index] = types
-                else:
-                    span_pred[index] = "B-" + types
-                for j in range(index+1, end_index):
-                    if "-" in types:  # then its FEWNERD
-                        span_pred[j] = types
-                    else:
-                        span_pred[j] = "I-" + types
-                completed_answers.append(answer)
-        return span_pred, metadata
+            typed.append((answer, types))
+        return typed
+
+    @staticmethod
+    def bracketed(typestring):
+        if "(" in typestring and ")" in typestring:
+            return typestring[typestring.find("(") + 1:typestring.find(")")]
+        return None
 
     def get_type(self, phrase, verbose=False):
         task = self.type_task
@@ -392,7 +516,7 @@ class MultiAlgorithm(Algorithm):
             answer = self.template_chat_query(task, exemplars, afterphrase, verbose=verbose)
         else:
             task = self.dispute_task_exemplars
-            answers = self.template_single_query(task, afterphrase, verbose=verbose)
+            answer = self.template_single_query(task, afterphrase, verbose=verbose)
         if "(" in answer and ")" in answer:
             start = answer.find("(")
             end = answer.find(")")
@@ -400,6 +524,79 @@ class MultiAlgorithm(Algorithm):
         else:
             return -1
 
+    def get_types(self, phrases, verbose=False):
+        """
+        {phrase: get_type(phrase)} for all of phrases. With batch_queries one request asks for every type, the
+        phrases whose item can not be read from the answer are asked on their own. Phrases type_memo is confident
+        about are not asked at all
+        """
+        phrases = list(dict.fromkeys(phrases))
+        types = {}
+        keys = {}
+        if self.type_memo is not None:
+            for phrase in phrases:
+                keys[phrase] = self.type_memo.key(self.defn + self.type_task_exemplars, phrase, self.para)
+                memo_type = self.type_memo.get(keys[phrase])
+                if memo_type is not None:
+                    types[phrase] = memo_type
+        asked = [phrase for phrase in phrases if phrase not in types]
+        if self.batch_queries and len(asked) > 1:
+            found = self.batched_type_query(self.batch_type_task, self.batch_type_task_exemplars,
+                                            self.batch_type_exemplars, asked, asked, verbose=verbose)
+            types.update({asked[i]: found[i] for i in found})
+        for phrase in asked:
+            if phrase not in types:
+                types[phrase] = self.get_type(phrase, verbose=verbose)
+            if self.type_memo is not None:
+                self.type_memo.put(keys[phrase], types[phrase])
+        return types
+
+    def resolve_all_disputes(self, disputes, verbose=False):
+        """
+        {(phrase, option1, option2): resolve_dispute(phrase, option1, option2)} for all of disputes, batched like
+        get_types
+        """
+        disputes = list(dict.fromkeys(disputes))
+        resolved = {}
+        if self.batch_queries and len(disputes) > 1:
+            items = [f"{phrase}, Options: [({option1}), ({option2})]" for phrase, option1, option2 in disputes]
+            found = self.batched_type_query(self.batch_dispute_task, self.batch_dispute_task_exemplars,
+                                            self.batch_dispute_exemplars, items,
+                                            [phrase for phrase, option1, option2 in disputes], verbose=verbose)
+            resolved = {disputes[i]: found[i] for i in found}
+        for dispute in disputes:
+            if dispute not in resolved:
+                resolved[dispute] = self.resolve_dispute(*dispute, verbose=verbose)
+        return resolved
+
+    def batched_type_query(self, task, task_exemplars, exemplars, items, phrases, verbose=False):
+        """
+        Asks for the numbered list of items in one query and returns {i: type} for the items whose answer names
+        phrases[i] (matched in order, so a phrase can be asked for twice) and has a (type)
+        """
+        afterphrase = MultiAlgorithm.listed_phrases(items)
+        if self.model_fn.is_chat():
+            output = self.template_chat_query(task, exemplars, afterphrase, verbose=verbose)
+        else:
+            output = self.template_single_query(task_exemplars, afterphrase, verbose=verbose)
+        wanted = [phrase.lower().strip().strip(string.punctuation).strip() for phrase in phrases]
+        found = {}
+        for entity, true, explanation, entity_type in self.answer_parser.parse(output):
+            entity = entity.split(", options:")[0].strip().strip(string.punctuation).strip()
+            for i, phrase in enumerate(wanted):
+                if phrase == entity and i not in found:
+                    if entity_type is not None:
+                        found[i] = entity_type
+                    break
+        self.diagnostics["batched queries"] += 1
+        self.diagnostics["batched phrases"] += len(items)
+        self.diagnostics["asked again"] += len(items) - len(found)
+        return found
+
+    @staticmethod
+    def listed_phrases(items):
+        return "Entity Phrases:\n" + "\n".join(f"{i+1}. {item}" for i, item in enumerate(items))
+
     def template_chat_query(self, task, exemplars, afterphrase, verbose=False):
         system_msg = self.chatbot_init + self.defn + " " + task
         msgs = [(system_msg, "system")]
@@ -423,7 +620,66 @@ class MultiAlgorithm(Algorithm):
         return output
 
 
+class CompiledPrompt:
+    """
+    Everything about a prompt that does not depend on the paragraph, built once per configuration: the prefix of
+    single (completion) prompts and the system + exemplar turns of chat prompts with the exemplars already split at
+    'Answer:'. Rendering a request for a new paragraph is then a single concatenation
+    """
+    def __init__(self, chatbot_init, defn, exemplar_task, format_task, whole_task, exemplars=None, answer_format="coT"):
+        self.defn = defn
+        self.exemplar_task = exemplar_task
+        self.format_task = format_task
+        self.whole_task = whole_task
+        self.exemplars = exemplars
+        self.chatbot_init = chatbot_init
+        self.answer_format = answer_format  # "coT", "tf" or "plain", see TokenBudget
+        if exemplar_task is not None:
+            self.single_prefix = defn + "\n" + exemplar_task
+        else:
+            self.single_prefix = defn + "\n" + format_task
+        self.single_tokens = estimate_tokens(self.single_prefix)
+        self.chat_head = None
+        self.chat_tokens = None
+
+    def compile_chat(self):
+        # done on first use only, completion models never need the exemplars split into turns
+        if self.exemplar_task is not None:
+            chat_head = [(self.chatbot_init + self.defn + " " + self.whole_task, "system")]
+            for exemplar in self.exemplars:
+                if "Answer:" not in exemplar:
+                    raise ValueError(f"Something is wrong, exemplar: \n{exemplar} \n Does not have an 'Answer:'")
+                ans_index = exemplar.index("Answer:")
+                chat_head.append((exemplar[:ans_index+7].strip(), "user"))
+                chat_head.append((exemplar[ans_index+7:].strip(), "assistant"))
+        else:
+            chat_head = [(self.chatbot_init + self.defn + " " + self.format_task, "system")]
+        self.chat_head = tuple(chat_head)
+        self.chat_tokens = estimate_tokens(self.chat_head)
+
+    def single(self, suffix):
+        return utils.PrefixedPrompt(self.single_prefix, suffix)
+
+    def chat(self, user_msg):
+        if self.chat_head is None:
+            self.compile_chat()
+        return list(self.chat_head) + [(user_msg, "user")]
+
+    def n_tokens(self, chat=False):
+        """
+        Tokens taken by the fixed part of the prompt, the paragraph and its answer come on top of this
+        """
+        if chat:
+            if self.chat_head is None:
+                self.compile_chat()
+            return self.chat_tokens
+        return self.single_tokens
+
+
 class Config:
+    compiled_prompts = {}
+    exemplar_pair = re.compile(r"Entity Phrase:\s*(.*?)\s*\n\s*Answer:\s*(.*?)\s*(?=Entity Phrase:|$)", re.DOTALL)
+
     cot_format = """
     Format: 
     
@@ -457,88 +713,117 @@ class Config:
             exemplar = True
             type_task = "Q: Given the paragraph below and the entity phrase, identify what type the entity is \nParagraph:"
             alg.type_exemplars = self.type_exemplars
-            exemplar_construction = ""
-            for exemplar in self.type_exemplars:
-                exemplar_construction = exemplar_construction + type_task + "\n"
-                exemplar_construction = exemplar_construction + exemplar + "\n"
-            exemplar_construction = exemplar_construction + type_task + "\n"
-            alg.type_task_exemplars = exemplar_construction
+            alg.type_task_exemplars = Config.task_exemplars(type_task, self.type_exemplars)
             alg.type_task = type_task
 
             dispute_task = "Q: Given the paragraph below, the entity phrase and two proposed entity types, identify what the actual type of the entity is \nParagraph:"
             alg.dispute_exemplars = self.dispute_exemplars
-            exemplar_construction = ""
-            for exemplar in self.dispute_exemplars:
-                exemplar_construction = exemplar_construction + dispute_task + "\n"
-                exemplar_construction = exemplar_construction + exemplar + "\n"
-            exemplar_construction = exemplar_construction + dispute_task + "\n"
-            alg.dispute_task_exemplars = exemplar_construction
+            alg.dispute_task_exemplars = Config.task_exemplars(dispute_task, self.dispute_exemplars)
             alg.dispute_task = dispute_task
-        if defn:
-            alg.defn = self.defn
+
+            batch_type_task = "Q: Given the paragraph below and a numbered list of entity phrases, identify what " \
+                              "type each entity is. Answer for every phrase in order, in the format " \
+                              "'1. Entity Phrase | Explanation (entity_type)' \nParagraph:"
+            alg.batch_type_exemplars = [Config.batch_exemplar(exemplar) for exemplar in self.type_exemplars]
+            alg.batch_type_task_exemplars = Config.task_exemplars(batch_type_task, alg.batch_type_exemplars)
+            alg.batch_type_task = batch_type_task
+
+            batch_dispute_task = "Q: Given the paragraph below and a numbered list of entity phrases, each with two " \
+                                 "proposed entity types, identify what the actual type of each entity is. Answer for " \
+                                 "every phrase in order, in the format '1. Entity Phrase | Explanation (entity_type)' " \
+                                 "\nParagraph:"
+            alg.batch_dispute_exemplars = [Config.batch_exemplar(exemplar) for exemplar in self.dispute_exemplars]
+            alg.batch_dispute_task_exemplars = Config.task_exemplars(batch_dispute_task, alg.batch_dispute_exemplars)
+            alg.batch_dispute_task = batch_dispute_task
+        prompt = self.compile(alg, exemplar=exemplar, coT=coT, tf=tf, defn=defn)
+        alg.prompt = prompt
+        alg.defn = prompt.defn
+        alg.format_task = prompt.format_task
+        alg.exemplar_task = prompt.exemplar_task
+        if prompt.exemplars is not None:
+            alg.whole_task = prompt.whole_task
+            alg.exemplars = prompt.exemplars
+
+    @staticmethod
+    def task_exemplars(task, exemplars):
+        return "".join([task + "\n" + exemplar + "\n" for exemplar in exemplars]) + task + "\n"
+
+    @staticmethod
+    def batch_exemplar(exemplar):
+        """
+        A type or dispute exemplar (the paragraph, then "Entity Phrase: ... Answer: ..." per phrase) rewritten as
+        the numbered list of phrases and the numbered answer of a batched query
+        """
+        para = exemplar[:exemplar.index("Entity Phrase:")].strip()
+        pairs = Config.exemplar_pair.findall(exemplar)
+        answers = "\n".join(f"{i+1}. {phrase.split(', Options:')[0]} | {answer}"
+                            for i, (phrase, answer) in enumerate(pairs))
+        return f"{para}\n\n{MultiAlgorithm.listed_phrases([phrase for phrase, answer in pairs])}\nAnswer:\n{answers}"
+
+    def exemplar_list(self, exemplar=True, coT=True, tf=True):
+        if not exemplar:
+            return None
+        if coT:
+            if tf:
+                return self.cot_exemplars
+            else:
+                return self.no_tf_exemplars
         else:
-            alg.defn = ""
+            if not tf:
+                return self.exemplars
+            else:
+                return self.tf_exemplars
+
+    def compile(self, alg, exemplar=True, coT=True, tf=True, defn=True):
+        """
+        Builds the CompiledPrompt for a combination of options, cached on the config class, the definition and the
+        exemplar contents (autogenerate_annotations replaces the exemplars of an instance)
+        """
+        e_list = self.exemplar_list(exemplar=exemplar, coT=coT, tf=tf)
+        key = (type(self), alg.chatbot_init, exemplar, coT, tf, self.defn if defn else "",
+               tuple(e_list) if e_list is not None else None)
+        if key in Config.compiled_prompts:
+            return Config.compiled_prompts[key]
+        defn_string = self.defn if defn else ""
+        format_task = None
+        exemplar_task = None
+        whole_task = None
         if not exemplar:
-            alg.exemplar_task = None
             if coT:
                 if tf:
                     whole_task = "Q: Given the paragraph below, identify a list of possible entities " \
                                  "and for each entry explain why it either is or is not an entity. Answer in the format: \n"
 
-                    alg.format_task = whole_task + self.cot_format
+                    format_task = whole_task + self.cot_format
                 else:
                     whole_task = "Q: Given the paragraph below, identify a list of entities " \
                                  "and for each entry explain why it is an entity. Answer in the format: \n"
 
-                    alg.format_task = whole_task + self.no_tf_format
+                    format_task = whole_task + self.no_tf_format
 
             else:
                 whole_task = "Q: Given the paragraph below, identify the list of entities " \
                              "Answer in the format: \n"
 
                 if not tf:
-                    alg.format_task = whole_task + self.exemplar_format
+                    format_task = whole_task + self.exemplar_format
                 else:
-                    alg.format_task = whole_task + self.tf_format
+                    format_task = whole_task + self.tf_format
         else:
-            alg.format_task = None
             if coT:
                 if tf:
                     whole_task = "Q: Given the paragraph below, identify a list of possible entities " \
                                  "and for each entry explain why it either is or is not an entity. \nParagraph:"
-                    alg.whole_task = whole_task
-                    alg.exemplars = self.cot_exemplars
-                    exemplar_construction = ""
-                    for exemplar in self.cot_exemplars:
-                        exemplar_construction = exemplar_construction + whole_task + "\n"
-                        exemplar_construction = exemplar_construction + exemplar + "\n"
-                    exemplar_construction = exemplar_construction + whole_task + "\n"
-                    alg.exemplar_task = exemplar_construction
                 else:
                     whole_task = "Q: Given the paragraph below, identify a list of entities " \
                                  "and for each entry explain why it is an entity. \nParagraph:"
-                    alg.whole_task = whole_task
-                    alg.exemplars = self.no_tf_exemplars
-                    exemplar_construction = ""
-                    for exemplar in self.no_tf_exemplars:
-                        exemplar_construction = exemplar_construction + whole_task + "\n"
-                        exemplar_construction = exemplar_construction + exemplar + "\n"
-                    exemplar_construction = exemplar_construction + whole_task + "\n"
-                    alg.exemplar_task = exemplar_construction
             else:
                 whole_task = "Q: Given the paragraph below, identify the list of entities \nParagraph:"
-                exemplar_construction = ""
-                if not tf:
-                    e_list = self.exemplars
-                else:
-                    e_list = self.tf_exemplars
-                alg.whole_task = whole_task
-                alg.exemplars = e_list
-                for exemplar in e_list:
-                    exemplar_construction = exemplar_construction + whole_task + "\n"
-                    exemplar_construction = exemplar_construction + exemplar + "\n"
-                exemplar_construction = exemplar_construction + whole_task + "\n"
-                alg.exemplar_task = exemplar_construction
+            exemplar_task = "".join([whole_task + "\n" + exemplar + "\n" for exemplar in e_list]) + whole_task + "\n"
+        prompt = CompiledPrompt(alg.chatbot_init, defn_string, exemplar_task, format_task, whole_task, e_list,
+                                answer_format=TokenBudget.answer_format(coT, tf))
+        Config.compiled_prompts[key] = prompt
+        return prompt
 
     def autogenerate_annotations(self, alg, texts, tokens, labels, max_examples=3):
         cot_exemplars = []
@@ -0,0 +1,135 @@
+from collections import Counter
+
+import utils
+
+
+class SpanAligner:
+    """
+    Maps predicted entity phrases onto the words of a paragraph and builds the BIO (or FewNERD) tag list.
+    The paragraph is indexed once and all multi word phrases are located in a single pass over its words with a
+    trie of the phrases, instead of rescanning the paragraph for every answer.
+    Occurrence semantics are the same as the original parse_span: the n-th time a phrase is predicted it is
+    assigned to its n-th occurrence in the paragraph, with the same edge cases (and exceptions)
+    """
+    split_tokens = ["'s", ":"]
+    end = None  # trie key marking that a phrase ends at this node
+
+    def __init__(self, para, true_tokens=None):
+        self.para = para.lower()
+        if true_tokens is not None:
+            self.para_words = [token.lower() for token in true_tokens]
+        else:
+            self.para_words = self.para.split(" ")
+        self.span_pred = ["O" for word in self.para_words]
+        self.completed = Counter()
+        self.word_positions = {}
+        for i, word in enumerate(self.para_words):
+            self.word_positions.setdefault(word, []).append(i)
+        self.occurrences = {}
+        self.substring_counts = {}
+        # joining a window of words only equals a phrase word by word if no word contains a space itself
+        self.spaced_words = any(" " in word for word in self.para_words)
+
+    @staticmethod
+    def normalize(answer):
+        answer = answer.strip().lower()  # take any whitespace out and lowercase for matching
+        if "(" in answer:
+            answer = answer[:answer.find("(")].strip()  # in case some type annotation is stuck here
+        return answer
+
+    @staticmethod
+    def token_split(answer):
+        for token in SpanAligner.split_tokens:
+            answer = (" " + token).join(answer.split(token))
+        return answer
+
+    def index_phrases(self, answers):
+        """
+        Finds every occurrence of every multi word answer (already normalized) in one pass over the paragraph
+        """
+        self.index_word_phrases([tuple(SpanAligner.token_split(answer).split(" ")) for answer in answers
+                                 if len(answer.split(" ")) > 1])
+
+    def index_word_phrases(self, phrases):
+        trie = {}
+        for phrase in phrases:
+            if phrase in self.occurrences:
+                continue
+            self.occurrences[phrase] = []
+            node = trie
+            for word in phrase:
+                node = node.setdefault(word, {})
+            node[SpanAligner.end] = phrase
+        if len(trie) == 0:
+            return
+        n_words = len(self.para_words)
+        for start in range(n_words):
+            node = trie
+            position = start
+            while position < n_words and self.para_words[position] in node:
+                node = node[self.para_words[position]]
+                position += 1
+                if SpanAligner.end in node:
+                    self.occurrences[node[SpanAligner.end]].append(start)
+
+    def substring_count(self, answer):
+        if answer not in self.substring_counts:
+            self.substring_counts[answer] = self.para.count(answer)
+        return self.substring_counts[answer]
+
+    def phrase_positions(self, answer):
+        phrase = tuple(answer.split(" "))  # answer is already token split
+        if phrase not in self.occurrences:
+            self.index_word_phrases([phrase])
+        return self.occurrences[phrase]
+
+    def nth_phrase_position(self, answer, n):
+        if self.spaced_words:
+            return utils.find_nth_list_subset(self.para_words, answer, n)
+        found = self.phrase_positions(answer)
+        if len(found) > n:  # same as utils.find_nth_list_subset
+            return -1
+        else:
+            return found[n-1]
+
+    def tag(self, index, types, begin=True):
+        if "-" in types:  # then its FEWNERD
+            self.span_pred[index] = types
+        elif begin:
+            self.span_pred[index] = "B-" + types
+        else:
+            self.span_pred[index] = "I-" + types
+
+    def add(self, answer, types):
+        """
+        Tags a normalized answer phrase with types (without the brackets), answers must be added in prediction order
+        """
+        answer_token_split = SpanAligner.token_split(answer)
+        exists = answer in self.para or answer_token_split in self.para
+        answer_multi_word = len(answer.split(" ")) > 1
+        if not exists:
+            return
+        if not answer_multi_word:
+            if answer not in self.word_positions:
+                return
+            positions = self.word_positions[answer]
+            multiple = self.substring_count(answer) > 1
+            if not multiple:  # easiest case word should be in para_words only once
+                index = positions[0]
+            else:  # must find which occurance this is
+                n_th = self.completed[answer.strip()] + 1
+                if n_th > len(positions):
+                    raise ValueError(f"{answer} is not in list")  # what list.index raises in utils.find_nth_list
+                index = positions[n_th-1]
+            if self.span_pred[index] == "O":
+                self.tag(index, types)
+            self.completed[answer] += 1
+        else:
+            answer = answer_token_split
+            n_th = self.completed[answer.strip()] + 1
+            index = self.nth_phrase_position(answer, n_th)
+            end_index = index + len(answer.split(" "))
+            self.tag(index, types)
+            for j in range(index+1, end_index):
+                self.tag(j, types, begin=False)
+            self.completed[answer] += 1
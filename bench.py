@@ -0,0 +1,1725 @@
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import openai
+import pandas as pd
+
+
+class FakeCompletionServer:
+    """
+    Local stand in for the OpenAI completion endpoints so throughput can be measured offline.
+    Every request sleeps for latency seconds and then answers with a numbered list that marks each capitalised
+    word of the paragraph as an entity (followed by trailing, if set), cut off at the request's max_tokens. Streamed requests get the answer as server
+    sent events of chunk_size characters, token_latency seconds apart. Point the openai library at it with
+    use_fake_server
+    """
+    def __init__(self, latency=0.5, host="127.0.0.1", port=0, token_latency=0.0, chunk_size=4, trailing=""):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.chunk_size = chunk_size
+        self.trailing = trailing
+        self.n_chunks = 0
+        self.n_requests = 0
+        self.request_times = []
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                with server.lock:
+                    server.n_requests += 1
+                    server.request_times.append(time.monotonic())
+                time.sleep(server.latency)
+                response = server.respond(self.path, body)
+                if body.get("stream"):
+                    self.stream(response)
+                    return
+                if server.token_latency > 0:  # the whole answer is ready when its last chunk would have been
+                    choice = response["choices"][0]
+                    text = choice["message"]["content"] if "message" in choice else choice["text"]
+                    time.sleep(server.token_latency * -(-len(text) // server.chunk_size))
+                payload = json.dumps(response).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def stream(self, response):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                choice = response["choices"][0]
+                text = choice["message"]["content"] if "message" in choice else choice["text"]
+                try:
+                    for start in range(0, len(text), server.chunk_size):
+                        piece = text[start:start+server.chunk_size]
+                        if "message" in choice:
+                            chunk = {"index": 0, "delta": {"content": piece}, "finish_reason": None}
+                        else:
+                            chunk = {"index": 0, "text": piece, "finish_reason": None}
+                        event = {"id": "fake", "object": response["object"], "choices": [chunk]}
+                        self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+                        self.wfile.flush()
+                        with server.lock:
+                            server.n_chunks += 1
+                        time.sleep(server.token_latency)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):  # the client stopped reading
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @staticmethod
+    def answer(text):
+        packed = re.findall(r"\nParagraph (\d+): (.*)", text)
+        if len(packed) > 0:
+            blocks = [f"Answer {number}:\n" + FakeCompletionServer.answer_para(para) for number, para in packed]
+            return "\n\n".join(blocks)[len("Answer 1:"):]  # the prompt already ends with 'Answer 1:'
+        para = text.split("Paragraph:")[-1].split("Answer:")[0]
+        return FakeCompletionServer.answer_para(para)
+
+    @staticmethod
+    def answer_para(para):
+        lines = []
+        for word in para.strip().strip("'").strip().split(" "):
+            if word[:1].isupper():
+                lines.append(f"{len(lines)+1}. {word} | True | as it is a name (PER)")
+        return "\n".join(lines)
+
+    @staticmethod
+    def limit(text, max_tokens):
+        """
+        text cut to max_tokens (counted like estimate_tokens) and its finish_reason
+        """
+        if max_tokens is not None and len(text) > 4 * max_tokens:
+            return text[:4 * max_tokens], "length"
+        return text, "stop"
+
+    def respond(self, path, body):
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        if "chat" in path:
+            text = FakeCompletionServer.answer(body["messages"][-1]["content"]) + self.trailing
+            text, finish_reason = FakeCompletionServer.limit(text, body.get("max_tokens"))
+            choice = {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": finish_reason}
+            return {"id": "fake", "object": "chat.completion", "model": body.get("model"), "choices": [choice],
+                    "usage": usage}
+        else:
+            text = FakeCompletionServer.answer(body["prompt"]) + self.trailing
+            text, finish_reason = FakeCompletionServer.limit(text, body.get("max_tokens"))
+            choice = {"index": 0, "text": text, "finish_reason": finish_reason}
+            return {"id": "fake", "object": "text_completion", "model": body.get("model"), "choices": [choice],
+                    "usage": usage}
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def require(same, what):
+    """
+    Ends a benchmark with a non-zero exit status when one of its equivalence checks fails
+    """
+    if not same:
+        raise SystemExit(f"bench check failed: {what}")
+
+
+def use_fake_server(server):
+    openai.api_base = server.url
+    openai.api_key = openai.api_key or "fake"
+
+
+def toy_dataset(n_rows=50):
+    texts = [f"Mr Smith met Jane Doe in Paris on day {i} ." for i in range(n_rows)]
+    exact_types = [["O", "B-PER", "O", "B-PER", "I-PER", "O", "B-LOC", "O", "O", "O", "O"] for _ in range(n_rows)]
+    entities = [["Smith", "Jane Doe", "Paris"] for _ in range(n_rows)]
+    return pd.DataFrame({"text": texts, "entities": entities, "exact_types": exact_types})
+
+
+def bench_async_openai(n_rows=50, latency=0.5, concurrencies=(None, 4, 16), requests_per_minute=6000):
+    """
+    Runs eval_dataset over a toy dataset against the fake server, serially and with several concurrency levels
+    """
+    from algorithms import Algorithm, ConllConfig
+    from models import AsyncOpenAIGPT, OpenAIGPT
+    from ratelimit import RateLimiter
+    from run import eval_dataset
+
+    val = toy_dataset(n_rows)
+    timings = {}
+    preds = {}
+    with FakeCompletionServer(latency=latency) as server:
+        use_fake_server(server)
+        for concurrency in concurrencies:
+            OpenAIGPT.rate_limiter = RateLimiter(requests_per_minute=requests_per_minute, tokens_per_minute=None)
+            algorithm = Algorithm()
+            ConllConfig().set_config(algorithm, exemplar=True, coT=True, tf=True)
+            start = time.perf_counter()
+            f1_micro, f1_macro, df = eval_dataset(val, AsyncOpenAIGPT(), algorithm, print_every=None,
+                                                  concurrency=concurrency)
+            timings[concurrency] = time.perf_counter() - start
+            preds[concurrency] = (f1_micro, f1_macro, df["pred"].tolist())
+            print(f"concurrency {concurrency}: {timings[concurrency]:.2f}s for {n_rows} rows "
+                  f"({n_rows / timings[concurrency]:.1f} rows/s), micro f1 {f1_micro}")
+    require(all(pred == preds[concurrencies[0]] for pred in preds.values()), "predictions of the concurrency levels")
+    return timings
+
+
+def bench_rate_limiter(n_rows=20, latency=0.2, requests_per_minute=300):
+    """
+    Compares the old fixed sleep before every query with the RateLimiter at the same requests per minute budget.
+    The sleep adds the full interval on top of the response latency, the limiter only waits for what is left of it
+    """
+    from algorithms import Algorithm, ConllConfig
+    from models import OpenAIGPT
+    from ratelimit import RateLimiter
+    from run import eval_dataset
+
+    val = toy_dataset(n_rows)
+    interval = 60 / requests_per_minute
+    timings = {}
+    preds = {}
+    with FakeCompletionServer(latency=latency) as server:
+        use_fake_server(server)
+        for name in ["fixed sleep", "rate limiter"]:
+            if name == "fixed sleep":
+                OpenAIGPT.rate_limiter = RateLimiter(requests_per_minute=10 ** 6, tokens_per_minute=None)
+                sleep_between_queries = interval
+            else:
+                OpenAIGPT.rate_limiter = RateLimiter(requests_per_minute=requests_per_minute, tokens_per_minute=None)
+                sleep_between_queries = None
+            algorithm = Algorithm()
+            ConllConfig().set_config(algorithm, exemplar=True, coT=True, tf=True)
+            start = time.perf_counter()
+            f1_micro, f1_macro, df = eval_dataset(val, OpenAIGPT(), algorithm,
+                                                  sleep_between_queries=sleep_between_queries, print_every=None)
+            timings[name] = time.perf_counter() - start
+            preds[name] = df["pred"].tolist()
+            print(f"{name}: {timings[name]:.2f}s for {n_rows} rows, budget allows {n_rows * interval:.2f}s minimum")
+    require(preds["fixed sleep"] == preds["rate limiter"], "predictions with the fixed sleep and the rate limiter")
+    return timings
+
+
+def bench_response_cache(n_rows=20, latency=0.3, path="cache/bench_responses.sqlite"):
+    """
+    Runs the same evaluation twice through a CachedModel, the replay is answered entirely from disk
+    """
+    from algorithms import Algorithm, ConllConfig
+    from cache import CachedModel, ResponseCache
+    from models import OpenAIGPT
+    from ratelimit import RateLimiter
+    from run import eval_dataset
+
+    val = toy_dataset(n_rows)
+    cache = ResponseCache(path)
+    cache.clear()
+    timings = {}
+    preds = {}
+    requests = {}
+    with FakeCompletionServer(latency=latency) as server:
+        use_fake_server(server)
+        OpenAIGPT.rate_limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=None)
+        for name in ["first run", "replay"]:
+            algorithm = Algorithm()
+            ConllConfig().set_config(algorithm, exemplar=True, coT=True, tf=True)
+            start = time.perf_counter()
+            f1_micro, f1_macro, df = eval_dataset(val, CachedModel(OpenAIGPT(), cache), algorithm, print_every=None)
+            timings[name] = time.perf_counter() - start
+            preds[name] = df["pred"].tolist()
+            requests[name] = server.n_requests
+            print(f"{name}: {timings[name]:.2f}s, {server.n_requests} requests reached the server, {cache.stats()}")
+    require(preds["first run"] == preds["replay"], "predictions of the first run and the replay")
+    require(requests["replay"] == requests["first run"], "server requests of the first run and the replay")
+    return timings
+
+
+def bench_batched_generation(model=None, n_rows=32, batch_sizes=(None, 4, 16)):
+    """
+    Times eval_dataset with a local seq2seq model one row at a time against batched generation,
+    defaults to flan-t5-small on the cpu so no gpu is needed
+    """
+    from algorithms import Algorithm, ConllConfig
+    from run import eval_dataset
+    import utils
+
+    if model is None:
+        from models import T5
+        utils.Parameters.devices = ["cpu"]
+        model = T5(size="small")
+    val = toy_dataset(n_rows)
+    timings = {}
+    preds = {}
+    for batch_size in batch_sizes:
+        algorithm = Algorithm()
+        ConllConfig().set_config(algorithm, exemplar=True, coT=True, tf=True)
+        start = time.perf_counter()
+        f1_micro, f1_macro, df = eval_dataset(val, model, algorithm, print_every=None, batch_size=batch_size)
+        timings[batch_size] = time.perf_counter() - start
+        preds[batch_size] = df["pred"].tolist()
+        print(f"batch size {batch_size}: {timings[batch_size]:.2f}s for {n_rows} rows")
+    require(all(pred == preds[batch_sizes[0]] for pred in preds.values()), "predictions of the batch sizes")
+    return timings
+
+
+def bench_prefix_reuse(model=None, n_rows=20, config=None):
+    """
+    Per sentence latency of a local seq2seq model with and without reusing the tokenized exemplar prefix,
+    reported for the tokenization alone and for the full query
+    """
+    from algorithms import Algorithm, ConllConfig
+    import utils
+
+    if model is None:
+        from models import T5
+        utils.Parameters.devices = ["cpu"]
+        model = T5(size="small")
+    if config is None:
+        config = ConllConfig()
+    algorithm = Algorithm(model_fn=model)
+    config.set_config(algorithm, exemplar=True, coT=True, tf=True)
+    prompts = []
+    for para in toy_dataset(n_rows)["text"]:
+        algorithm.set_para(para)
+        prompts.append(algorithm.single_query_input())
+    print(f"prefix is {len(prompts[0].prefix)} characters, suffix {len(prompts[0].suffix)} characters")
+    timings = {}
+    encoded = {}
+    outputs = {}
+    for reuse_prefix in [False, True]:
+        model.reuse_prefix = reuse_prefix
+        model.encode(prompts[0])  # the first call tokenizes and verifies the prefix
+        start = time.perf_counter()
+        encoded[reuse_prefix] = [model.encode(prompt) for prompt in prompts]
+        encode_time = (time.perf_counter() - start) / n_rows
+        start = time.perf_counter()
+        outputs[reuse_prefix] = [model(prompt) for prompt in prompts]
+        query_time = (time.perf_counter() - start) / n_rows
+        timings[reuse_prefix] = (encode_time, query_time)
+        print(f"reuse prefix {reuse_prefix}: tokenize {encode_time * 1000:.2f}ms, "
+              f"query {query_time * 1000:.1f}ms per sentence")
+    require(encoded[False] == encoded[True], "token ids with and without prefix reuse")
+    require(outputs[False] == outputs[True], "outputs with and without prefix reuse")
+    return timings
+
+
+def bench_packing(n_rows=40, latency=0.5, token_budgets=(None, 1500, 3000)):
+    """
+    Number of requests, wall time and f1 of eval_dataset with and without packing several paragraphs per request
+    """
+    from algorithms import Algorithm, ConllConfig
+    from models import OpenAIGPT
+    from ratelimit import RateLimiter
+    from run import eval_dataset
+
+    val = toy_dataset(n_rows)
+    results = {}
+    preds = {}
+    with FakeCompletionServer(latency=latency) as server:
+        use_fake_server(server)
+        OpenAIGPT.rate_limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=None)
+        for token_budget in token_budgets:
+            algorithm = Algorithm()
+            ConllConfig().set_config(algorithm, exemplar=True, coT=True, tf=True)
+            n_requests = server.n_requests
+            start = time.perf_counter()
+            f1_micro, f1_macro, df = eval_dataset(val, OpenAIGPT(), algorithm, print_every=None,
+                                                  pack_token_budget=token_budget)
+            elapsed = time.perf_counter() - start
+            results[token_budget] = (server.n_requests - n_requests, elapsed, f1_micro)
+            preds[token_budget] = df["pred"].tolist()
+            print(f"token budget {token_budget}: {results[token_budget][0]} requests, {elapsed:.2f}s, "
+                  f"micro f1 {f1_micro}")
+    require(all(pred == preds[token_budgets[0]] for pred in preds.values()), "predictions packed and unpacked")
+    return results
+
+
+def bench_prompt_render(n_rows=2000, chat=True):
+    """
+    Per row cost of building the request for a paragraph from the compiled prompt installed by set_config,
+    against rebuilding it from the task strings every time (what happens when no compiled prompt is installed)
+    """
+    from algorithms import Algorithm, ConllConfig
+
+    algorithm = Algorithm()
+    ConllConfig().set_config(algorithm, exemplar=True, coT=True, tf=True)
+    texts = toy_dataset(n_rows)["text"]
+    render = algorithm.chat_query_input if chat else algorithm.single_query_input
+    timings = {}
+    rendered = {}
+    for name in ["rebuilt", "compiled"]:
+        prompt = algorithm.prompt
+        if name == "rebuilt":
+            algorithm.prompt = None
+        rendered[name] = []
+        start = time.perf_counter()
+        for para in texts:
+            algorithm.set_para(para)
+            rendered[name].append(render())
+        timings[name] = (time.perf_counter() - start) / n_rows
+        algorithm.prompt = prompt
+        print(f"{name}: {timings[name] * 10 ** 6:.1f}us per row")
+    print(f"compiled prompt is ~{algorithm.prompt.n_tokens(chat=chat)} tokens before the paragraph")
+    require(rendered["rebuilt"] == rendered["compiled"], "rebuilt and compiled requests")
+    return timings
+
+
+def reference_parse_span(para, answers, typestrings, true_tokens=None):
+    """
+    The original quadratic Algorithm.parse_span, kept to check SpanAligner against
+    """
+    import utils
+
+    para = para.lower()
+    if true_tokens is not None:
+        para_words = [token.lower() for token in true_tokens]
+    else:
+        para_words = para.split(" ")
+    span_pred = ["O" for word in para_words]
+    completed_answers = []
+    split_tokens = ["'s", ":"]
+    for i, answer in enumerate(answers):
+        answer = answer.strip().lower()
+        if "(" in answer:
+            answer = answer[:answer.find("(")].strip()
+        types = typestrings[i]
+        if "(" in types and ")" in types:
+            types = types[types.find("(") + 1:types.find(")")]
+        else:
+            continue
+        answer_token_split = answer
+        for token in split_tokens:
+            answer_token_split = (" "+token).join(answer_token_split.split(token))
+        exists = answer in para or answer_token_split in para
+        answer_multi_word = len(answer.split(" ")) > 1
+        if not exists:
+            continue
+        if not answer_multi_word:
+            if answer not in para_words:
+                continue
+            multiple = para.count(answer) > 1
+            if not multiple:
+                index = para_words.index(answer)
+            else:
+                n_th = completed_answers.count(answer.strip()) + 1
+                index = utils.find_nth_list(para_words, answer, n_th)
+            if span_pred[index] == "O":
+                if "-" in types:
+                    span_pred[index] = types
+                else:
+                    span_pred[index] = "B-" + types
+            completed_answers.append(answer)
+        else:
+            for token in split_tokens:
+                if token in answer:
+                    answer = (" "+token).join(answer.split(token))
+            answer_words = answer.split(" ")
+            n_th = completed_answers.count(answer.strip()) + 1
+            index = utils.find_nth_list_subset(para_words, answer, n_th)
+            end_index = index + len(answer_words)
+            if "-" in types:
+                span_pred[index] = types
+            else:
+                span_pred[index] = "B-" + types
+            for j in range(index+1, end_index):
+                if "-" in types:
+                    span_pred[j] = types
+                else:
+                    span_pred[j] = "I-" + types
+            completed_answers.append(answer)
+    return span_pred
+
+
+def load_shipped_predictions(results_dir="results"):
+    """
+    (file, paragraph, model output) for every row of the shipped results/*.csv files
+    """
+
+    rows = []
+    for filename in sorted(os.listdir(results_dir)):
+        if not filename.endswith(".csv"):
+            continue
+        df = pd.read_csv(os.path.join(results_dir, filename))
+        for text, meta in zip(df["text"], df["meta"]):
+            rows.append((filename, text, meta if isinstance(meta, str) else ""))
+    return rows
+
+
+def bench_span_alignment(repeats=5, scale=1):
+    """
+    Aligns the model answers of every shipped result row with the reference parse_span and with SpanAligner,
+    checks that both give the same tags (or raise the same exception) and times them.
+    scale > 1 repeats each paragraph and answer list that many times to look at long sentences
+    """
+    from algorithms import Algorithm
+    from utils import AnswerMapping
+
+    cases = []
+    for filename, text, meta in load_shipped_predictions():
+        answers, typestrings = AnswerMapping.exemplar_format_list(meta, identify_types=True, verbose=False)
+        cases.append((" ".join([text] * scale), answers * scale, typestrings * scale))
+
+    def outcome(fn, *args):
+        try:
+            return fn(*args)
+        except Exception as e:
+            return type(e).__name__
+
+    algorithm = Algorithm()
+
+    def new_parse(para, answers, typestrings):
+        algorithm.set_para(para)
+        return algorithm.parse_span(answers, typestrings, None)[0]
+
+    mismatches = 0
+    for case in cases:
+        if outcome(reference_parse_span, *case) != outcome(new_parse, *case):
+            mismatches += 1
+    timings = {}
+    for name, fn in [("reference", reference_parse_span), ("SpanAligner", new_parse)]:
+        start = time.perf_counter()
+        for i in range(repeats):
+            for case in cases:
+                outcome(fn, *case)
+        timings[name] = (time.perf_counter() - start) / repeats
+        print(f"{name}: {timings[name] * 1000:.1f}ms for {len(cases)} rows")
+    print(f"{mismatches} rows differ out of {len(cases)}")
+    require(mismatches == 0, "reference and SpanAligner tags")
+    return timings, mismatches
+
+
+def reference_clean_output(answers, typestrings=None):
+    """
+    The original BaseAlgorithm.clean_output, which reads the stopword corpus for every answer
+    """
+    import string
+    from nltk.corpus import stopwords
+
+    if typestrings is None:
+        answers = list(set(answers))
+        for trivial in ["", " ", ".", "-"] + stopwords.words('english'):
+            while trivial in answers:
+                answers.remove(trivial)
+    else:
+        new_answers = []
+        new_typestrings = []
+        for i, ans in enumerate(answers):
+            if ans in new_answers:
+                continue
+            if ans in ["", " ", ".", "-"] + stopwords.words('english'):
+                continue
+            new_answers.append(ans)
+            new_typestrings.append(typestrings[i])
+    for i in range(len(answers)):
+        ans = answers[i]
+        if "(" in ans:
+            ans = ans[:ans.find("(")]
+        ans = ans.strip().strip(''.join(string.punctuation)).strip()
+        answers[i] = ans
+    if typestrings is None:
+        return answers
+    else:
+        return answers, typestrings
+
+
+def bench_clean_output(n_top=8):
+    """
+    Profiles clean_output over the answers of every shipped result row, with and without types, for the
+    reference implementation and the cached stopword set, and checks both give the same output
+    """
+    import cProfile
+    import pstats
+    from algorithms import BaseAlgorithm
+    from utils import AnswerMapping
+
+    parsed = []
+    for filename, text, meta in load_shipped_predictions():
+        parsed.append(AnswerMapping.exemplar_format_list(meta, identify_types=True, verbose=False))
+
+    def reference_pass():
+        outputs = []
+        for answers, typestrings in parsed:
+            outputs.append(sorted(reference_clean_output(list(answers))))
+            outputs.append(reference_clean_output(list(answers), list(typestrings)))
+        return outputs
+
+    def new_pass():
+        outputs = []
+        for answers, typestrings in parsed:
+            outputs.append(sorted(BaseAlgorithm.clean_output(list(answers))))
+            outputs.append(BaseAlgorithm.clean_output(list(answers), list(typestrings)))
+        return outputs
+
+    results = {}
+    for name, fn in [("reference", reference_pass), ("cached stopwords", new_pass)]:
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        results[name] = fn()
+        profiler.disable()
+        print(f"{name}: {(time.perf_counter() - start) * 1000:.1f}ms for {len(parsed)} rows")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(n_top)
+    print(f"same output: {results['reference'] == results['cached stopwords']}")
+    require(results["reference"] == results["cached stopwords"], "reference and cached stopword clean_output")
+    return results
+
+
+def bench_incremental_metrics(scale=1, print_every=10):
+    """
+    Scores the truth / pred columns of every shipped result file the way eval_dataset used to (seqeval over the
+    whole history after every row) and with SpanMetrics, checks the final micro / macro f1 agree and times both.
+    scale > 1 repeats the rows that many times
+    """
+    import ast
+    import warnings
+    from seqeval.metrics import f1_score
+    from metrics import SpanMetrics
+
+    warnings.simplefilter("ignore")  # seqeval warns on every ill defined precision / recall
+    for filename in sorted(os.listdir("results")):
+        if not filename.endswith(".csv"):
+            continue
+        df = pd.read_csv(os.path.join("results", filename))
+        truths = [ast.literal_eval(item) for item in df["truth"]] * scale
+        preds = [ast.literal_eval(item) for item in df["pred"]] * scale
+
+        start = time.perf_counter()
+        history_t, history_p = [], []
+        for i, (t, p) in enumerate(zip(truths, preds)):
+            history_t.append(t)
+            history_p.append(p)
+            f1_score([t], [p])
+            f1_score(history_t, history_p, average="micro")
+            if i % print_every == 0:
+                f1_score(history_t, history_p, average="macro")
+        reference = (f1_score(history_t, history_p, average="micro"), f1_score(history_t, history_p, average="macro"))
+        reference_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        metrics = SpanMetrics()
+        for i, (t, p) in enumerate(zip(truths, preds)):
+            metrics.add(t, p)
+            if i % print_every == 0:
+                metrics.micro_f1(), metrics.macro_f1()
+        incremental = (metrics.micro_f1(), metrics.macro_f1())
+        incremental_time = time.perf_counter() - start
+        print(f"{filename} ({len(truths)} rows): seqeval {reference_time:.3f}s, SpanMetrics {incremental_time:.3f}s, "
+              f"same scores: {reference == incremental}")
+        require(reference == incremental, f"seqeval and SpanMetrics scores of {filename}")
+
+
+def bench_resume(n_rows=30, crash_after=6, latency=0.05, concurrency=None, path="checkpoints/bench_resume.jsonl"):
+    """
+    Runs complete_eval with a checkpoint against the fake server, stops it with a quota error after crash_after
+    requests, resumes and checks the resumed scores equal an uninterrupted run and how many requests were repeated
+    """
+    import numpy as np
+    from algorithms import Algorithm, ConllConfig
+    from checkpoint import Checkpoint
+    from models import AsyncOpenAIGPT, OpenAIGPT
+    from ratelimit import RateLimiter
+    from run import complete_eval
+
+    class QuotaModel(AsyncOpenAIGPT):
+        quota = None
+
+        def check_quota(self):
+            if QuotaModel.quota is not None:
+                if QuotaModel.quota <= 0:
+                    raise openai.error.RateLimitError("You exceeded your current quota")
+                QuotaModel.quota -= 1
+
+        def __call__(self, inputs):
+            self.check_quota()
+            return super().__call__(inputs)
+
+        async def acall(self, inputs):
+            self.check_quota()
+            return await super().acall(inputs)
+
+    def evaluate(checkpoint):
+        OpenAIGPT.rate_limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=None, max_retries=0)
+        algorithm = Algorithm()
+        ConllConfig().set_config(algorithm, exemplar=True, coT=True, tf=True)
+        np.random.seed(0)
+        micros, macros, df = complete_eval(val, QuotaModel(), algorithm, n_runs=1, limit=n_rows // 2,
+                                           print_every=None, concurrency=concurrency, checkpoint=checkpoint)
+        return micros[0], macros[0]
+
+    val = toy_dataset(n_rows)
+    with FakeCompletionServer(latency=latency) as server:
+        use_fake_server(server)
+        reference = evaluate(None)
+        reference_requests = server.n_requests
+        server.n_requests = 0
+        QuotaModel.quota = crash_after
+        try:
+            evaluate(Checkpoint(path, resume=False))
+        except openai.error.RateLimitError as e:
+            print(f"stopped after {server.n_requests} requests: {e}")
+        logged = len(Checkpoint(path).rows.get(0, {}))
+        print(f"{logged} rows in the checkpoint")
+        require(logged == server.n_requests, "rows answered and rows logged before the crash")
+        QuotaModel.quota = None
+        resumed = evaluate(Checkpoint(path, resume=True))
+    print(f"uninterrupted: {reference_requests} requests, interrupted + resumed: {server.n_requests} requests")
+    print(f"same scores: {reference == resumed} {reference} {resumed}")
+    require(reference == resumed, "uninterrupted and resumed scores")
+    require(server.n_requests == reference_requests, "requests of the uninterrupted and resumed runs")
+    return reference, resumed
+
+
+def sweep_toy_job(url, n_rows, latency):
+    """
+    One sweep job for bench_sweep: evaluates a toy dataset against an already running fake server
+    """
+    from algorithms import Algorithm, ConllConfig
+    from models import OpenAIGPT
+    from run import eval_dataset
+
+    openai.api_base = url
+    openai.api_key = openai.api_key or "fake"
+    algorithm = Algorithm()
+    ConllConfig().set_config(algorithm, exemplar=True, coT=True, tf=True)
+    f1_micro, f1_macro, df = eval_dataset(toy_dataset(n_rows), OpenAIGPT(), algorithm, print_every=None)
+    return f1_micro, f1_macro
+
+
+def bench_sweep(n_jobs=8, n_rows=10, latency=0.5, worker_counts=(1, 4), requests_per_minute=600):
+    """
+    Runs n_jobs toy evaluations through sweep.sweep with different pool sizes, all workers share one
+    requests_per_minute budget, reports the time and the request rate the server actually saw
+    """
+    from sweep import sweep
+
+    with FakeCompletionServer(latency=latency) as server:
+        for n_workers in worker_counts:
+            server.n_requests = 0
+            server.request_times = []
+            jobs = [dict(url=server.url, n_rows=n_rows, latency=latency) for i in range(n_jobs)]
+            start = time.perf_counter()
+            results = sweep(jobs, n_workers=n_workers, requests_per_minute=requests_per_minute,
+                            tokens_per_minute=None, fn=sweep_toy_job)
+            elapsed = time.perf_counter() - start
+            # workers spend their first seconds importing, time the requests from the first to the last one
+            span = server.request_times[-1] - server.request_times[0]
+            print(f"{n_workers} workers: {elapsed:.2f}s for {n_jobs} jobs, {server.n_requests} requests in "
+                  f"{span:.2f}s ({(server.n_requests - 1) / span * 60:.0f} per minute, budget "
+                  f"{requests_per_minute}), same scores: {len(set(results)) == 1}")
+            require(len(set(results)) == 1, f"scores of the {n_workers} worker sweep jobs")
+
+
+def shipped_dataset(filename="conllNone.csv"):
+    """
+    The rows of a shipped results file as an evaluation dataset (text, entities, exact_types)
+    """
+    import ast
+
+    df = pd.read_csv(f"results/{filename}")
+    return pd.DataFrame({"text": df["text"], "entities": df["entities"].apply(ast.literal_eval),
+                         "exact_types": df["truth"].apply(ast.literal_eval)})
+
+
+def shard_job(url, index, n_shards, limit, root):
+    """
+    One shard of bench_shards, run in its own process
+    """
+    from algorithms import Algorithm, ConllConfig
+    from models import OpenAIGPT
+    from ratelimit import RateLimiter
+    from run import complete_eval
+    from shard import Shard
+
+    openai.api_base = url
+    openai.api_key = openai.api_key or "fake"
+    OpenAIGPT.rate_limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=None)
+    algorithm = Algorithm()
+    ConllConfig().set_config(algorithm, exemplar=True, coT=True, tf=True)
+    shard = Shard(index, n_shards, "bench_shards", seed=0, root=root)
+    complete_eval(shipped_dataset(), OpenAIGPT(), algorithm, n_runs=2, limit=limit, print_every=None,
+                  shard=shard)
+    shard.save()
+
+
+def bench_shards(n_shards=3, limit=60, latency=0.05, root="/tmp/bench_shards"):
+    """
+    Evaluates the shipped conll rows unsharded and as n_shards local processes against the fake server, merges the
+    shards and checks the merged micro / macro f1 of every run equal the unsharded ones
+    """
+    import subprocess
+    import sys
+    from run import complete_eval
+    from shard import merge_shards
+
+    with FakeCompletionServer(latency=latency) as server:
+        start = time.perf_counter()
+        processes = [subprocess.Popen([sys.executable, "-c", f"import bench; bench.shard_job({server.url!r}, {index}, "
+                                       f"{n_shards}, {limit}, {root!r})"], stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.DEVNULL) for index in range(n_shards)]
+        for process in processes:
+            require(process.wait() == 0, "shard process exit status")
+        print(f"{n_shards} shards: {time.perf_counter() - start:.2f}s, {server.n_requests} requests")
+        micros, macros = merge_shards("bench_shards", n_shards, root=root, results_dir=root)
+
+        from algorithms import Algorithm, ConllConfig
+        from models import OpenAIGPT
+        from ratelimit import RateLimiter
+
+        use_fake_server(server)
+        OpenAIGPT.rate_limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=None)
+        algorithm = Algorithm()
+        ConllConfig().set_config(algorithm, exemplar=True, coT=True, tf=True)
+        dataset = shipped_dataset()
+        reference_micros, reference_macros = [], []
+        for run in range(2):
+            f1_micros, f1_macros, df = complete_eval(dataset.sample(limit, random_state=run), OpenAIGPT(), algorithm,
+                                                     n_runs=1, print_every=None)
+            reference_micros.extend(f1_micros)
+            reference_macros.extend(f1_macros)
+    print(f"same scores: {list(micros) == reference_micros and list(macros) == reference_macros}")
+    require(list(micros) == reference_micros and list(macros) == reference_macros, "merged and unsharded scores")
+    return micros, macros
+
+
+def bench_dataset_cache(paths=("data/FewNERD/inter/test.txt", "data/FewNERD/inter/dev.txt",
+                               "data/Genia/sampletest1.iob2"), repeats=3):
+    """
+    Times parsing each IOB2 file against loading it from its ColumnStore and checks both give the same DataFrame
+    """
+    from data import parse_ob2, read_ob2
+
+    for path in paths:
+        start = time.perf_counter()
+        for i in range(repeats):
+            reference = parse_ob2(path)
+        parse_time = (time.perf_counter() - start) / repeats
+        read_ob2(path)  # makes sure the store exists
+        start = time.perf_counter()
+        for i in range(repeats):
+            cached = read_ob2(path)
+        cached_time = (time.perf_counter() - start) / repeats
+        same = all(reference[column].tolist() == cached[column].tolist() for column in reference.columns)
+        same = same and list(reference.columns) == list(cached.columns)
+        print(f"{path} ({len(reference)} sentences): parse {parse_time:.3f}s, cached {cached_time:.3f}s, "
+              f"same: {same}")
+        require(same, f"parsed and cached DataFrames of {path}")
+
+
+def reference_read_ob2(file_path):
+    """
+    The original read_ob2, which reads the whole file with readlines and grows each sentence by concatenation
+    """
+    with open(file_path) as file:
+        lines = file.readlines()
+    sentences = []
+    entities = []
+    types = []
+    exact_types = []
+    data = []
+    sub_entities = []
+    sub_types = {}
+    sub_exact_types = []
+    words = ""
+    curr_entity = ""
+    curr_type = None
+
+    for i, line in enumerate(lines):
+        if line.strip() == "" or line == "\n" or i == len(lines)-1:
+            # save entity if it exists
+            if curr_type is not None:
+                sub_entities.append(curr_entity.strip())
+                sub_types[curr_entity.strip()] = curr_type
+                curr_entity = ""
+                curr_type = None
+            if words != "":
+                sentences.append(words)
+                entities.append(sub_entities)
+                types.append(sub_types)
+                exact_types.append(sub_exact_types)
+                data.append([words, sub_entities, sub_types, sub_exact_types])
+            sub_entities = []
+            sub_types = {}
+            sub_exact_types = []
+            words = ""
+            curr_entity = ""
+            curr_type = None
+        else:
+            word, tag = line.split("\t")
+            if words == "":
+                words = word
+            else:
+                words = words + " " + word
+            sub_exact_types.append(tag.strip())
+            if tag.split() == "O" or "-" not in tag:  # if there was an entity before this then add it in full
+                if curr_type is not None:
+                    sub_entities.append(curr_entity.strip())
+                    sub_types[curr_entity.strip()] = curr_type
+                curr_entity = ""
+                curr_type = None
+            elif "B-" in tag or "I-" in tag:
+                if "B-" in tag:
+                    if curr_type is not None:
+                        sub_entities.append(curr_entity.strip())
+                        sub_types[curr_entity.strip()] = curr_type
+                    curr_entity = word
+                    curr_type = tag.split("-")[1].strip()
+                else:  # I- in tag
+                    if curr_type is None:
+                        print(f"Should not be happening bug here")
+                    curr_entity = curr_entity + " " + word
+            else:
+                main_type, subtype = tag.split("-")  # must assume that if curr_type is not None then its the same one because FewNERD doesn't contain B, I information
+                if subtype.strip() == "government/governmentagency":
+                    subtype = "government"
+                if curr_type is None:
+                    curr_entity = word
+                    curr_type = main_type + "-" + subtype.strip()  # can change to make it subtype if we want
+                else:
+                    curr_entity = curr_entity + " " + word
+
+    df = pd.DataFrame(columns=["text", "entities", "types", "exact_types"], data=data)
+    return df
+
+
+def write_synthetic_ob2(path, size_mb=300, sentence_length=60, seed=0):
+    """
+    Writes a random IOB2 file of about size_mb megabytes mixing BIO and FewNERD style tags
+    """
+    import random
+
+    rng = random.Random(seed)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    bio = ["PER", "LOC", "ORG"]
+    fewnerd = ["person-actor", "location-GPE", "organization-government/governmentagency"]
+    size = 0
+    with open(path, "w") as f:
+        while size < size_mb * 2 ** 20:
+            fewnerd_style = rng.random() < 0.5
+            tags = []
+            while len(tags) < sentence_length:
+                if rng.random() < 0.7:
+                    tags.append("O")
+                    continue
+                length = rng.randint(1, 3)
+                if fewnerd_style:
+                    tags.extend([rng.choice(fewnerd)] * length)
+                else:
+                    entity_type = rng.choice(bio)
+                    tags.extend(["B-" + entity_type] + ["I-" + entity_type] * (length - 1))
+            lines = [f"{rng.choice(vocabulary)}\t{tag}\n" for tag in tags[:sentence_length]]
+            block = "".join(lines) + "\n"
+            f.write(block)
+            size += len(block)
+
+
+def bench_stream_ob2(size_mb=300, reference_mb=20, path="/tmp/synthetic.iob2", reference_path="/tmp/synthetic_small.iob2"):
+    """
+    Streams a size_mb synthetic IOB2 file with stream_ob2 in a fresh process and reports time and peak memory,
+    then compares stream_ob2 with the original reader (which holds the whole file) on a reference_mb file
+    """
+    import subprocess
+    import sys
+
+    def measure(setup, code):
+        # VmHWM is the peak of this process only, ru_maxrss would also count the parent's memory before exec
+        script = f"import re, time\n{setup}\nstart = time.perf_counter()\n{code}\n" \
+                 f"peak = re.search(r'VmHWM:\\s+(\\d+)', open('/proc/self/status').read()).group(1)\n" \
+                 f"print(time.perf_counter() - start, int(peak) / 1024)"
+        output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+        elapsed, peak = output.split()[-2:]
+        return float(elapsed), float(peak)
+
+    if not os.path.exists(path):
+        write_synthetic_ob2(path, size_mb=size_mb)
+    if not os.path.exists(reference_path):
+        write_synthetic_ob2(reference_path, size_mb=reference_mb)
+    setup = "from data import stream_ob2, parse_ob2\nfrom bench import reference_read_ob2"
+    stream = "n = sum(1 for sentence in stream_ob2({!r}))"
+    reference = "df = reference_read_ob2({!r})"
+    parse = "df = parse_ob2({!r})"
+    elapsed, peak = measure(setup, stream.format(path))
+    print(f"stream_ob2 over {os.path.getsize(path) / 2 ** 20:.0f}MB: {elapsed:.1f}s, peak memory {peak:.0f}MB")
+    for name, code in [("stream_ob2", stream), ("original read_ob2", reference), ("parse_ob2 DataFrame", parse)]:
+        elapsed, peak = measure(setup, code.format(reference_path))
+        print(f"{name} over {os.path.getsize(reference_path) / 2 ** 20:.0f}MB: {elapsed:.1f}s, "
+              f"peak memory {peak:.0f}MB")
+    from data import parse_ob2
+
+    new, old = parse_ob2(reference_path), reference_read_ob2(reference_path)
+    same = all(new[column].tolist() == old[column].tolist() for column in old.columns)
+    print(f"same DataFrame: {same}")
+    require(same, "stream_ob2 and original read_ob2 DataFrames")
+
+
+def reference_load_conll2003(dset):
+    """
+    The original per token loop of load_conll2003, indexing the HF dataset row by row
+    """
+    columns = ["text", "entities", "types", "exact_types"]
+    conll_tag_map = {0: "none", 1: "per", 2: "per", 3: "org", 4: "org", 5: "loc", 6: "loc", 7: "misc", 8: "misc"}
+    conll_fulltagmap = {0: "O", 1: 'B-PER', 2: 'I-PER', 3: 'B-ORG', 4: 'I-ORG', 5: 'B-LOC', 6: 'I-LOC', 7: 'B-MISC', 8: 'I-MISC'}
+    data = []
+    for j in range(len(dset)):
+        text = " ".join(dset[j]['tokens'])
+        types = dset[j]["ner_tags"]
+        sentence = text.split(" ")
+        assert len(sentence) == len(types)
+        entities = []
+        d = {}
+        subentities = ""
+        curr_type = None
+        exacts = []
+        for i, tag in enumerate(types):
+            exacts.append(conll_fulltagmap[tag])
+            if tag == 0:
+                if curr_type is not None:
+                    entities.append(subentities)
+                    d[subentities] = curr_type
+                    curr_type = None
+                    subentities = ""
+            else:
+                if tag in [1, 3, 5, 7]:
+                    if curr_type is not None:
+                        entities.append(subentities)
+                        d[subentities] = curr_type
+                    curr_type = conll_tag_map[tag]
+                    subentities = sentence[i]
+                else:
+                    assert curr_type is not None
+                    subentities = subentities + " " + sentence[i]
+        data.append([text, entities, d, exacts])
+    df = pd.DataFrame(columns=columns, data=data)
+    return df
+
+
+def synthetic_hf_split(n_sentences=60000, seed=0):
+    """
+    A random conll2003 like HF dataset (tokens, ner_tags) with well formed BIO sequences
+    """
+    import random
+    import datasets
+
+    rng = random.Random(seed)
+    tokens, tags = [], []
+    for i in range(n_sentences):
+        length = rng.randint(1, 30)
+        sentence_tags = []
+        while len(sentence_tags) < length:
+            if rng.random() < 0.6:
+                sentence_tags.append(0)
+            else:
+                begin = rng.choice([1, 3, 5, 7])
+                sentence_tags.extend([begin] + [begin + 1] * rng.randint(0, 2))
+        tokens.append([f"word{rng.randrange(5000)}" for j in range(length)])
+        tags.append(sentence_tags[:length])
+    return datasets.Dataset.from_dict({"tokens": tokens, "ner_tags": tags})
+
+
+def bench_tag_decoder(n_sentences=60000):
+    """
+    Decodes a synthetic HF split with the original row by row loop and with data.decode_tags on its Arrow columns
+    """
+    import data
+
+    dset = synthetic_hf_split(n_sentences)
+    start = time.perf_counter()
+    reference = reference_load_conll2003(dset)
+    reference_time = time.perf_counter() - start
+    data.load_dataset = lambda *args, **kwargs: {"validation": dset}
+    start = time.perf_counter()
+    decoded = data.load_conll2003.__wrapped__("validation")  # skip any local snapshot
+    decoded_time = time.perf_counter() - start
+    same = all(reference[column].tolist() == decoded[column].tolist() for column in reference.columns)
+    print(f"{n_sentences} sentences: row loop {reference_time:.2f}s, decode_tags {decoded_time:.2f}s, same: {same}")
+    require(same, "row loop and decode_tags DataFrames")
+
+
+def bench_snapshots(n_sentences=60000, root="cache/bench_snapshots"):
+    """
+    Snapshots a synthetic conll2003 split, then loads it through data.load_conll2003 with the hub unreachable
+    (load_dataset raises) and compares time and content against decoding the HF split. Also times a fresh
+    interpreter's import of data, which no longer imports datasets
+    """
+    import subprocess
+    import sys
+    import data
+
+    dset = synthetic_hf_split(n_sentences)
+    data.load_dataset = lambda *args, **kwargs: {split: dset for split in data.hf_splits}
+    data.snapshot_root = root
+    start = time.perf_counter()
+    decoded = data.load_conll2003.__wrapped__("validation")
+    decoded_time = time.perf_counter() - start
+    data.snapshot_datasets(["conll2003"], splits=["validation"])
+
+    def offline(*args, **kwargs):
+        raise ConnectionError("hub is unreachable")
+    data.load_dataset = offline
+    start = time.perf_counter()
+    snapshot = data.load_conll2003("validation")
+    snapshot_time = time.perf_counter() - start
+    same = all(decoded[column].tolist() == snapshot[column].tolist() for column in decoded.columns)
+    print(f"{n_sentences} sentences: HF decode {decoded_time:.2f}s (plus hub resolution), snapshot "
+          f"{snapshot_time:.2f}s, same: {same}")
+    require(same, "decoded and snapshot DataFrames")
+    script = "import time; start = time.perf_counter(); import data; print(time.perf_counter() - start)"
+    import_time = float(subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+                                       check=True).stdout)
+    print(f"import data: {import_time:.2f}s")
+
+
+def bench_quick(n_conll=20000):
+    """
+    Time to the first Quick.conll result when every Quick dataset is loaded up front (what importing main used to
+    do) and with the lazy registry, then the time of a second call in the same session. Stands in shipped IOB2
+    files and a synthetic conll split for the datasets that are not in this tree, with a model that answers at once
+    """
+    import data
+    import main
+
+    dset = synthetic_hf_split(n_conll)
+    data.load_dataset = lambda *args, **kwargs: {"validation": dset}
+    loaders = {"genia": (data.parse_ob2, {"file_path": "data/Genia/sampletest1.iob2"}),
+               "conll": (data.load_conll2003.__wrapped__, {}),
+               "fewnerd": (data.parse_ob2, {"file_path": "data/FewNERD/inter/test.txt"}),
+               "crossner_ai": (data.parse_ob2, {"file_path": "data/FewNERD/inter/dev.txt"})}
+    class InstantModel:
+        @staticmethod
+        def is_chat():
+            return False
+
+        def __call__(self, prompt):
+            return "it is a word"
+
+    model = InstantModel()
+    times = {}
+    results = {}
+    for mode in ["eager", "lazy"]:
+        main.quick_datasets = main.LazyDatasets(loaders)
+        start = time.perf_counter()
+        if mode == "eager":
+            main.quick_datasets.warm(*loaders)
+        main.Quick.conll(0, model=model)
+        times[mode] = time.perf_counter() - start
+        results[mode] = main.quick_datasets["conll"]
+    start = time.perf_counter()
+    main.Quick.conll(1, model=model)
+    warm_time = time.perf_counter() - start
+    print(f"First Quick.conll result: eager {times['eager']:.2f}s, lazy {times['lazy']:.2f}s, "
+          f"next call in the session {warm_time:.3f}s")
+    require(results["eager"].equals(results["lazy"]), "conll datasets of the eager and lazy loads")
+
+
+def bench_startup(modules=("custom", "run", "main", "eval", "data", "models"), top=6):
+    """
+    Cold import time of every entry point module in a fresh interpreter (python -X importtime), with the modules it
+    imports directly that take the longest (cumulative, i.e. including everything they import)
+    """
+    import subprocess
+    import sys
+
+    for module in modules:
+        stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True,
+                                text=True, check=True).stderr
+        direct = []
+        total = None
+        for line in stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            self_time, cumulative, name = line[len("import time:"):].split("|")
+            depth = (len(name) - len(name.lstrip())) // 2  # one space after the "|", two more per nesting level
+            if depth == 0 and name.strip() == module:
+                total = int(cumulative) / 1e6
+            elif depth == 1:
+                direct.append((int(cumulative) / 1e6, name.strip()))
+        direct.sort(reverse=True)
+        print(f"import {module}: {total:.2f}s")
+        for seconds, name in direct[:top]:
+            print(f"\t{name}: {seconds:.2f}s")
+
+
+def reference_sample_all_types(dset, min_k=5, time_limit=60):
+    """
+    The original rejection sampler of data.sample_all_types, gives up (returns None) after time_limit seconds
+    """
+    from data import miniproc
+
+    start = time.perf_counter()
+    total_types = set(miniproc(x) for i in dset.index for x in dset.loc[i, 'exact_types'])
+    k = min_k
+    attempt = 0
+    while time.perf_counter() - start < time_limit:
+        minidset = dset.sample(k).reset_index(drop=True)
+        selected_types = set(miniproc(x) for i in minidset.index for x in minidset.loc[i, 'exact_types'])
+        if len(selected_types) == len(total_types):
+            return minidset
+        attempt += 1
+        if (attempt+1) % 10 == 0:
+            k += 1
+    return None
+
+
+def bench_exemplar_selection(time_limit=60):
+    """
+    Times the original rejection sampler against the set cover selector on the shipped datasets and checks that
+    every selection covers all types
+    """
+    import data
+
+    datasets = {"genia sampletest1": data.read_ob2("data/Genia/sampletest1.iob2"),
+                "fewnerd inter dev": data.read_ob2("data/FewNERD/inter/dev.txt"),
+                "fewnerd inter test": data.read_ob2("data/FewNERD/inter/test.txt")}
+    for name, dset in datasets.items():
+        all_types = set(data.miniproc(x) for tags in dset["exact_types"] for x in tags)
+        start = time.perf_counter()
+        reference = reference_sample_all_types(dset, 3, time_limit=time_limit)
+        reference_time = time.perf_counter() - start
+        reference = "gave up" if reference is None else f"{len(reference)} rows"
+        start = time.perf_counter()
+        first = data.sample_all_types(dset, 3, seed=0)
+        first_time = time.perf_counter() - start
+        start = time.perf_counter()
+        selections = [data.sample_all_types(dset, 3, seed=seed) for seed in range(1, 11)]
+        selection_time = (time.perf_counter() - start) / 10
+        covers = all(set(data.miniproc(x) for tags in selection["exact_types"] for x in tags) == all_types
+                     for selection in [first] + selections)
+        print(f"{name} ({len(all_types)} types): rejection sampling {reference_time:.2f}s ({reference}), set cover "
+              f"{first_time*1000:.1f}ms first / {selection_time*1000:.1f}ms indexed ({len(first)} rows), "
+              f"covers all types: {covers}")
+        require(covers, f"types of the {name} selections")
+
+
+def reference_exemplar_format_list(output, separator='|', true_only=True):
+    """
+    The original AnswerMapping.exemplar_format_list (identify_types=True) and get_numbered_list_items
+    """
+    if "\n" in output:
+        listed = []
+        for cand in output.split("\n"):
+            c = cand.strip()
+            if c.lower().strip() in ["", "answer:"]:
+                pass
+            elif re.match(r"\d+[.)]+ *", c):
+                start = 0
+                while c[start].isnumeric() or c[start] == '.':
+                    start += 1
+                listed.append(c[start:].strip())
+            else:
+                print(f"Unable to match nonempty {c}")
+    else:
+        listed = []
+        if "1" in output:
+            for item in re.split(r"\d+[.)]", output):
+                if item.strip().lower() == "" or "answer" in item.strip().lower():
+                    pass
+                else:
+                    listed.append(item.strip())
+    final = []
+    typestring = []
+    for option in listed:
+        if separator in option:
+            split = option.split(separator)
+            explanation = None
+            if len(split) == 2:
+                entity, depends = split
+                if depends.strip().lower() in ["true", "false"]:
+                    status = depends
+                else:
+                    status = "true"
+                    explanation = depends
+            elif len(split) == 3:
+                entity, status, explanation = split
+            else:
+                entity, status = split[0], split[1]
+                print(f"Got more than 3 values for {option} with separator '{separator}'")
+            if status.strip().lower() == "true" or not true_only:
+                if explanation is not None:
+                    typestring.append(explanation.strip())
+                final.append(entity.strip().lower())
+        else:
+            final.append(option.strip().lower())
+    return final, typestring
+
+
+def bench_answer_parsing(repeats=20):
+    """
+    Parses the meta (raw model output) of every shipped result row with the original exemplar_format_list and
+    with AnswerParser, checks the outputs agree and times one pass over all of them with each (fastest of repeats
+    passes, interleaved so that load on the machine hits all three alike; printing of the original is discarded)
+    """
+    import contextlib
+    import io
+    from utils import AnswerMapping, AnswerParser
+
+    metas = [meta for filename, text, meta in load_shipped_predictions()]
+    parser = AnswerParser()
+    passes = {"original": lambda: [reference_exemplar_format_list(meta) for meta in metas],
+              "exemplar_format_list": lambda: [AnswerMapping.exemplar_format_list(meta, identify_types=True,
+                                                                                  verbose=False) for meta in metas],
+              "parse_batch": lambda: parser.parse_batch(metas)}
+    timings = {name: float("inf") for name in passes}
+    outputs = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(repeats):
+            for name, parse in passes.items():
+                start = time.perf_counter()
+                outputs[name] = parse()
+                timings[name] = min(timings[name], time.perf_counter() - start)
+    same = outputs["original"] == outputs["exemplar_format_list"]
+    print(f"{len(metas)} outputs, fastest of {repeats} passes: " +
+          ", ".join(f"{name} {timing*1000:.1f}ms" for name, timing in timings.items()) + f", same: {same}")
+    require(same, "original and AnswerParser answer lists")
+    print(f"diagnostics per pass: { {name: count // repeats for name, count in parser.diagnostics.items()} }")
+    return timings
+
+
+def bench_streaming(n_rows=10, token_latency=0.02, chunk_size=4):
+    """
+    Checks that perform_span_stream gives the same tags as span_from_output on every shipped model output (fed in
+    random pieces), with stop_early the same tags as the output up to the end of its list, then times the first
+    entity and the whole answer, streamed and not, against the fake server, and how much of a rambling answer early
+    stopping skips
+    """
+    import random
+    from algorithms import Algorithm, ConllConfig
+    from models import OpenAIGPT
+    from ratelimit import RateLimiter
+    from utils import AnswerStream
+
+    class ReplayModel:
+        def __init__(self, output, rng):
+            self.output = output
+            self.rng = rng
+
+        @staticmethod
+        def is_chat():
+            return False
+
+        def __call__(self, inputs):
+            return self.output
+
+        def stream(self, inputs):
+            start = 0
+            while start < len(self.output):
+                size = self.rng.randint(1, 12)
+                yield self.output[start:start+size]
+                start += size
+
+    def outcome(fn):
+        try:
+            return fn()
+        except Exception as exception:
+            return type(exception).__name__
+
+    rng = random.Random(0)
+    algorithm = Algorithm()
+    ConllConfig().set_config(algorithm, exemplar=True, coT=True, tf=True)
+    def tags(result):
+        return result[0] if isinstance(result, tuple) else result
+
+    mismatches = {True: 0, False: 0}
+    early_mismatches = 0
+    rows = load_shipped_predictions()
+    for filename, text, meta in rows:
+        algorithm.set_para(text)
+        end = AnswerStream.list_end(meta)
+        listed = outcome(lambda: algorithm.span_from_output(meta if end is None else meta[:end]))
+        for stop_early in [False, True]:
+            algorithm.set_model_fn(ReplayModel(meta, rng))
+            streamed = outcome(lambda: algorithm.perform_span_stream(stop_early=stop_early))
+            whole = outcome(lambda: algorithm.span_from_output(meta))
+            mismatches[stop_early] += streamed != whole
+            if stop_early:
+                early_mismatches += tags(streamed) != tags(listed)
+    print(f"{len(rows)} shipped outputs: {mismatches[False]} differ streamed, {mismatches[True]} with stop_early "
+          f"({early_mismatches} in their tags from the output up to the end of its list)")
+    require(mismatches[False] == 0, "streamed and whole output tags")
+    require(early_mismatches == 0, "stop_early tags and the tags of the list")
+
+    val = toy_dataset(n_rows)
+    trailing = "\nParagraph: " + " ".join(["More Words"] * 40) + "\nAnswer:\n1. More | True | as it is (PER)"
+    OpenAIGPT.model = "gpt-3.5-turbo"
+    OpenAIGPT.rate_limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=None)
+    for ramble in ["", trailing]:
+        with FakeCompletionServer(latency=0.1, token_latency=token_latency, chunk_size=chunk_size,
+                                  trailing=ramble) as server:
+            use_fake_server(server)
+            algorithm = Algorithm(model_fn=OpenAIGPT())
+            ConllConfig().set_config(algorithm, exemplar=True, coT=True, tf=True)
+            timings = {"whole": [], "first entity": [], "streamed": []}
+            for text in val["text"]:
+                algorithm.set_para(text)
+                start = time.perf_counter()
+                whole = algorithm.perform_span()
+                timings["whole"].append(time.perf_counter() - start)
+                first = []
+                start = time.perf_counter()
+                streamed = algorithm.perform_span_stream(
+                    on_entity=lambda *args: first.append(time.perf_counter()) if not first else None)
+                timings["streamed"].append(time.perf_counter() - start)
+                timings["first entity"].append(first[0] - start)
+                require(streamed[0] == whole[0], "streamed and whole tags from the fake server")
+            chunks = server.n_chunks
+            label = "with a rambling tail" if ramble else "plain answers"
+            print(f"{label}: " + ", ".join(f"{name} {np.mean(values):.2f}s" for name, values in timings.items())
+                  + f", {chunks} chunks sent for {2 * n_rows} answers")
+
+
+def answer_forms(output):
+    """
+    A shipped (coT and tf) model output rewritten the way the tf and plain prompt formats ask for it
+    """
+    from utils import AnswerParser
+
+    tf, plain = [], []
+    for entity, true, explanation, entity_type in AnswerParser().parse(output, "|"):
+        types = "(misc)"
+        if explanation is not None and "(" in explanation and ")" in explanation:
+            types = explanation[explanation.find("("):explanation.find(")") + 1]
+        tf.append(f"{len(tf) + 1}. {entity} | {true} | {types}")
+        if true:
+            plain.append(f"{len(plain) + 1}. {entity} | {types}")
+    return {"coT": output, "tf": "\n".join(tf), "plain": "\n".join(plain)}
+
+
+class ScriptedSeq2Seq:
+    """
+    Stands in for a seq2seq model in HugginFaceModel: generate writes the script of the prompt's first word one
+    token per step, then keeps repeating it like a model that does not stop after its list. Stopping criteria and
+    max_new_tokens are applied per sequence like transformers does, n_generated counts the tokens written
+    """
+    def __init__(self, tokenizer, scripts):
+        self.tokenizer = tokenizer
+        self.scripts = scripts
+        self.n_generated = 0
+
+    def generate(self, input_ids, attention_mask=None, max_new_tokens=20, stopping_criteria=(), streamer=None):
+        import torch
+
+        prompts = self.tokenizer.batch_decode(input_ids, skip_special_tokens=True)
+        scripts = [self.tokenizer(self.scripts[prompt.split()[0]], add_special_tokens=False)["input_ids"]
+                   for prompt in prompts]
+        pad = self.tokenizer.pad_token_id
+        ids = torch.full((len(scripts), 1), pad, dtype=torch.long)
+        done = torch.zeros(len(scripts), dtype=torch.bool)
+        for step in range(max_new_tokens):
+            new = torch.tensor([pad if done[i] else script[step % len(script)] for i, script in enumerate(scripts)])
+            self.n_generated += int((~done).sum())
+            ids = torch.cat([ids, new[:, None]], dim=1)
+            for criterion in stopping_criteria:
+                done = done | criterion(ids, None)
+            if done.all():
+                break
+        return ids
+
+
+def bench_token_budget(max_new_tokens=(200, 600), batch_size=8):
+    """
+    Replays every shipped output (and its tf / plain forms) through Algorithm with and without a TokenBudget:
+    tokens reserved per request, answers cut off by the limit and rows whose tags change because of it. Then the
+    local model path: new tokens generated for the same answers by a model that repeats its list until stopped,
+    with the fixed max_new_tokens, the budget, the list end criterion and both
+    """
+    from tokenizers import Tokenizer, decoders, models as token_models, pre_tokenizers
+    from transformers import PreTrainedTokenizerFast
+
+    import utils
+    from algorithms import Algorithm, ConllConfig
+    from budget import TokenBudget
+    from models import HugginFaceModel, OpenAIGPT
+    from ratelimit import estimate_tokens
+
+    class ReplayModel:
+        supports_budget = True
+
+        def __init__(self):
+            self.output = None
+            self.limits = []
+
+        @staticmethod
+        def is_chat():
+            return True
+
+        def __call__(self, inputs, budget=None):
+            limit = OpenAIGPT.max_tokens if budget is None else budget
+            self.limits.append(limit)
+            return self.output[:4 * limit]  # estimate_tokens counts 4 characters per token
+
+    def outcome(fn):
+        try:
+            return fn()[0]
+        except Exception as exception:
+            return type(exception).__name__
+
+    rows = load_shipped_predictions()
+    forms = [answer_forms(meta) for filename, text, meta in rows]
+    flags = {"coT": (True, True), "tf": (False, True), "plain": (False, False)}
+    for answer_format, (coT, tf) in flags.items():
+        counts = {}
+        for budget in [None, TokenBudget()]:
+            model = ReplayModel()
+            algorithm = Algorithm(model_fn=model, budget=budget)
+            ConllConfig().set_config(algorithm, exemplar=True, coT=coT, tf=tf)
+            cut, changed = 0, 0
+            for (filename, text, meta), form in zip(rows, forms):
+                model.output = form[answer_format]
+                algorithm.set_para(text)
+                tags = outcome(lambda: algorithm.perform_span())
+                cut += estimate_tokens(model.output) > model.limits[-1]
+                changed += tags != outcome(lambda: algorithm.span_from_output(model.output))
+            counts["fixed" if budget is None else "budget"] = (sum(model.limits), cut, changed)
+        print(f"{answer_format}: " + ", ".join(f"{name} {reserved / len(rows):.0f} tokens reserved per request, "
+                                               f"{cut} answers cut, {changed} rows changed"
+                                               for name, (reserved, cut, changed) in counts.items()))
+        require(counts["budget"][1] < 0.01 * len(rows), f"answers cut by the {answer_format} budget (1% at most)")
+
+    lists = [" ".join(form["coT"].split()) for form in forms]
+    words = sorted({word for answer in lists for word in answer.split()} | {f"row{i}" for i in range(len(rows))})
+    vocab = {"<pad>": 0, "</s>": 1, "<unk>": 2, **{word: i + 3 for i, word in enumerate(words)}}
+    tokenizer = Tokenizer(token_models.WordLevel(vocab, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    tokenizer.decoder = decoders.WordPiece(prefix="\u0000", cleanup=False)
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, pad_token="<pad>", eos_token="</s>",
+                                        unk_token="<unk>")
+    utils.Parameters.devices = ["cpu"]
+    model = HugginFaceModel()
+    model.tokenizer = tokenizer
+    model.model = ScriptedSeq2Seq(tokenizer, {f"row{i}": answer for i, answer in enumerate(lists)})
+    model.reuse_prefix = False
+    prompts = [f"row{i}" for i in range(len(rows))]
+    budget = TokenBudget()
+    budgets = [budget.tokens(text) for filename, text, meta in rows]
+    lengths = [len(answer.split()) for answer in lists]
+    algorithm = Algorithm()
+    ConllConfig().set_config(algorithm, exemplar=True, coT=True, tf=True)
+
+    def tags(text, output):
+        algorithm.set_para(text)
+        return outcome(lambda: algorithm.span_from_output(output))
+
+    expected = [tags(text, answer) for (filename, text, meta), answer in zip(rows, lists)]
+    for limit in max_new_tokens:
+        model.max_new_tokens = limit
+        for stop, budgeted in [(False, False), (False, True), (True, False), (True, True)]:
+            model.stop_at_list_end = stop
+            model.model.n_generated = 0
+            start = time.perf_counter()
+            outputs = model.batch_query(prompts, batch_size=batch_size, budgets=budgets if budgeted else None)
+            elapsed = time.perf_counter() - start
+            exact = sum(output == answer for output, answer in zip(outputs, lists))
+            same = sum(tags(text, output) == tags_of_list for (filename, text, meta), output, tags_of_list in
+                       zip(rows, outputs, expected))
+            label = f"max_new_tokens {limit}{', budget' if budgeted else ''}{', list end' if stop else ''}"
+            print(f"{label}: {model.model.n_generated} tokens generated for {sum(lengths)} in the lists, "
+                  f"{exact} outputs exactly their list, {same}/{len(rows)} with its tags, {elapsed:.2f}s")
+            if stop and budgeted:
+                require(same == len(rows), f"tags of the lists and the {label} outputs")
+
+
+class TypeOracle:
+    """
+    Chat model stand-in for the MultiAlgorithm type and dispute queries, one phrase or a numbered list of them.
+    A phrase's type and the option a dispute settles on only depend on the phrase (crc32), items of a batched answer
+    are left out or left without a type at drop_rate so the per phrase fallback gets exercised
+    """
+    types = ["PER", "ORG", "LOC", "MISC"]
+
+    def __init__(self, drop_rate=0.0):
+        self.drop_rate = drop_rate
+        self.n_calls = 0
+        self.n_tokens = 0
+        self.n_phrases = 0
+
+    @staticmethod
+    def is_chat():
+        return True
+
+    @staticmethod
+    def crc(text):
+        import zlib
+        return zlib.crc32(text.encode("utf-8"))
+
+    def answer(self, item):
+        phrase, options = item, None
+        if ", Options: " in item:
+            phrase, options = item.split(", Options: ", 1)
+            options = re.findall(r"\((.*?)\)", options)
+            return f"{phrase} | it fits ({options[TypeOracle.crc(phrase + ' ' + ' '.join(options)) % 2]})"
+        return f"{phrase} | it is ({TypeOracle.types[TypeOracle.crc(phrase) % 4]})"
+
+    def __call__(self, msgs):
+        from ratelimit import estimate_tokens
+
+        self.n_calls += 1
+        self.n_tokens += estimate_tokens(msgs)
+        query = msgs[-1][0]
+        query = query[:query.rindex("\nAnswer:")]
+        if "Entity Phrases:\n" not in query:
+            self.n_phrases += 1
+            return self.answer(query[query.rindex("Entity Phrase: ") + len("Entity Phrase: "):].strip())
+        items = query[query.rindex("Entity Phrases:\n") + len("Entity Phrases:\n"):].strip().split("\n")
+        self.n_phrases += len(items)
+        lines = []
+        for i, item in enumerate(items):
+            item = item.split(". ", 1)[1]
+            roll = TypeOracle.crc(f"drop {item}") % 1000 / 1000
+            if roll < self.drop_rate / 2:
+                continue
+            line = f"{i + 1}. {self.answer(item)}"
+            if roll < self.drop_rate:
+                line = line[:line.rindex("(")]
+            lines.append(line)
+        return "\n".join(lines)
+
+
+def bench_type_queries(drop_rates=(0.0, 0.2), latency=0.5):
+    """
+    MultiAlgorithm on every shipped output (the first query answered from the shipped meta) with per entity and
+    batched type / dispute queries: checks both give the same tags, counts the model calls and prompt tokens and
+    what they would take at latency seconds per call in sequence
+    """
+    from algorithms import ConllConfig, MultiAlgorithm
+
+    def outcome(fn):
+        try:
+            return fn()[0]
+        except Exception as exception:
+            return type(exception).__name__
+
+    rows = load_shipped_predictions()
+    for resolve_disputes in [False, True]:
+        for drop_rate in drop_rates:
+            results = {}
+            for batch_queries in [False, True]:
+                model = TypeOracle(drop_rate=drop_rate)
+                algorithm = MultiAlgorithm(model_fn=model, resolve_disputes=resolve_disputes,
+                                           batch_queries=batch_queries)
+                ConllConfig().set_config(algorithm)
+                tags = []
+                for filename, text, meta in rows:
+                    algorithm.set_para(text)
+                    tags.append(outcome(lambda: algorithm.span_from_output(meta)))
+                results[batch_queries] = (tags, model.n_calls, model.n_tokens, dict(algorithm.diagnostics))
+            differ = sum(a != b for a, b in zip(results[False][0], results[True][0]))
+            label = f"resolve_disputes {resolve_disputes}, drop_rate {drop_rate}"
+            print(f"{label}: {differ}/{len(rows)} rows differ")
+            require(differ == 0, f"per entity and batched tags with {label}")
+            for batch_queries, (tags, n_calls, n_tokens, diagnostics) in results.items():
+                name = "batched" if batch_queries else "per entity"
+                print(f"    {name}: {n_calls} calls ({n_calls / len(rows):.2f} per row, {n_calls * latency:.0f}s at "
+                      f"{latency}s each), {n_tokens} prompt tokens {diagnostics if batch_queries else ''}")
+
+
+class NoisyTypeOracle(TypeOracle):
+    """
+    TypeOracle that answers the true type of a phrase in its paragraph (from truth, {paragraph: {phrase: type}}),
+    except for noise of the (paragraph, phrase) pairs which get one of types instead, like a model that is mostly
+    right and sometimes misled by the context
+    """
+    def __init__(self, truth, types, noise=0.1):
+        super().__init__()
+        self.truth = truth
+        self.types = types
+        self.noise = noise
+        self.para = None
+
+    def answer(self, item):
+        entity_type = self.truth[self.para].get(item.lower())
+        key = TypeOracle.crc(f"{self.para} {item}")
+        if entity_type is None or key % 1000 < self.noise * 1000:
+            entity_type = self.types[key % len(self.types)]
+        return f"{item} | it is ({entity_type})"
+
+    def __call__(self, msgs):
+        query = msgs[-1][0]
+        self.para = query[query.index("Paragraph: ") + len("Paragraph: "):query.index(" \nEntity Phrase")]
+        return super().__call__(msgs)
+
+
+def bench_type_memo(path="data/FewNERD/inter/test.txt", limit=None, noise=0.1):
+    """
+    MultiAlgorithm over a dataset whose first query lists exactly the true entities, typed by NoisyTypeOracle,
+    without a TypeMemo and with a few settings of one: model calls, memo hit rate and the micro / macro f1 delta
+    """
+    from algorithms import ConllConfig, MultiAlgorithm
+    from typememo import TypeMemo
+    from data import read_ob2
+    from metrics import SpanMetrics
+
+    df = read_ob2(path)
+    if limit is not None:
+        df = df.head(limit)
+    truth, outputs, iob2 = {}, [], []
+    for text, tags in zip(df["text"], df["exact_types"]):
+        words = text.split(" ")
+        phrases = {}
+        sentence = []
+        start = 0
+        for i in range(1, len(tags) + 1):
+            if i == len(tags) or tags[i] != tags[start]:
+                entity_type = tags[start].replace("-", "_")  # FewNERD types have no B- / I-, give them one
+                if tags[start] != "O":
+                    phrases.setdefault(" ".join(words[start:i]).lower(), entity_type)
+                    sentence.extend(["B-" + entity_type] + ["I-" + entity_type] * (i - start - 1))
+                else:
+                    sentence.extend(["O"] * (i - start))
+                start = i
+        truth[text] = phrases
+        iob2.append(sentence)
+        outputs.append("\n".join(f"{j + 1}. {phrase} | True | as it is ({entity_type})"
+                                 for j, (phrase, entity_type) in enumerate(phrases.items())))
+    types = sorted({entity_type for phrases in truth.values() for entity_type in phrases.values()})
+    n_phrases = sum(len(phrases) for phrases in truth.values())
+    print(f"{len(df)} sentences, {n_phrases} entity phrases, {len(types)} types, noise {noise}")
+    baseline = None
+    settings = [("no memo", None), ("min_count 1", dict(min_count=1, min_agreement=0.0)),
+                ("min_count 2", dict(min_count=2, min_agreement=0.9)),
+                ("min_count 3", dict(min_count=3, min_agreement=0.9)),
+                ("min_count 2, context 2", dict(min_count=2, min_agreement=0.9, context=2)),
+                ("min_count 2, audit 0.1", dict(min_count=2, min_agreement=0.9, audit_rate=0.1))]
+    for name, kwargs in settings:
+        memo = None if kwargs is None else TypeMemo(**kwargs)
+        model = NoisyTypeOracle(truth, types, noise=noise)
+        algorithm = MultiAlgorithm(model_fn=model, resolve_disputes=False, type_memo=memo)
+        ConllConfig().set_config(algorithm)
+        metrics = SpanMetrics()
+        failed = 0
+        start = time.perf_counter()
+        for text, tags, output in zip(df["text"], iob2, outputs):
+            algorithm.set_para(text)
+            try:
+                span_pred, meta = algorithm.span_from_output(output)
+            except IndexError:  # skipped like run.perform_span does
+                failed += 1
+                continue
+            metrics.add(tags, span_pred)
+        elapsed = time.perf_counter() - start
+        f1 = (metrics.micro_f1(), metrics.macro_f1())
+        if baseline is None:
+            baseline = f1
+        memo_stats = "" if memo is None else f", {memo.stats()}"
+        print(f"{name}: {model.n_calls} calls typing {model.n_phrases} phrases, {failed} rows not aligned, micro f1 {f1[0]:.4f} ({f1[0] - baseline[0]:+.4f}), macro f1 "
+              f"{f1[1]:.4f} ({f1[1] - baseline[1]:+.4f}), {elapsed:.1f}s{memo_stats}")
+
+
+if __name__ == "__main__":
+    bench_async_openai()
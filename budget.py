@@ -0,0 +1,59 @@
+import string
+
+import utils
+
+
+class TokenBudget:
+    """
+    Output tokens to allow for the answer to one paragraph, predicted from its number of candidate words and the
+    answer format instead of a fixed max_tokens. Every candidate costs item_tokens of the format on top of
+    list_tokens (coT items carry an explanation, tf items a True / False and a type, plain items only the true
+    entities and their types). The defaults were fitted on the shipped results/*.csv outputs (estimate_tokens
+    counting) so that fewer than 1% of the answers would have been cut off
+    """
+    item_tokens = {"coT": 12, "tf": 4, "plain": 3}
+    list_tokens = {"coT": 64, "tf": 48, "plain": 32}
+
+    def __init__(self, margin=1.0, min_tokens=32, max_tokens=600):
+        self.margin = margin
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.n_queries = 0
+        self.total_tokens = 0
+
+    @staticmethod
+    def answer_format(coT, tf):
+        if coT:
+            return "coT"
+        return "tf" if tf else "plain"
+
+    @staticmethod
+    def candidates(para):
+        """
+        Words of para that the model may list: not a stopword, a number or only punctuation
+        """
+        stopwords = utils.get_stopwords()
+        n = 0
+        for word in para.split():
+            word = word.strip(string.punctuation)
+            if word != "" and word.lower() not in stopwords and not word.isnumeric():
+                n += 1
+        return n
+
+    def tokens(self, para, answer_format="coT"):
+        needed = TokenBudget.list_tokens[answer_format] + TokenBudget.item_tokens[answer_format] * \
+            TokenBudget.candidates(para)
+        return int(min(self.max_tokens, max(self.min_tokens, self.margin * needed)))
+
+    def take(self, paras, answer_format="coT"):
+        """
+        Budget of one request answering all of paras, counted in stats
+        """
+        budget = sum(self.tokens(para, answer_format) for para in paras)
+        self.n_queries += 1
+        self.total_tokens += budget
+        return budget
+
+    def stats(self):
+        mean = self.total_tokens / self.n_queries if self.n_queries > 0 else 0
+        return {"queries": self.n_queries, "tokens": self.total_tokens, "mean tokens": round(mean, 1)}
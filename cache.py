@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+cache_root = "cache"
+
+
+def normalize_inputs(inputs):
+    """
+    Canonical form of a model input: a prompt string stays as is, chat messages given either as (content, role)
+    pairs or as openai style dicts become a list of [role, content]
+    """
+    if isinstance(inputs, str):
+        return inputs
+    normalized = []
+    for message in inputs:
+        if isinstance(message, dict):
+            normalized.append([message["role"], message["content"]])
+        else:
+            content, role = message
+            normalized.append([role, content])
+    return normalized
+
+
+def make_key(model_name, inputs, params=None):
+    payload = json.dumps([model_name, normalize_inputs(inputs), params or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def model_name(model_fn):
+    name = getattr(model_fn, "name", None)
+    if name is None:
+        name = getattr(model_fn, "model", None)
+    if not isinstance(name, str):
+        name = getattr(model_fn, "__qualname__", type(model_fn).__name__)
+    return name
+
+
+class ResponseCache:
+    """
+    On disk cache of model outputs keyed on (model name, normalized input, decoding params).
+    Backed by sqlite in WAL mode so several processes can read and write the same file, least recently used entries
+    are evicted once the cache holds more than max_entries entries or max_bytes of responses
+    """
+    def __init__(self, path=None, max_entries=None, max_bytes=2 ** 30):
+        if path is None:
+            path = os.path.join(cache_root, "responses.sqlite")
+        if os.path.dirname(path) != "":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, model TEXT, "
+                                "response TEXT, size INTEGER, last_access REAL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+    def __getstate__(self):  # sqlite connections can not be pickled, reopen in the new process instead
+        return {"path": self.path, "max_entries": self.max_entries, "max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key, model_name, response):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                                    (key, model_name, response, len(response.encode("utf-8")), time.time()))
+            self.evict()
+
+    def evict(self):
+        count, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        excess = 0
+        if self.max_entries is not None:
+            excess = max(excess, count - self.max_entries)
+        if self.max_bytes is not None and size > self.max_bytes:
+            rows = self.connection.execute("SELECT size FROM responses ORDER BY last_access").fetchall()
+            freed = 0
+            n = 0
+            for row in rows:
+                if size - freed <= self.max_bytes:
+                    break
+                freed += row[0]
+                n += 1
+            excess = max(excess, n)
+        if excess > 0:
+            self.connection.execute("DELETE FROM responses WHERE key IN "
+                                    "(SELECT key FROM responses ORDER BY last_access LIMIT ?)", (excess,))
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate(), "entries": len(self)}
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM responses")
+
+
+class CachedModel:
+    """
+    Wraps any model_fn (OpenAIGPT, T5, Alpaca or a plain function) so identical queries are answered from a
+    ResponseCache. Exposes the same is_chat / acall interface as the wrapped model
+    """
+    def __init__(self, model_fn, cache=None):
+        self.model_fn = model_fn
+        self.cache = cache if cache is not None else ResponseCache()
+
+    def __getattr__(self, item):
+        if item == "model_fn":  # not set yet (e.g. while unpickling), avoid recursing into ourselves
+            raise AttributeError(item)
+        return getattr(self.model_fn, item)
+
+    def is_chat(self):
+        return hasattr(self.model_fn, "is_chat") and self.model_fn.is_chat()
+
+    def model_name(self):
+        return model_name(self.model_fn)
+
+    def decoding_params(self):
+        if hasattr(self.model_fn, "decoding_params"):
+            return self.model_fn.decoding_params()
+        return {}
+
+    def key(self, inputs, budget=None):
+        params = self.decoding_params()
+        if budget is not None:  # keys of requests without a budget stay what they were
+            params = {**params, "budget": budget}
+        return make_key(self.model_name(), inputs, params)
+
+    @staticmethod
+    def budget_kwargs(budget):
+        return {} if budget is None else {"budget": budget}
+
+    def __call__(self, inputs, budget=None):
+        key = self.key(inputs, budget)
+        output = self.cache.get(key)
+        if output is None:
+            output = self.model_fn(inputs, **CachedModel.budget_kwargs(budget))
+            self.cache.put(key, self.model_name(), output)
+        return output
+
+    def stream(self, inputs, budget=None):
+        """
+        A cached response comes back as one piece, otherwise the wrapped model's stream (or its whole output if it
+        can not stream) is passed through and cached once it has been read to the end
+        """
+        key = self.key(inputs, budget)
+        output = self.cache.get(key)
+        if output is not None:
+            yield output
+            return
+        if not hasattr(self.model_fn, "stream"):
+            output = self.model_fn(inputs, **CachedModel.budget_kwargs(budget))
+            self.cache.put(key, self.model_name(), output)
+            yield output
+            return
+        pieces = []
+        for piece in self.model_fn.stream(inputs, **CachedModel.budget_kwargs(budget)):
+            pieces.append(piece)
+            yield piece
+        self.cache.put(key, self.model_name(), "".join(pieces))
+
+    def batch_query(self, inputs, budgets=None, **kwargs):
+        if budgets is None:
+            keys = [self.key(item) for item in inputs]
+        else:
+            keys = [self.key(item, budget) for item, budget in zip(inputs, budgets)]
+        outputs = [self.cache.get(key) for key in keys]
+        missing = [i for i, output in enumerate(outputs) if output is None]
+        if len(missing) > 0:
+            if budgets is not None:
+                kwargs["budgets"] = [budgets[i] for i in missing]
+            generated = self.model_fn.batch_query([inputs[i] for i in missing], **kwargs)
+            for i, output in zip(missing, generated):
+                outputs[i] = output
+                self.cache.put(keys[i], self.model_name(), output)
+        return outputs
+
+    async def acall(self, inputs, budget=None):
+        key = self.key(inputs, budget)
+        output = self.cache.get(key)
+        if output is None:
+            output = await self.model_fn.acall(inputs, **CachedModel.budget_kwargs(budget))
+            self.cache.put(key, self.model_name(), output)
+        return output
@@ -0,0 +1,90 @@
+import json
+import os
+
+from cache import model_name
+
+checkpoint_root = "checkpoints"
+
+
+class Checkpoint:
+    """
+    Append only JSONL log of one evaluation (dataset, subdataset, config flags, model). Records the rows each run
+    sampled and every finished row's prediction and raw model output as soon as it completes, so a run that
+    crashes or runs out of quota can be resumed without querying the finished rows again
+    """
+    def __init__(self, path, resume=True):
+        if os.path.dirname(path) != "":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not resume and os.path.exists(path):
+            print(f"Moving old checkpoint {path} to {path}.old")
+            os.replace(path, path + ".old")
+        self.path = path
+        self.samples = {}
+        self.rows = {}
+        if os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def for_run(dataset, subdataset, model, exemplar, coT, defn, tf, name_meta="", resume=True):
+        model_id = model_name(model).replace("/", "_")
+        filename = f"{name_meta}{dataset}{subdataset}_{model_id}_defn{defn}_exemplar{exemplar}_coT{coT}_tf{tf}.jsonl"
+        return Checkpoint(os.path.join(checkpoint_root, filename), resume=resume)
+
+    def load(self):
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:  # last line of a crashed run may be cut off
+                    continue
+                if record["kind"] == "sample":
+                    self.samples[record["run"]] = record["index"]
+                else:
+                    self.rows.setdefault(record["run"], {})[record["position"]] = record
+
+    def append(self, record):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+
+    def sample(self, run, dataset, limit):
+        """
+        dataset.sample(limit), except that a resumed run gets back the rows it sampled the first time
+        """
+        if run in self.samples:
+            return dataset.loc[self.samples[run]]
+        small_dataset = dataset.sample(limit)
+        self.samples[run] = small_dataset.index.tolist()
+        self.append({"kind": "sample", "run": run, "index": self.samples[run]})
+        return small_dataset
+
+    def finished(self, run, texts):
+        """
+        Returns {position: result} for the rows of texts already done in this run, result is (span_pred, meta) or
+        None if the row could not be aligned
+        """
+        done = {}
+        for position, record in self.rows.get(run, {}).items():
+            if position < len(texts) and texts[position] == record["text"]:
+                done[position] = Checkpoint.result(record)
+        return done
+
+    def finished_row(self, run, position, text):
+        """
+        The logged record of the row at position if it is done in this run with this text, else None
+        """
+        record = self.rows.get(run, {}).get(position)
+        if record is not None and record["text"] == text:
+            return record
+        return None
+
+    @staticmethod
+    def result(record):
+        return None if record["pred"] is None else (record["pred"], record["meta"])
+
+    def log_row(self, run, position, text, result):
+        record = {"kind": "row", "run": run, "position": position, "text": text, "pred": None, "meta": None}
+        if result is not None:
+            record["pred"], record["meta"] = result
+        self.rows.setdefault(run, {})[position] = record
+        self.append(record)
@@ -1,10 +1,18 @@
+import functools
+import itertools
 import os
+import sys
+import weakref
+import numpy as np
 import pandas as pd
-from datasets import load_dataset
 import re
 import string
+from datastore import cached_parse, ColumnStore
 
 data_root = "data"
+snapshot_root = os.path.join(data_root, "snapshots")
+ob2_columns = ["text", "entities", "types", "exact_types"]
+hf_splits = ["train", "validation", "test"]
 
 
 def get_row(func):
@@ -15,77 +23,123 @@ def get_row(func):
     return infunc
 
 
-def read_ob2(file_path):
+def load_dataset(*args, **kwargs):
+    from datasets import load_dataset as hf_load_dataset  # slow to import, only needed without a snapshot
+    return hf_load_dataset(*args, **kwargs)
+
+
+def snapshot_path(name, split, root=None):
+    if root is None:
+        root = snapshot_root
+    return os.path.join(root, name, split)
+
+
+def snapshotted(name):
+    """
+    Makes an HF backed loader read the ColumnStore snapshot of the split in data/snapshots/<name>/<split> when there
+    is one (see snapshot_datasets) and only fall back to load_dataset when there is not
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def infunc(split="validation", **kwargs):
+            path = snapshot_path(name, split)
+            if os.path.exists(os.path.join(path, "meta.json")):
+                return ColumnStore(path).frame()
+            return func(split=split, **kwargs)
+        infunc.snapshot_name = name
+        return infunc
+    return decorator
+
+
+def read_ob2(file_path, cached=True):
+    """
+    Parses an IOB2 / FewNERD file, by default through a columnar cache keyed on the file content so every later
+    load of the same file skips the parsing
+    """
+    if cached:
+        return cached_parse(file_path, parse_ob2)
+    return parse_ob2(file_path)
+
+
+def parse_ob2(file_path):
+    data = [[sentence[column] for column in ob2_columns] for sentence in stream_ob2(file_path)]
+    df = pd.DataFrame(columns=ob2_columns, data=data)
+    return df
+
+
+def stream_ob2(file_path):
+    """
+    Yields one {text, entities, types, exact_types} dict per sentence of an IOB2 / FewNERD file, reading it a line
+    at a time so memory stays constant however large the file is. The records can be given to eval_dataset as is.
+    As before, the last line of the file always ends the sentence (and is not read as a token)
+    """
     with open(file_path) as file:
-        lines = file.readlines()
-    sentences = []
+        sentence = []
+        previous = None
+        for line in file:
+            if previous is not None:
+                if previous.strip() == "":
+                    if len(sentence) > 0:
+                        record = ob2_sentence(sentence)
+                        if record is not None:
+                            yield record
+                    sentence = []
+                else:
+                    word, tag = previous.split("\t")
+                    sentence.append((word, tag))
+            previous = line
+        if len(sentence) > 0:
+            record = ob2_sentence(sentence)
+            if record is not None:
+                yield record
+
+
+def ob2_sentence(lines):
+    """
+    Builds the record of one sentence from its (word, tag) lines, None if it has no words
+    """
+    words = []
     entities = []
-    types = []
+    types = {}
     exact_types = []
-    data = []
-    sub_entities = []
-    sub_types = {}
-    sub_exact_types = []
-    words = ""
     curr_entity = ""
     curr_type = None
-
-    for i, line in enumerate(lines):
-        if line.strip() == "" or line == "\n" or i == len(lines)-1:
-            # save entity if it exists
+    for word, tag in lines:
+        if len(words) > 0 or word != "":  # leading empty words are left out of the text
+            words.append(word)
+        exact_types.append(tag.strip())
+        if "-" not in tag:  # if there was an entity before this then add it in full
             if curr_type is not None:
-                sub_entities.append(curr_entity.strip())
-                sub_types[curr_entity.strip()] = curr_type
-                curr_entity = ""
-                curr_type = None
-            if words != "":
-                sentences.append(words)
-                entities.append(sub_entities)
-                types.append(sub_types)
-                exact_types.append(sub_exact_types)
-                data.append([words, sub_entities, sub_types, sub_exact_types])
-            sub_entities = []
-            sub_types = {}
-            sub_exact_types = []
-            words = ""
+                entities.append(curr_entity.strip())
+                types[curr_entity.strip()] = curr_type
             curr_entity = ""
             curr_type = None
-        else:
-            word, tag = line.split("\t")
-            if words == "":
-                words = word
-            else:
-                words = words + " " + word
-            sub_exact_types.append(tag.strip())
-            if tag.split() == "O" or "-" not in tag:  # if there was an entity before this then add it in full
+        elif "B-" in tag or "I-" in tag:
+            if "B-" in tag:
                 if curr_type is not None:
-                    sub_entities.append(curr_entity.strip())
-                    sub_types[curr_entity.strip()] = curr_type
-                curr_entity = ""
-                curr_type = None
-            elif "B-" in tag or "I-" in tag:
-                if "B-" in tag:
-                    if curr_type is not None:
-                        sub_entities.append(curr_entity.strip())
-                        sub_types[curr_entity.strip()] = curr_type
-                    curr_entity = word
-                    curr_type = tag.split("-")[1].strip()
-                else:  # I- in tag
-                    if curr_type is None:
-                        print(f"Should not be happening bug here")
-                    curr_entity = curr_entity + " " + word
-            else:
-                main_type, subtype = tag.split("-")  # must assume that if curr_type is not None then its the same one because FewNERD doesn't contain B, I information
-                if subtype.strip() == "government/governmentagency":
-                    subtype = "government"
+                    entities.append(curr_entity.strip())
+                    types[curr_entity.strip()] = curr_type
+                curr_entity = word
+                curr_type = tag.split("-")[1].strip()
+            else:  # I- in tag
                 if curr_type is None:
-                    curr_entity = word
-                    curr_type = main_type + "-" + subtype.strip()  # can change to make it subtype if we want
-                else:
-                    curr_entity = curr_entity + " " + word
-
-    df = pd.DataFrame(columns=["text", "entities", "types", "exact_types"], data=data)
-    return df
+                    print(f"Should not be happening bug here")
+                curr_entity = curr_entity + " " + word
+        else:
+            main_type, subtype = tag.split("-")  # must assume that if curr_type is not None then its the same one because FewNERD doesn't contain B, I information
+            if subtype.strip() == "government/governmentagency":
+                subtype = "government"
+            if curr_type is None:
+                curr_entity = word
+                curr_type = main_type + "-" + subtype.strip()  # can change to make it subtype if we want
+            else:
+                curr_entity = curr_entity + " " + word
+    if curr_type is not None:
+        entities.append(curr_entity.strip())
+        types[curr_entity.strip()] = curr_type
+    if len(words) == 0:
+        return None
+    return {"text": " ".join(words), "entities": entities, "types": types, "exact_types": exact_types}
 
 
 def write_ob2(df, dataset_folder=None, filename=None):
@@ -105,8 +159,94 @@ def write_ob2(df, dataset_folder=None, filename=None):
     return
 
 
+def flat_lists(column):
+    """
+    (flat values, sentence offsets) of a column of lists, given as python lists or as an Arrow list array
+    (e.g. dset.with_format("arrow")[:]["tokens"]), which is flattened without going through python rows.
+    pyarrow is imported here so that loading the local files does not need it
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if isinstance(column, (pa.ListArray, pa.LargeListArray)):
+        lengths = pc.list_value_length(column).to_numpy(zero_copy_only=False)
+        values = column.flatten()
+    else:
+        column = [list(item) for item in column]
+        lengths = [len(item) for item in column]
+        values = list(itertools.chain.from_iterable(column))
+    return values, np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+
+
+def decode_tags(tokens, tags, tag_map, begin_tags, outside_tag=0, type_map=None, split_text=True,
+                true_tokens=False):
+    """
+    Decodes whole columns of token lists and integer tag lists (as the HF datasets give them) into the text,
+    entities, types and exact_types columns (and true_tokens if asked). The tags of all sentences are handled at
+    once as one numpy array, only the entity strings and types dicts are built per sentence.
+    tag_map: id -> BIO tag, type_map: id -> type stored in types (tag_map by default), begin_tags: ids that start
+    an entity. As in the per token loops this replaces, an entity is only recorded once the next B or O tag closes
+    it, so one still open at the end of its sentence is left out, and an I tag with no open entity is an error
+    split_text: take the words from text.split(" ") rather than the tokens themselves
+    """
+    if type_map is None:
+        type_map = tag_map
+    words, word_starts = flat_lists(tokens)
+    flat, starts = flat_lists(tags)
+    if not isinstance(words, list):
+        words = words.to_pylist()
+    flat = np.asarray(flat, dtype=np.int64)
+    word_starts = word_starts.tolist()
+    sentences = [words[start:end] for start, end in zip(word_starts[:-1], word_starts[1:])]
+    texts = [" ".join(sentence) for sentence in sentences]
+    if split_text:
+        sentences = [text.split(" ") for text in texts]
+    lengths = np.diff(starts)
+    assert [len(sentence) for sentence in sentences] == lengths.tolist()
+    sentence_of = np.repeat(np.arange(len(lengths)), lengths)
+    position = np.arange(len(flat))
+
+    names = np.empty(max(tag_map) + 1, dtype=object)
+    for tag, name in tag_map.items():
+        names[tag] = name
+    exact_types = names[flat].tolist()
+
+    is_begin = np.isin(flat, list(begin_tags))
+    is_marker = is_begin | (flat == outside_tag)  # tags that close the open entity
+    last_marker = np.maximum.accumulate(np.where(is_marker, position, -1)) if len(flat) > 0 else position
+    inside = ~is_marker
+    open_before = last_marker[inside] >= starts[sentence_of[inside]]
+    assert open_before.all() and is_begin[last_marker[inside]].all()
+    next_marker = np.minimum.accumulate(np.where(is_marker, position, len(flat))[::-1])[::-1]
+    next_marker = np.append(next_marker, len(flat))
+
+    entities = [[] for sentence in sentences]
+    types = [{} for sentence in sentences]
+    begins = np.flatnonzero(is_begin)
+    ends = next_marker[begins + 1]
+    begin_sentences = sentence_of[begins]
+    closed = ends < starts[begin_sentences + 1]  # one still open at the end of the sentence is not recorded
+    begin_starts = starts[begin_sentences]
+    for begin, end, s, start, tag in zip((begins - begin_starts)[closed].tolist(), (ends - begin_starts)[closed].tolist(),
+                                         begin_sentences[closed].tolist(), begin_starts[closed].tolist(),
+                                         flat[begins][closed].tolist()):
+        entity = " ".join(sentences[s][begin:end])
+        entities[s].append(entity)
+        types[s][entity] = type_map[tag]
+    columns = ["text", "entities", "types", "exact_types"]
+    starts = starts.tolist()
+    exact_types = [exact_types[start:end] for start, end in zip(starts[:-1], starts[1:])]
+    data = {"text": texts, "entities": entities, "types": types, "exact_types": exact_types}
+    if true_tokens:
+        columns.append("true_tokens")
+        data["true_tokens"] = sentences
+    return pd.DataFrame(data, columns=columns)
+
+
+@snapshotted("tweetner")
 def load_tweetner(split="validation"):
-    columns = ["text", "entities", "types", "exact_types", "true_tokens"]
     tweetner_tag_map = {
         0: "B-corporation",
         1: "B-creative_work",
@@ -124,44 +264,15 @@ def load_tweetner(split="validation"):
         13: "I-product",
         14: "O"
     }
-    data = []
-    dset = load_dataset("tner/tweetner7")[split+"_2021"]
-    for j in range(len(dset)):
-        text = " ".join(dset[j]['tokens'])
-        types = dset[j]["tags"]
-        sentence = dset[j]['tokens']#text.split(" ")
-        assert len(sentence) == len(types)
-        entities = []
-        d = {}
-        subentities = ""
-        curr_type = None
-        exacts = []
-        for i, tag in enumerate(types):
-            exacts.append(tweetner_tag_map[tag])
-            if tag == 14:
-                if curr_type is not None:
-                    entities.append(subentities)
-                    d[subentities] = curr_type
-                    curr_type = None
-                    subentities = ""
-            else:
-                if tag <= 6:
-                    if curr_type is not None:
-                        entities.append(subentities)
-                        d[subentities] = curr_type
-                    curr_type = tweetner_tag_map[tag]
-                    subentities = sentence[i]
-                else:
-                    assert curr_type is not None
-                    subentities = subentities + " " + sentence[i]
-        data.append([text, entities, d, exacts, sentence])
-    df = pd.DataFrame(columns=columns, data=data)
+    dset = load_dataset("tner/tweetner7")[split+"_2021"].with_format("arrow")[:]
+    df = decode_tags(dset["tokens"], dset["tags"], tweetner_tag_map, begin_tags=range(7), outside_tag=14,
+                     split_text=False, true_tokens=True)
     return df
 
 
+@snapshotted("fabner")
 def load_fabner(split="validation"):
-    dset = load_dataset("DFKI-SLT/fabner", "fabner_bio")[split]
-    columns = ["text", "entities", "types", "exact_types"]
+    dset = load_dataset("DFKI-SLT/fabner", "fabner_bio")[split].with_format("arrow")[:]
     fabner_tag_map = {0: "O",
                       1: "B-MATE",
                       2: "I-MATE",
@@ -188,120 +299,40 @@ def load_fabner(split="validation"):
                       23: "B-BIOP",
                       24: "I-BIOP"}
 
-    data = []
-    for j in range(len(dset)):
-        text = " ".join(dset[j]['tokens'])
-        types = dset[j]["ner_tags"]
-        sentence = text.split(" ")
-        assert len(sentence) == len(types)
-        entities = []
-        d = {}
-        subentities = ""
-        curr_type = None
-        exacts = []
-        for i, tag in enumerate(types):
-            exacts.append(fabner_tag_map[tag])
-            if tag == 0:
-                if curr_type is not None:
-                    entities.append(subentities)
-                    d[subentities] = curr_type
-                    curr_type = None
-                    subentities = ""
-            else:
-                if tag % 2 == 1:
-                    if curr_type is not None:
-                        entities.append(subentities)
-                        d[subentities] = curr_type
-                    curr_type = fabner_tag_map[tag]
-                    subentities = sentence[i]
-                else:
-                    assert curr_type is not None
-                    subentities = subentities + " " + sentence[i]
-        data.append([text, entities, d, exacts])
-    df = pd.DataFrame(columns=columns, data=data)
+    df = decode_tags(dset["tokens"], dset["ner_tags"], fabner_tag_map, begin_tags=range(1, 25, 2))
     return df
 
 
+@snapshotted("conll2003")
 def load_conll2003(split="validation"):
-    dset = load_dataset("conll2003")[split]
-    columns = ["text", "entities", "types", "exact_types"]
+    dset = load_dataset("conll2003")[split].with_format("arrow")[:]
     #'B-PER': 1, 'I-PER': 2, 'B-ORG': 3, 'I-ORG': 4, 'B-LOC': 5, 'I-LOC': 6, 'B-MISC': 7, 'I-MISC': 8}
     conll_tag_map = {0: "none", 1: "per", 2: "per", 3: "org", 4: "org", 5: "loc", 6: "loc", 7: "misc", 8: "misc"}
     conll_fulltagmap = {0: "O", 1: 'B-PER', 2: 'I-PER', 3: 'B-ORG', 4: 'I-ORG', 5: 'B-LOC', 6: 'I-LOC', 7: 'B-MISC', 8: 'I-MISC'}
-    data = []
-    for j in range(len(dset)):
-        text = " ".join(dset[j]['tokens'])
-        types = dset[j]["ner_tags"]
-        sentence = text.split(" ")
-        assert len(sentence) == len(types)
-        entities = []
-        d = {}
-        subentities = ""
-        curr_type = None
-        exacts = []
-        for i, tag in enumerate(types):
-            exacts.append(conll_fulltagmap[tag])
-            if tag == 0:
-                if curr_type is not None:
-                    entities.append(subentities)
-                    d[subentities] = curr_type
-                    curr_type = None
-                    subentities = ""
-            else:
-                if tag in [1, 3, 5, 7]:
-                    if curr_type is not None:
-                        entities.append(subentities)
-                        d[subentities] = curr_type
-                    curr_type = conll_tag_map[tag]
-                    subentities = sentence[i]
-                else:
-                    assert curr_type is not None
-                    subentities = subentities + " " + sentence[i]
-        data.append([text, entities, d, exacts])
-    df = pd.DataFrame(columns=columns, data=data)
+    df = decode_tags(dset["tokens"], dset["ner_tags"], conll_fulltagmap, begin_tags=[1, 3, 5, 7],
+                     type_map=conll_tag_map)
     return df
 
 
-def load_ontonotes(split="validation", save_ob2=True):
+@snapshotted("ontonotes")
+def fetch_ontonotes(split="validation"):
     dset_holder = load_dataset("conll2012_ontonotesv5", 'english_v4')[split]
-    columns = ["text", "entities", "types", "exact_types"]
     onto_tags = ["O", "B-PERSON", "I-PERSON", "B-NORP", "I-NORP", "B-FAC", "I-FAC", "B-ORG", "I-ORG", "B-GPE", "I-GPE", "B-LOC", "I-LOC", "B-PRODUCT", "I-PRODUCT", "B-DATE", "I-DATE", "B-TIME", "I-TIME", "B-PERCENT", "I-PERCENT", "B-MONEY", "I-MONEY", "B-QUANTITY", "I-QUANTITY", "B-ORDINAL", "I-ORDINAL", "B-CARDINAL", "I-CARDINAL", "B-EVENT", "I-EVENT", "B-WORK_OF_ART", "I-WORK_OF_ART", "B-LAW", "I-LAW", "B-LANGUAGE", "I-LANGUAGE"]
     onto_tag_map = {}
     for i in range(len(onto_tags)):
         onto_tag_map[i] = onto_tags[i]
-    onto_fulltagmap = onto_tag_map
-    data = []
-    for k, dset_example in enumerate(dset_holder):
-        for j,  dset in enumerate(dset_example['sentences']):
-            text = " ".join(dset['words'])
-            types = dset["named_entities"]
-            sentence = text.split(" ")
-            assert len(sentence) == len(types)
-            entities = []
-            d = {}
-            subentities = ""
-            curr_type = None
-            exacts = []
-            for i, tag in enumerate(types):
-                exacts.append(onto_fulltagmap[tag])
-                if tag == 0:
-                    if curr_type is not None:
-                        entities.append(subentities)
-                        d[subentities] = curr_type
-                        curr_type = None
-                        subentities = ""
-                else:
-                    if tag % 2 == 1:  # then it is a B
-                        if curr_type is not None:
-                            entities.append(subentities)
-                            d[subentities] = curr_type
-                        curr_type = onto_tag_map[tag]
-                        subentities = sentence[i]
-                    else:
-                        assert curr_type is not None
-                        subentities = subentities + " " + sentence[i]
-            data.append([text, entities, d, exacts])
-    df = pd.DataFrame(columns=columns, data=data)
+    sentences = dset_holder.with_format("arrow")[:]["sentences"].combine_chunks().flatten()  # every document's sentences
+    df = decode_tags(sentences.field("words"), sentences.field("named_entities"), onto_tag_map,
+                     begin_tags=range(1, len(onto_tags), 2))
+    return df
+
+
+def load_ontonotes(split="validation", save_ob2=True):
+    """
+    fetch_ontonotes, also written to data/ontoNotes/<split>.txt with save_ob2 whether it came from the snapshot or
+    the hub
+    """
+    df = fetch_ontonotes(split=split)
     if save_ob2:
         if split == "validation":
             split = "dev"
@@ -325,6 +356,27 @@ def load_cross_ner(cross_ner_path='data/CrossNER', category="ai", split="train")
     return read_ob2(file_path)
 
 
+hf_loaders = [load_conll2003, load_fabner, load_tweetner, fetch_ontonotes]
+
+
+def snapshot_datasets(names=None, splits=None, root=None):
+    """
+    Downloads every split of the HF backed datasets (all of hf_loaders, or those named) and saves each as a
+    ColumnStore snapshot, after which the loaders no longer touch the hub
+    """
+    if splits is None:
+        splits = hf_splits
+    for loader in hf_loaders:
+        if names is not None and loader.snapshot_name not in names:
+            continue
+        for split in splits:
+            df = loader.__wrapped__(split=split)
+            path = snapshot_path(loader.snapshot_name, split, root=root)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            ColumnStore.write(df, path, overwrite=True)
+            print(f"Saved {len(df)} rows of {loader.snapshot_name} {split} to {path}")
+
+
 def scroll(dataset, start=0, exclude=None):
     cols = dataset.columns
     for i in range(start, len(dataset)):
@@ -349,30 +401,61 @@ def miniproc(x):
         return x
 
 
-def sample_all_types(dset, min_k=5):
-    total_types = []
-    for i in dset.index:
-        types = list(set([miniproc(x) for x in dset.loc[i, 'exact_types']]))
-        total_types.extend(types)
-    total_types = list(set(total_types))
-    done = False
-    k = min_k
-    i = 0
-    minidset = None
-    while not done:
-        selected_types = []
-        minidset = dset.sample(k).reset_index(drop=True)
-        for i in minidset.index:
-            types = list(set([miniproc(x) for x in minidset.loc[i, 'exact_types']]))
-            selected_types.extend(types)
-        selected_types = list(set(selected_types))
-        if len(selected_types) == len(total_types):
-            done = True
-            break
-        i += 1
-        if (i+1) % 10 == 0:
-            k += 1
-    return minidset
+class ExemplarSelector:
+    """
+    Picks few shot exemplar rows that between them show every type (miniproc of the exact_types tags) of a dataset.
+    Which rows have which types is indexed once per dataset as a boolean rows x types matrix. A selection is then a
+    greedy set cover (repeatedly the row with the most still missing types, random among ties) padded with random
+    rows up to min_k, in random order
+    """
+    selectors = {}  # id(dset): (weakref to dset, selector)
+
+    def __init__(self, dset):
+        tags, offsets = flat_lists(dset["exact_types"])
+        codes, unique_tags = pd.factorize(pd.Series(tags, dtype=object))
+        self.types, tag_types = np.unique([miniproc(tag) for tag in unique_tags], return_inverse=True)
+        rows = np.repeat(np.arange(len(dset)), np.diff(offsets))
+        self.row_types = np.zeros((len(dset), len(self.types)), dtype=bool)
+        self.row_types[rows, tag_types[codes]] = True
+
+    @staticmethod
+    def for_frame(dset):
+        """
+        The selector of dset, built on first use and reused for as long as that DataFrame is alive
+        """
+        key = id(dset)
+        if key in ExemplarSelector.selectors:
+            ref, selector = ExemplarSelector.selectors[key]
+            if ref() is dset and len(selector.row_types) == len(dset):
+                return selector
+        for other in [other for other, (ref, _) in ExemplarSelector.selectors.items() if ref() is None]:
+            del ExemplarSelector.selectors[other]
+        selector = ExemplarSelector(dset)
+        ExemplarSelector.selectors[key] = (weakref.ref(dset), selector)
+        return selector
+
+    def select(self, dset, min_k=5, seed=None):
+        if seed is None:
+            seed = np.random.randint(2 ** 31)  # follows np.random.seed, like the DataFrame.sample this replaced
+        rng = np.random.default_rng(seed)
+        missing = np.ones(len(self.types), dtype=bool)
+        chosen = []
+        while missing.any():
+            gains = self.row_types[:, missing].sum(axis=1)
+            row = rng.choice(np.flatnonzero(gains == gains.max()))
+            chosen.append(row)
+            missing &= ~self.row_types[row]
+        rest = np.setdiff1d(np.arange(len(dset)), chosen)
+        padding = rng.choice(rest, min(max(min_k - len(chosen), 0), len(rest)), replace=False)
+        order = rng.permutation(np.concatenate([np.array(chosen, dtype=np.int64), padding]))
+        return dset.iloc[order].reset_index(drop=True)
+
+
+def sample_all_types(dset, min_k=5, seed=None):
+    """
+    At least min_k rows of dset that together contain every type in dset, seed makes the choice reproducible
+    """
+    return ExemplarSelector.for_frame(dset).select(dset, min_k=min_k, seed=seed)
 
 
 def save(func, name):
@@ -387,5 +470,9 @@ def save(func, name):
 
 
 if __name__ == "__main__":
-    save(load_fabner, "fabner")
-    save(load_tweetner, "tweetner")
\ No newline at end of file
+    if sys.argv[1:2] == ["snapshot"]:
+        # python data.py snapshot [conll2003 fabner tweetner ontonotes]
+        snapshot_datasets(sys.argv[2:] or None)
+    else:
+        save(load_fabner, "fabner")
+        save(load_tweetner, "tweetner")
\ No newline at end of file
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from cache import cache_root
+
+store_version = 1
+store_root = os.path.join(cache_root, "datasets")
+
+
+def file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def intern(values, vocab, index):
+    ids = []
+    for value in values:
+        if value not in index:
+            index[value] = len(vocab)
+            vocab.append(value)
+        ids.append(index[value])
+    return ids
+
+
+class ColumnStore:
+    """
+    A parsed dataset (text, entities, types, exact_types columns) stored column by column as numpy arrays, memory
+    mapped on load. Strings are one blob per column with character offsets, tags and entity types are interned ids
+    and sentence boundaries are offsets into the flat tag and entity arrays. The types dict of a sentence is rebuilt
+    from its entities and their types in order, which gives the same keys, order and values as read_ob2
+    """
+    columns = ["text", "entities", "types", "exact_types"]
+    arrays = ["text_offsets", "tag_ids", "tag_offsets", "entity_offsets", "entity_type_ids", "sentence_entities"]
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.tags = meta["tags"]
+        self.types = meta["types"]
+        self.extra_columns = meta.get("extra_columns", [])
+        for name in ColumnStore.arrays:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        self.blobs = {}
+
+    def __len__(self):
+        return len(self.text_offsets) - 1
+
+    def blob(self, name):
+        if name not in self.blobs:
+            with open(os.path.join(self.path, f"{name}.txt"), encoding="utf-8", newline="") as f:
+                self.blobs[name] = f.read()
+        return self.blobs[name]
+
+    @staticmethod
+    def split(items, offsets):
+        offsets = offsets.tolist()
+        return [items[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def column(self, name):
+        if name == "text":
+            return ColumnStore.split(self.blob("text"), self.text_offsets)
+        if name == "exact_types":
+            tags = np.array(self.tags, dtype=object)[self.tag_ids].tolist()
+            return ColumnStore.split(tags, self.tag_offsets)
+        if name == "entities":
+            return ColumnStore.split(self.entity_strings(), self.sentence_entities)
+        if name == "types":
+            types = ColumnStore.split(np.array(self.types, dtype=object)[self.entity_type_ids].tolist(),
+                                      self.sentence_entities)
+            entities = ColumnStore.split(self.entity_strings(), self.sentence_entities)
+            return [dict(zip(sentence, sentence_types)) if sentence else {} for sentence, sentence_types in
+                    zip(entities, types)]
+        if name in self.extra_columns:
+            with open(os.path.join(self.path, f"{name}.json")) as f:
+                return json.load(f)
+        raise KeyError(name)
+
+    def entity_strings(self):
+        if "entity_strings" not in self.blobs:
+            self.blobs["entity_strings"] = ColumnStore.split(self.blob("entities"), self.entity_offsets)
+        return self.blobs["entity_strings"]
+
+    def frame(self, columns=None):
+        """
+        DataFrame of the requested columns (all by default). It materializes them: every requested column is
+        decoded in full into python lists here, only the columns left out stay on disk (memory mapped / unread)
+        """
+        if columns is None:
+            columns = ColumnStore.columns + self.extra_columns
+        return pd.DataFrame({name: self.column(name) for name in columns}, columns=columns)
+
+    @staticmethod
+    def write(df, path, overwrite=False):
+        """
+        Saves a DataFrame with the read_ob2 columns (plus any other list / str columns, kept as json) to path. The
+        store is written to its own temporary directory and renamed into place, so concurrent writers never see each
+        other's files. If another process got there first its store is kept (or swapped out when overwrite is set).
+        Returns whether this copy is the one now at path
+        """
+        tags, tag_index = [], {}
+        types, type_index = [], {}
+        text_offsets, tag_ids, tag_offsets = [0], [], [0]
+        entity_strings, entity_type_ids, sentence_entities = [], [], [0]
+        for text, entities, sentence_types, exact_types in zip(df["text"], df["entities"], df["types"],
+                                                               df["exact_types"]):
+            text_offsets.append(text_offsets[-1] + len(text))
+            tag_ids.extend(intern(exact_types, tags, tag_index))
+            tag_offsets.append(len(tag_ids))
+            entity_strings.extend(entities)
+            entity_type_ids.extend(intern([sentence_types[entity] for entity in entities], types, type_index))
+            sentence_entities.append(len(entity_strings))
+        entity_offsets = np.cumsum([0] + [len(entity) for entity in entity_strings])
+        extra_columns = [name for name in df.columns if name not in ColumnStore.columns]
+
+        tmp_path = tempfile.mkdtemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path))
+        os.chmod(tmp_path, 0o755)
+        with open(os.path.join(tmp_path, "text.txt"), "w", encoding="utf-8", newline="") as f:
+            f.write("".join(df["text"]))
+        with open(os.path.join(tmp_path, "entities.txt"), "w", encoding="utf-8", newline="") as f:
+            f.write("".join(entity_strings))
+        arrays = {"text_offsets": np.array(text_offsets, dtype=np.int64),
+                  "tag_ids": np.array(tag_ids, dtype=np.int32),
+                  "tag_offsets": np.array(tag_offsets, dtype=np.int64),
+                  "entity_offsets": np.array(entity_offsets, dtype=np.int64),
+                  "entity_type_ids": np.array(entity_type_ids, dtype=np.int32),
+                  "sentence_entities": np.array(sentence_entities, dtype=np.int64)}
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+        for name in extra_columns:
+            with open(os.path.join(tmp_path, f"{name}.json"), "w") as f:
+                json.dump(df[name].tolist(), f)
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump({"version": store_version, "tags": tags, "types": types, "extra_columns": extra_columns}, f)
+        if overwrite and os.path.exists(path):
+            old_path = tempfile.mkdtemp(prefix=os.path.basename(path) + ".", suffix=".old",
+                                        dir=os.path.dirname(path))
+            os.rename(path, os.path.join(old_path, "store"))
+            shutil.rmtree(old_path, ignore_errors=True)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not os.path.exists(os.path.join(path, "meta.json")):
+                raise
+            return False
+        return True
+
+
+def cached_parse(file_path, parse, root=None):
+    """
+    parse(file_path) as a DataFrame, from the ColumnStore of the file if this exact file content was parsed before
+    """
+    if root is None:
+        root = store_root
+    path = os.path.join(root, f"{file_hash(file_path)}-v{store_version}")
+    if os.path.exists(os.path.join(path, "meta.json")):
+        return ColumnStore(path).frame()
+    df = parse(file_path)
+    os.makedirs(root, exist_ok=True)
+    if not ColumnStore.write(df, path):
+        return ColumnStore(path).frame()
+    return df
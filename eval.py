@@ -10,9 +10,6 @@ from data import scroll
 from models import OpenAIGPT
 import warnings
 import random
-from seqeval.metrics import f1_score as seq_f1
-import matplotlib.pyplot as plt
-from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay
 results_dir = "results"
 
 
@@ -90,6 +87,9 @@ def analytics(d):
         preds.extend(pred)
     print(f"Correlation is: ")
     print(d.corr()["f1"])
+    import matplotlib.pyplot as plt
+    from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay
+
     conf = confusion_matrix(truths, preds, labels=all_types)
     disp = ConfusionMatrixDisplay(confusion_matrix=conf, display_labels=all_types)
     disp.plot()
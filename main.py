@@ -2,28 +2,69 @@ from algorithms import *
 from models import *
 
 from data import *
-from seqeval.metrics import f1_score
 import string
+import time
+
+
+class LazyDatasets:
+    """
+    Named dataset loaders that only run on first access, every loaded dataset is kept for the rest of the session
+    """
+    def __init__(self, loaders):
+        self.loaders = loaders  # name: (loader, kwargs)
+        self.loaded = {}
+
+    def __getitem__(self, name):
+        if name not in self.loaded:
+            loader, kwargs = self.loaders[name]
+            start = time.time()
+            self.loaded[name] = loader(**kwargs)
+            print(f"Loaded {name} ({len(self.loaded[name])} rows) in {time.time() - start:.2f}s")
+        return self.loaded[name]
+
+    def warm(self, *names):
+        for name in names:
+            self[name]
+
+
+crossner_categories = ['politics', 'literature', 'ai', 'science', 'music']
+quick_datasets = LazyDatasets({"genia": (load_genia, {}), "conll": (load_conll2003, {}),
+                               "fewnerd": (load_few_nerd, {}),
+                               **{f"crossner_{category}": (load_cross_ner, {"category": category})
+                                  for category in crossner_categories}})
 
 
 class Quick:
+    model = None
+
+    @staticmethod
+    def get_model(model=None):
+        """
+        model, or the session model (OpenAIGPT unless Quick.session was given another one)
+        """
+        if model is not None:
+            return model
+        if Quick.model is None:
+            Quick.model = OpenAIGPT()
+        return Quick.model
+
     @staticmethod
-    def example_span(para, config=ConllConfig(), model = OpenAIGPT(), verbose=True):
+    def example_span(para, config=ConllConfig(), model=None, verbose=True):
         e.set_para(para)
-        e.set_model_fn(model)
+        e.set_model_fn(Quick.get_model(model))
         e.split_phrases = False
         config.set_config(e, exemplar=True, coT=True, tf=True)
         ret = e.perform_span(verbose=verbose)
         return ret
 
     @staticmethod
-    def dataset(i, train_dset, config, model=OpenAIGPT(), verbose=True):
+    def dataset(i, train_dset, config, model=None, verbose=True):
         q = train_dset.loc[i]
         para = q['text']
         entities = q['entities']
         print(f"Paragraph: {para}")
         e.set_para(para)
-        e.set_model_fn(model)
+        e.set_model_fn(Quick.get_model(model))
         config.set_config(e, exemplar=True, coT=True, tf=True)
         #tokens =
         ret = e.generate_annotations(para.split(" "), q["exact_types"])
@@ -34,6 +75,8 @@ class Quick:
 
     @staticmethod
     def analyze(q, ret):
+        from seqeval.metrics import f1_score
+
         ans = [ret]
         entities = [q['exact_types']]
         true_types = q['types']
@@ -42,41 +85,64 @@ class Quick:
 
 
     @staticmethod
-    def genia(i, model=OpenAIGPT(), verbose=True):
+    def genia(i, model=None, verbose=True):
         config = GeniaConfig()
-        return Quick.dataset(i, train_dset=genia_train, config=config, verbose=verbose)
+        return Quick.dataset(i, train_dset=quick_datasets["genia"], config=config, model=model, verbose=verbose)
 
     @staticmethod
-    def conll(i, model=OpenAIGPT(), verbose=True):
+    def conll(i, model=None, verbose=True):
         config = ConllConfig()
-        return Quick.dataset(i, train_dset=conll_train, config=config, model=model, verbose=verbose)
+        return Quick.dataset(i, train_dset=quick_datasets["conll"], config=config, model=model, verbose=verbose)
 
     @staticmethod
-    def crossner(i, model=OpenAIGPT(), verbose=True, category="ai"):
-        cats = ['politics', 'literature', 'ai', 'science', 'music']
+    def crossner(i, model=None, verbose=True, category="ai"):
+        cats = crossner_categories
         confs = [CrossNERPoliticsConfig(), CrossNERLiteratureConfig(), CrossNERAIConfig(),
                  CrossNERNaturalSciencesConfig(), CrossNERMusicConfig()]
         assert category in cats
         j = cats.index(category)
         print(j)
         config = confs[j]
-        return Quick.dataset(i, train_dset=cross_ner_train, config=config, model=model, verbose=verbose)
+        return Quick.dataset(i, train_dset=quick_datasets[f"crossner_{category}"], config=config, model=model,
+                             verbose=verbose)
 
     @staticmethod
-    def fewnerd(i, model=OpenAIGPT(), verbose=True, split="train"):
+    def fewnerd(i, model=None, verbose=True, split="train"):
         splits = ["train", "dev", "test"]
         confs = [FewNERDINTRATestConfig()]
         assert split in splits
         j = splits.index(split)
         config = confs[j]
-        return Quick.dataset(i, train_dset=few_nerd_train, config=config, model=model, verbose=verbose)
+        return Quick.dataset(i, train_dset=quick_datasets["fewnerd"], config=config, model=model, verbose=verbose)
+
+    @staticmethod
+    def session(model=None, warm=()):
+        """
+        Reads commands like "conll 5" or "crossner 3 science" until an empty line, the model and every dataset
+        loaded stay in memory between commands
+        """
+        Quick.model = Quick.get_model(model)
+        quick_datasets.warm(*warm)
+        commands = {"genia": Quick.genia, "conll": Quick.conll, "crossner": Quick.crossner,
+                    "fewnerd": Quick.fewnerd}
+        options = {"crossner": "category", "fewnerd": "split"}
+        while True:
+            inp = input("Quick> ").split()
+            if len(inp) == 0 or inp[0] in ["q", "quit", "exit"]:
+                return
+            if inp[0] not in commands or len(inp) < 2 or not inp[1].isdigit():
+                print(f"Usage: <{'|'.join(commands)}> <index> [category / split]")
+                continue
+            start = time.time()
+            try:
+                kwargs = {options[inp[0]]: inp[2]} if len(inp) > 2 and inp[0] in options else {}
+                commands[inp[0]](int(inp[1]), **kwargs)
+            except Exception as exception:  # keep the session (and everything loaded) alive
+                print(f"{type(exception).__name__}: {exception}")
+            print(f"Took {time.time() - start:.2f}s")
 
 
 e = Algorithm()
-genia_train = load_genia()
-conll_train = load_conll2003()
-few_nerd_train = load_few_nerd()
-cross_ner_train = load_cross_ner(category="ai")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+from collections import Counter
+
+import numpy as np
+
+
+def get_entities(seq):
+    # seqeval.metrics imports sklearn (over a second), so only on the first scored row
+    from seqeval.metrics.sequence_labeling import get_entities as seqeval_get_entities
+    return seqeval_get_entities(seq)
+
+
+class SpanMetrics:
+    """
+    Running entity level scores for a stream of (truth, pred) tag sequences.
+    Keeps per type true positive, predicted and true counts so the micro / macro f1 over everything added so far
+    costs O(#types) instead of rescoring the whole history. Gives the same numbers as seqeval's default f1_score:
+    seqeval joins the sentences with "O" so no entity crosses a sentence boundary, scoring row by row is equivalent
+    """
+    def __init__(self):
+        self.tp = Counter()
+        self.n_pred = Counter()
+        self.n_true = Counter()
+        self.n_rows = 0
+
+    @staticmethod
+    def row_counts(truth, pred):
+        truth = list(truth)
+        pred = list(pred)
+        if len(truth) != len(pred):
+            raise ValueError(f"Found input variables with inconsistent numbers of samples:\n"
+                             f"{len(truth)}\n{len(pred)}")
+        true_entities = set(get_entities(truth))
+        pred_entities = set(get_entities(pred))
+        tp = Counter(entity[0] for entity in true_entities & pred_entities)
+        n_pred = Counter(entity[0] for entity in pred_entities)
+        n_true = Counter(entity[0] for entity in true_entities)
+        return tp, n_pred, n_true
+
+    def add(self, truth, pred):
+        """
+        Adds one row and returns that row's own micro f1 (what f1_score([truth], [pred]) gives)
+        """
+        tp, n_pred, n_true = SpanMetrics.row_counts(truth, pred)
+        self.tp.update(tp)
+        self.n_pred.update(n_pred)
+        self.n_true.update(n_true)
+        self.n_rows += 1
+        return SpanMetrics.f1(sum(tp.values()), sum(n_pred.values()), sum(n_true.values()))
+
+    def merge(self, other):
+        self.tp.update(other.tp)
+        self.n_pred.update(other.n_pred)
+        self.n_true.update(other.n_true)
+        self.n_rows += other.n_rows
+        return self
+
+    def types(self):
+        return sorted(set(self.n_true) | set(self.n_pred))
+
+    @staticmethod
+    def f1(tp, n_pred, n_true):
+        # same arithmetic as seqeval, ill defined precision / recall are 0
+        precision = np.float64(tp / n_pred) if n_pred > 0 else np.float64(0)
+        recall = np.float64(tp / n_true) if n_true > 0 else np.float64(0)
+        denom = precision + recall
+        if denom == 0:
+            denom = 1
+        return 2 * precision * recall / denom
+
+    def micro_f1(self):
+        return SpanMetrics.f1(sum(self.tp.values()), sum(self.n_pred.values()), sum(self.n_true.values()))
+
+    def macro_f1(self):
+        types = self.types()
+        if len(types) == 0:
+            return np.float64("nan")  # seqeval averages over no types
+        return np.average([SpanMetrics.f1(self.tp[t], self.n_pred[t], self.n_true[t]) for t in types])
+
+    def per_type(self):
+        return {t: SpanMetrics.f1(self.tp[t], self.n_pred[t], self.n_true[t]) for t in self.types()}
+
+    def to_dict(self):
+        return {"tp": dict(self.tp), "n_pred": dict(self.n_pred), "n_true": dict(self.n_true),
+                "n_rows": self.n_rows}
+
+    @staticmethod
+    def from_dict(counts):
+        metrics = SpanMetrics()
+        metrics.tp.update(counts["tp"])
+        metrics.n_pred.update(counts["n_pred"])
+        metrics.n_true.update(counts["n_true"])
+        metrics.n_rows = counts["n_rows"]
+        return metrics
@@ -1,8 +1,10 @@
+import functools
 import os
-from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+import threading
 import openai
 
 import utils
+from ratelimit import RateLimiter, estimate_tokens
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
@@ -12,63 +14,360 @@ class OpenAIGPT:
     #model = "gpt-4"
     model = "gpt-3.5-turbo"
     #model = "davinci"
-    seconds_per_query = (60 / 20) + 0.01
+    rate_limiter = RateLimiter(requests_per_minute=20, tokens_per_minute=40000)
+    max_tokens = 250
+    supports_budget = True  # the calls below take budget=, the max_tokens of that request (see budget.TokenBudget)
+
+    @staticmethod
+    def create_completion(prompt, budget=None):
+        return openai.Completion.create(model=OpenAIGPT.model, prompt=prompt,
+                                        max_tokens=OpenAIGPT.max_tokens if budget is None else budget)
+
+    @staticmethod
+    def create_chat_completion(messages, budget=None):
+        return openai.ChatCompletion.create(model=OpenAIGPT.model, messages=messages, **OpenAIGPT.chat_limit(budget))
+
+    @staticmethod
+    def create_completion_stream(prompt, budget=None):
+        return openai.Completion.create(model=OpenAIGPT.model, prompt=prompt,
+                                        max_tokens=OpenAIGPT.max_tokens if budget is None else budget, stream=True)
+
+    @staticmethod
+    def create_chat_completion_stream(messages, budget=None):
+        return openai.ChatCompletion.create(model=OpenAIGPT.model, messages=messages, stream=True,
+                                            **OpenAIGPT.chat_limit(budget))
+
     @staticmethod
-    def request_model(prompt):
-        return openai.Completion.create(model=OpenAIGPT.model, prompt=prompt, max_tokens=250)
+    def chat_limit(budget):
+        # chat requests are only limited when given a budget, like before budgets existed
+        return {} if budget is None else {"max_tokens": budget}
 
     @staticmethod
-    def request_chat_model(msgs):
+    def reserved_tokens(inputs, budget=None):
+        return estimate_tokens(inputs, OpenAIGPT.max_tokens if budget is None else budget)
+
+    @staticmethod
+    def to_messages(msgs):
         messages = []
         for message in msgs:
             content, role = message
             messages.append({"role": role, "content": content})
-        return openai.ChatCompletion.create(model=OpenAIGPT.model, messages=messages)
+        return messages
+
+    @staticmethod
+    def request_model(prompt, budget=None):
+        return OpenAIGPT.rate_limiter.call(functools.partial(OpenAIGPT.create_completion, budget=budget), prompt,
+                                           n_tokens=OpenAIGPT.reserved_tokens(prompt, budget))
+
+    @staticmethod
+    def request_chat_model(msgs, budget=None):
+        return OpenAIGPT.rate_limiter.call(functools.partial(OpenAIGPT.create_chat_completion, budget=budget),
+                                           OpenAIGPT.to_messages(msgs), n_tokens=OpenAIGPT.reserved_tokens(msgs, budget))
 
     @staticmethod
     def decode_response(response):
+        """
+        The text of a response as a utils.Completion, which also tells its finish_reason
+        """
+        choice = response["choices"][0]
         if OpenAIGPT.is_chat():
-            return response["choices"][0]["message"]["content"]
+            return utils.Completion(choice["message"]["content"], choice.get("finish_reason"))
         else:
-            return response["choices"][0]["text"]
+            return utils.Completion(choice["text"], choice.get("finish_reason"))
 
     @staticmethod
-    def query(prompt):
-        return OpenAIGPT.decode_response(OpenAIGPT.request_model(prompt))
+    def decode_chunk(chunk):
+        if OpenAIGPT.is_chat():
+            return chunk["choices"][0]["delta"].get("content", "")
+        else:
+            return chunk["choices"][0]["text"]
 
     @staticmethod
-    def chat_query(msgs):
-        return OpenAIGPT.decode_response(OpenAIGPT.request_chat_model(msgs))
+    def query(prompt, budget=None):
+        return OpenAIGPT.decode_response(OpenAIGPT.request_model(prompt, budget=budget))
+
+    @staticmethod
+    def stream(inputs, budget=None):
+        """
+        Yields the response to inputs (a prompt or chat messages) piece by piece as it arrives, closing the
+        generator stops reading the response
+        """
+        if OpenAIGPT.is_chat():
+            response = OpenAIGPT.rate_limiter.call(
+                functools.partial(OpenAIGPT.create_chat_completion_stream, budget=budget),
+                OpenAIGPT.to_messages(inputs), n_tokens=OpenAIGPT.reserved_tokens(inputs, budget))
+        else:
+            response = OpenAIGPT.rate_limiter.call(
+                functools.partial(OpenAIGPT.create_completion_stream, budget=budget), inputs,
+                n_tokens=OpenAIGPT.reserved_tokens(inputs, budget))
+        try:
+            for chunk in response:
+                text = OpenAIGPT.decode_chunk(chunk)
+                if text:
+                    yield text
+        finally:
+            response.close()
+
+    @staticmethod
+    def chat_query(msgs, budget=None):
+        return OpenAIGPT.decode_response(OpenAIGPT.request_chat_model(msgs, budget=budget))
 
     @staticmethod
     def is_chat():
         return OpenAIGPT.model in ["gpt-4", "gpt-3.5-turbo"]
 
     @staticmethod
-    def __call__(inputs):
+    def decoding_params():
+        if OpenAIGPT.is_chat():
+            return {}
+        else:
+            return {"max_tokens": OpenAIGPT.max_tokens}
+
+    @staticmethod
+    def __call__(inputs, budget=None):
+        if OpenAIGPT.is_chat():
+            return OpenAIGPT.chat_query(inputs, budget=budget)
+        else:
+            return OpenAIGPT.query(inputs, budget=budget)
+
+
+class AsyncOpenAIGPT(OpenAIGPT):
+    """
+    OpenAIGPT that can also be awaited, used by run.eval_dataset to keep several requests in flight.
+    Calling it synchronously behaves exactly like OpenAIGPT
+    """
+    @staticmethod
+    async def acreate_completion(prompt, budget=None):
+        return await openai.Completion.acreate(model=OpenAIGPT.model, prompt=prompt,
+                                               max_tokens=OpenAIGPT.max_tokens if budget is None else budget)
+
+    @staticmethod
+    async def acreate_chat_completion(messages, budget=None):
+        return await openai.ChatCompletion.acreate(model=OpenAIGPT.model, messages=messages,
+                                                   **OpenAIGPT.chat_limit(budget))
+
+    @staticmethod
+    async def arequest_model(prompt, budget=None):
+        return await OpenAIGPT.rate_limiter.acall(functools.partial(AsyncOpenAIGPT.acreate_completion, budget=budget),
+                                                  prompt, n_tokens=OpenAIGPT.reserved_tokens(prompt, budget))
+
+    @staticmethod
+    async def arequest_chat_model(msgs, budget=None):
+        return await OpenAIGPT.rate_limiter.acall(
+            functools.partial(AsyncOpenAIGPT.acreate_chat_completion, budget=budget), OpenAIGPT.to_messages(msgs),
+            n_tokens=OpenAIGPT.reserved_tokens(msgs, budget))
+
+    @staticmethod
+    async def acall(inputs, budget=None):
         if OpenAIGPT.is_chat():
-            return OpenAIGPT.chat_query(inputs)
+            response = await AsyncOpenAIGPT.arequest_chat_model(inputs, budget=budget)
         else:
-            return OpenAIGPT.query(inputs)
+            response = await AsyncOpenAIGPT.arequest_model(inputs, budget=budget)
+        return OpenAIGPT.decode_response(response)
 
 
 class HugginFaceModel:
-    def query(self, prompt):
-        inputs = self.tokenizer(prompt, return_tensors="pt").to(utils.Parameters.devices[0])
-        outputs = self.model.generate(**inputs, max_new_tokens=200)
-        return self.tokenizer.batch_decode(outputs, skip_special_tokens=True)[0]
+    name = None
+    max_new_tokens = 200
+    reuse_prefix = True
+    max_cached_prefixes = 16
+    stop_at_list_end = False  # end generation once the answer list is over (utils.AnswerStream.list_end)
+    supports_budget = True
+
+    def input_device(self):
+        return utils.Parameters.devices[0]
+
+    def prefix_token_ids(self, prompt):
+        """
+        Token ids of the prefix of a PrefixedPrompt, tokenized once per distinct prefix. The first time a prefix is
+        seen the prefix + suffix ids are checked against tokenizing the full prompt, if the split changes the
+        tokenization that prefix is marked unusable (None) and prompts with it are tokenized whole.
+        Only the tokenization is reused, the encoder states of the prefix can not be, the seq2seq encoders used here
+        attend in both directions so the prefix states depend on the paragraph after it
+        """
+        if not hasattr(self, "prefix_cache"):
+            self.prefix_cache = {}
+        if prompt.prefix not in self.prefix_cache:
+            if len(self.prefix_cache) >= self.max_cached_prefixes:
+                self.prefix_cache.clear()
+            prefix_ids = self.tokenizer(prompt.prefix, add_special_tokens=False)["input_ids"]
+            split_ids = prefix_ids + self.tokenizer(prompt.suffix)["input_ids"]
+            if split_ids != self.tokenizer(str(prompt))["input_ids"]:
+                prefix_ids = None
+            self.prefix_cache[prompt.prefix] = prefix_ids
+        return self.prefix_cache[prompt.prefix]
+
+    def encode(self, prompt):
+        if self.reuse_prefix and isinstance(prompt, utils.PrefixedPrompt):
+            prefix_ids = self.prefix_token_ids(prompt)
+            if prefix_ids is not None:
+                return prefix_ids + self.tokenizer(prompt.suffix)["input_ids"]
+        return self.tokenizer(str(prompt))["input_ids"]
+
+    def generation_kwargs(self, budget=None, stop=None):
+        """
+        max_new_tokens (budget if given) and the stopping criteria of a generate call, stop() ends it early
+        """
+        from transformers import StoppingCriteriaList
+
+        criteria = []
+        if stop is not None:
+            criteria.append(stop_when(stop))
+        if self.stop_at_list_end:
+            criteria.append(list_end_criterion(self.tokenizer))
+        return {"max_new_tokens": self.max_new_tokens if budget is None else budget,
+                "stopping_criteria": StoppingCriteriaList(criteria)}
+
+    def cut(self, output):
+        """
+        output without whatever the model generated after the answer list, the stopping criterion only runs after
+        each token so the last one may already be past the end. Off by default, an item list_end mistakes for the
+        start of something else is dropped with the rest
+        """
+        if self.stop_at_list_end:
+            end = utils.AnswerStream.list_end(output)
+            if end is not None:
+                return output[:end].rstrip()
+        return output
+
+    def query(self, prompt, budget=None):
+        inputs = self.tokenizer.pad({"input_ids": [self.encode(prompt)]}, return_tensors="pt").to(self.input_device())
+        outputs = self.model.generate(**inputs, **self.generation_kwargs(budget))
+        return self.cut(self.tokenizer.batch_decode(outputs, skip_special_tokens=True)[0])
+
+    def batch_query(self, prompts, batch_size=8, budgets=None):
+        """
+        Generates for many prompts at once. Prompts are sorted by token length and cut into micro batches of
+        batch_size so each generate call pads as little as possible, outputs are returned in input order.
+        budgets (one per prompt) limit the new tokens, a micro batch gets the largest budget of its prompts
+        """
+        encodings = [self.encode(prompt) for prompt in prompts]
+        order = sorted(range(len(prompts)), key=lambda i: len(encodings[i]))
+        outputs = [None for prompt in prompts]
+        for start in range(0, len(order), batch_size):
+            indices = order[start:start+batch_size]
+            batch = self.tokenizer.pad({"input_ids": [encodings[i] for i in indices]}, return_tensors="pt")
+            batch = batch.to(self.input_device())
+            budget = None if budgets is None else max(budgets[i] for i in indices)
+            generated = self.model.generate(**batch, **self.generation_kwargs(budget))
+            decoded = self.tokenizer.batch_decode(generated, skip_special_tokens=True)
+            for i, output in zip(indices, decoded):
+                outputs[i] = self.cut(output)
+        return outputs
+
+    def stream(self, prompt, budget=None):
+        """
+        Yields the generated text piece by piece while generate runs in a background thread, closing the generator
+        stops the generation at its next token. The pieces are not cut at the end of the list like query, the
+        reader sees that end itself (utils.AnswerStream.finished). An exception in generate ends the stream and is
+        raised again here
+        """
+        from transformers import TextIteratorStreamer
+
+        cancelled = threading.Event()
+        failure = []
+        streamer = TextIteratorStreamer(self.tokenizer, skip_special_tokens=True)
+        inputs = self.tokenizer.pad({"input_ids": [self.encode(prompt)]}, return_tensors="pt").to(self.input_device())
 
-    def __call__(self, prompt):
-        return self.query(prompt)
+        def generate():
+            try:
+                self.model.generate(**inputs, streamer=streamer, **self.generation_kwargs(budget, stop=cancelled.is_set))
+            except BaseException as e:
+                failure.append(e)
+            finally:
+                streamer.end()  # wakes the reader even when generate failed before writing anything
+
+        generation = threading.Thread(target=generate, daemon=True)
+        generation.start()
+        try:
+            for text in streamer:
+                if text:
+                    yield text
+        finally:
+            cancelled.set()
+            generation.join()
+        if len(failure) > 0:
+            raise failure[0]
+
+    def decoding_params(self):
+        if self.stop_at_list_end:
+            return {"max_new_tokens": self.max_new_tokens, "stop_at_list_end": True}
+        return {"max_new_tokens": self.max_new_tokens}
+
+    def __call__(self, prompt, budget=None):
+        return self.query(prompt, budget=budget)
+
+
+def stop_when(condition):
+    """
+    Stopping criterion for generate that ends every sequence once condition() is true
+    """
+    import torch
+    from transformers import StoppingCriteria
+
+    class Condition(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return torch.full((input_ids.shape[0],), condition(), dtype=torch.bool, device=input_ids.device)
+
+    return Condition()
+
+
+def list_end_criterion(tokenizer):
+    """
+    Stopping criterion for generate that ends each sequence of a batch on its own once the text it decodes to has a
+    complete answer list (utils.AnswerStream.list_end). The input_ids it sees are the decoder ids of the seq2seq
+    models here, i.e. only the generated text. Each step only decodes the new tokens (with the one before them so
+    the spacing between tokens comes out as in a full decode) and feeds that text to a utils.ListEnd per sequence
+    """
+    import torch
+    from transformers import StoppingCriteria
+
+    class ListEnd(StoppingCriteria):
+        def __init__(self):
+            self.ends = []
+            self.offsets = []  # (first token of the decoding context, first token not decoded yet) per sequence
+
+        def new_text(self, i, ids):
+            context, start = self.offsets[i]
+            if start == len(ids):
+                return ""
+            known = tokenizer.decode(ids[context:start], skip_special_tokens=True)
+            text = tokenizer.decode(ids[context:], skip_special_tokens=True)
+            if text.endswith("\ufffd"):
+                return ""  # a character split over several tokens, wait for the rest of it
+            self.offsets[i] = (start, len(ids))
+            return text[len(known):]
+
+        def __call__(self, input_ids, scores, **kwargs):
+            while len(self.ends) < input_ids.shape[0]:
+                self.ends.append(utils.ListEnd())
+                self.offsets.append((0, 0))
+            ids = input_ids.tolist()
+            return torch.tensor([self.ends[i].feed(self.new_text(i, ids[i])) for i in range(len(ids))],
+                                dtype=torch.bool, device=input_ids.device)
+
+    return ListEnd()
+
+
+def load_seq2seq(name):
+    """
+    (model, tokenizer) of a HF seq2seq checkpoint. transformers (and torch) are imported here and not at the top so
+    that the OpenAI only code paths never pay for them
+    """
+    from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+    return AutoModelForSeq2SeqLM.from_pretrained(name), AutoTokenizer.from_pretrained(name, model_max_length=600)
 
 
 class T5(HugginFaceModel):
     def __init__(self, size="large"):
-        self.model = AutoModelForSeq2SeqLM.from_pretrained(f"google/flan-t5-{size}").to(utils.Parameters.devices[0])
-        self.tokenizer = AutoTokenizer.from_pretrained(f"google/flan-t5-{size}", model_max_length=600)
+        self.name = f"google/flan-t5-{size}"
+        self.model, self.tokenizer = load_seq2seq(self.name)
+        self.model = self.model.to(utils.Parameters.devices[0])
 
 
 class ParallelHuggingFaceModel(HugginFaceModel):
+    max_new_tokens = 600
+
     def parallel(self, num_layers=24, num_devices=4):
         self.devices = utils.Parameters.get_device_ints(num_devices)
         layer_per_device = num_layers // num_devices
@@ -82,17 +381,15 @@ class ParallelHuggingFaceModel(HugginFaceModel):
                 start = start + layer_per_device
         self.model.parallelize(device_map)
 
-    def query(self, prompt):
-        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.devices[0])
-        outputs = self.model.generate(**inputs, max_new_tokens=600)
-        return self.tokenizer.batch_decode(outputs, skip_special_tokens=True)[0]
+    def input_device(self):
+        return self.devices[0]
 
 
 class T5XL(ParallelHuggingFaceModel):
     def __init__(self, size="xxl"):
         assert size in ["xl", "xxl"]
-        self.model = AutoModelForSeq2SeqLM.from_pretrained(f"google/flan-t5-{size}")
-        self.tokenizer = AutoTokenizer.from_pretrained(f"google/flan-t5-{size}", model_max_length=600)
+        self.name = f"google/flan-t5-{size}"
+        self.model, self.tokenizer = load_seq2seq(self.name)
         self.parallel(num_layers=24, num_devices=4)
 
 
@@ -100,6 +397,6 @@ class Alpaca(ParallelHuggingFaceModel):
     def __init__(self, size="base"):
         assert size in ["base", "large",  "gpt4-xl", "xl", "xxl"]
         layer_sizes = {"base": 12, "large": 24, "xl": 24, "gpt4-xl": 24, "xxl": 24}
-        self.tokenizer = AutoTokenizer.from_pretrained(f"declare-lab/flan-alpaca-{size}", model_max_length=600)
-        self.model = AutoModelForSeq2SeqLM.from_pretrained(f"declare-lab/flan-alpaca-{size}")
+        self.name = f"declare-lab/flan-alpaca-{size}"
+        self.model, self.tokenizer = load_seq2seq(self.name)
         self.parallel(num_layers=layer_sizes[size], num_devices=4)
\ No newline at end of file
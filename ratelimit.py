@@ -0,0 +1,199 @@
+import asyncio
+import multiprocessing
+import random
+import threading
+import time
+
+import openai
+
+
+def estimate_tokens(inputs, completion_tokens=0):
+    """
+    Rough token count of a prompt (str) or chat message list [(content, role), ...], ~4 characters per token
+    OpenAI counts the requested completion length against the tokens per minute budget as well
+    """
+    if isinstance(inputs, str):
+        n_chars = len(inputs)
+        n_messages = 0
+    else:
+        n_chars = sum(len(content) for content, role in inputs)
+        n_messages = len(inputs)
+    return n_chars // 4 + 4 * n_messages + completion_tokens
+
+
+class TokenBucket:
+    """
+    Holds up to capacity units and refills at per_minute / 60 units per second.
+    A take larger than the capacity is allowed once the bucket is full and leaves it in debt
+    """
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60
+        self.capacity = capacity if capacity is not None else max(1, self.rate)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        self.refill(now)
+        needed = min(amount, self.capacity)
+        if self.level >= needed:
+            return 0
+        return (needed - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= amount
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    TokenBucket whose level lives in shared memory, so processes started with it draw from one budget.
+    time.monotonic is system wide, so the refill time stamp means the same thing in every process
+    """
+    def __init__(self, per_minute, capacity=None, context=multiprocessing):
+        self.shared = context.RawArray("d", 2)  # level, updated
+        super().__init__(per_minute, capacity)
+
+    @property
+    def level(self):
+        return self.shared[0]
+
+    @level.setter
+    def level(self, value):
+        self.shared[0] = value
+
+    @property
+    def updated(self):
+        return self.shared[1]
+
+    @updated.setter
+    def updated(self, value):
+        self.shared[1] = value
+
+
+class RateLimiter:
+    """
+    Keeps model calls inside a requests per minute and tokens per minute budget.
+    The buckets refill in wall time, so time spent waiting on the previous response counts towards the next slot
+    instead of being added on top of it. 429s are retried with exponential backoff and full jitter
+    """
+    def __init__(self, requests_per_minute=20, tokens_per_minute=40000, burst_seconds=1,
+                 base_delay=1, max_delay=60, max_retries=None):
+        self.requests = TokenBucket(requests_per_minute, max(1, requests_per_minute * burst_seconds / 60))
+        self.tokens = None
+        if tokens_per_minute is not None:
+            self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute * burst_seconds / 60)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.lock = threading.Lock()
+        self.n_rate_limited = 0
+
+    def try_acquire(self, n_tokens=0):
+        """
+        Takes a slot if one is free and returns 0, else returns how many seconds to wait before trying again
+        """
+        with self.lock:
+            now = time.monotonic()
+            wait = self.requests.wait_time(1, now)
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.wait_time(n_tokens, now))
+            if wait == 0:
+                self.requests.take(1)
+                if self.tokens is not None:
+                    self.tokens.take(n_tokens)
+            return wait
+
+    def acquire(self, n_tokens=0):
+        wait = self.try_acquire(n_tokens)
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.try_acquire(n_tokens)
+
+    async def aacquire(self, n_tokens=0):
+        wait = self.try_acquire(n_tokens)
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self.try_acquire(n_tokens)
+
+    def settle(self, estimated_tokens, used_tokens):
+        """
+        Corrects the token bucket once the response reports how many tokens were actually used
+        """
+        if self.tokens is None or used_tokens is None:
+            return
+        with self.lock:
+            self.tokens.take(used_tokens - estimated_tokens)
+
+    def backoff_delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def rate_limited(self):
+        """
+        Called on a 429, empties the request bucket so every caller sharing this limiter holds off
+        """
+        with self.lock:
+            self.n_rate_limited += 1
+            self.requests.refill(time.monotonic())
+            self.requests.level = min(self.requests.level, 0)
+
+    def should_retry(self, attempt):
+        return self.max_retries is None or attempt < self.max_retries
+
+    def call(self, fn, inputs, n_tokens=0):
+        attempt = 0
+        while True:
+            self.acquire(n_tokens)
+            try:
+                response = fn(inputs)
+            except openai.error.RateLimitError:
+                self.rate_limited()
+                if not self.should_retry(attempt):
+                    raise
+                time.sleep(self.backoff_delay(attempt))
+                attempt += 1
+                continue
+            self.settle(n_tokens, RateLimiter.used_tokens(response))
+            return response
+
+    async def acall(self, fn, inputs, n_tokens=0):
+        attempt = 0
+        while True:
+            await self.aacquire(n_tokens)
+            try:
+                response = await fn(inputs)
+            except openai.error.RateLimitError:
+                self.rate_limited()
+                if not self.should_retry(attempt):
+                    raise
+                await asyncio.sleep(self.backoff_delay(attempt))
+                attempt += 1
+                continue
+            self.settle(n_tokens, RateLimiter.used_tokens(response))
+            return response
+
+    @staticmethod
+    def used_tokens(response):
+        try:
+            return response["usage"]["total_tokens"]
+        except (KeyError, TypeError):
+            return None
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    RateLimiter whose buckets and lock are shared between processes. It can only be handed to a process when the
+    process is started (e.g. through a ProcessPoolExecutor initializer), after that every process using it stays
+    within one global requests / tokens per minute budget
+    """
+    def __init__(self, requests_per_minute=20, tokens_per_minute=40000, burst_seconds=1,
+                 base_delay=1, max_delay=60, max_retries=None, context=multiprocessing):
+        super().__init__(requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute,
+                         burst_seconds=burst_seconds, base_delay=base_delay, max_delay=max_delay,
+                         max_retries=max_retries)
+        self.requests = SharedTokenBucket(requests_per_minute, self.requests.capacity, context)
+        if self.tokens is not None:
+            self.tokens = SharedTokenBucket(tokens_per_minute, self.tokens.capacity, context)
+        self.lock = context.Lock()
@@ -1,3 +1,5 @@
+import asyncio
+import copy
 import numpy as np
 from algorithms import *
 from data import *
@@ -5,64 +7,272 @@ from tqdm import tqdm
 import time
 import pandas as pd
 import openai
-from seqeval.metrics import f1_score
+from metrics import SpanMetrics
+from models import OpenAIGPT, AsyncOpenAIGPT, Alpaca
+from cache import ResponseCache, CachedModel
+from typememo import TypeMemo
+from checkpoint import Checkpoint
+from sweep import sweep
+from shard import Shard
+from ratelimit import estimate_tokens
+from budget import TokenBudget
 
 
-def eval_dataset(val, model, algorithm, sleep_between_queries=None, print_every=10):
+def perform_span(algorithm, para, true_tokens=None, sleep_between_queries=None):
+    algorithm.set_para(para)
+    if sleep_between_queries is not None:
+        time.sleep(sleep_between_queries)
+    try:
+        return algorithm.perform_span(true_tokens=true_tokens, verbose=False)
+    except IndexError:
+        return None
+
+
+async def perform_spans_async(algorithm, rows, concurrency=8, sleep_between_queries=None, on_result=None):
+    """
+    Runs perform_span_async for every (para, true_tokens) in rows with at most concurrency requests in flight
+    sleep_between_queries (if given) is the minimum gap between two requests being sent out
+    Returns results in the same order as rows, None for rows that could not be aligned
+    on_result (if given) is called with (row number, result) as soon as each row finishes, in completion order.
+    If a row raises no further rows are sent, the rows already in flight finish (and reach on_result) and then the
+    first error is raised
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    progress = tqdm(total=len(rows))
+    failures = []
+
+    async def worker(i, para, true_tokens):
+        alg = copy.copy(algorithm)  # set_para mutates, every in flight row gets its own copy
+        alg.set_para(para)
+        try:
+            result = await alg.perform_span_async(true_tokens=true_tokens, verbose=False)
+        except IndexError:
+            result = None
+        except Exception as e:
+            failures.append(e)
+            raise
+        finally:
+            semaphore.release()
+            progress.update(1)
+        if on_result is not None:
+            on_result(i, result)
+        return result
+
+    tasks = []
+    for i, (para, true_tokens) in enumerate(rows):
+        await semaphore.acquire()
+        if len(failures) > 0:
+            semaphore.release()
+            break
+        tasks.append(asyncio.create_task(worker(i, para, true_tokens)))
+        if sleep_between_queries is not None:
+            await asyncio.sleep(sleep_between_queries)
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    progress.close()
+    if len(failures) > 0:
+        raise failures[0]
+    return results
+
+
+def perform_spans_batched(algorithm, rows, batch_size=8, chunk_size=None, on_result=None):
+    """
+    Feeds rows to model_fn.batch_query (HugginFaceModel) chunk_size rows at a time, the model splits each chunk
+    into length bucketed micro batches of batch_size. Returns results in the same order as rows
+    """
+    if chunk_size is None:
+        chunk_size = batch_size * 4
+    results = []
+    for start in tqdm(range(0, len(rows), chunk_size)):
+        chunk = rows[start:start+chunk_size]
+        inputs = []
+        budgets = []
+        for para, true_tokens in chunk:
+            algorithm.set_para(para)
+            inputs.append(algorithm.query_input())
+            budgets.append(algorithm.answer_budget())
+        if None in budgets:
+            outputs = algorithm.model_fn.batch_query(inputs, batch_size=batch_size)
+        else:
+            outputs = algorithm.model_fn.batch_query(inputs, batch_size=batch_size, budgets=budgets)
+        for (para, true_tokens), output in zip(chunk, outputs):
+            algorithm.set_para(para)
+            try:
+                results.append(algorithm.span_from_output(output, true_tokens=true_tokens))
+            except IndexError:
+                results.append(None)
+            if on_result is not None:
+                on_result(len(results) - 1, results[-1])
+    return results
+
+
+def pack_rows(algorithm, rows, token_budget=3000, answer_tokens=150, max_pack=10):
+    """
+    Greedily groups consecutive rows so that the shared prompt plus every packed paragraph and its expected answer
+    (answer_tokens each) stays within token_budget. Returns lists of row indices, a row that does not fit with any
+    other gets a group of its own
+    """
+    prefix_tokens = algorithm.compiled_prompt().n_tokens(chat=algorithm.is_chat_model())
+    groups = []
+    group = []
+    used = prefix_tokens
+    for i, (para, true_tokens) in enumerate(rows):
+        cost = estimate_tokens(f"Paragraph {len(group)+1}: {para} \n") + answer_tokens
+        if len(group) > 0 and (used + cost > token_budget or len(group) >= max_pack):
+            groups.append(group)
+            group = []
+            used = prefix_tokens
+        group.append(i)
+        used += cost
+    if len(group) > 0:
+        groups.append(group)
+    return groups
+
+
+def perform_spans_packed(algorithm, rows, token_budget=3000, answer_tokens=150, on_result=None):
+    """
+    Annotates several paragraphs per model request (see Algorithm.perform_packed), returns results in row order
+    """
+    results = [None for row in rows]
+    for group in tqdm(pack_rows(algorithm, rows, token_budget=token_budget, answer_tokens=answer_tokens)):
+        outputs = algorithm.perform_packed([rows[i][0] for i in group], answer_tokens=answer_tokens)
+        for i, output in zip(group, outputs):
+            para, true_tokens = rows[i]
+            algorithm.set_para(para)
+            try:
+                results[i] = algorithm.span_from_output(output, true_tokens=true_tokens)
+            except IndexError:
+                results[i] = None
+            if on_result is not None:
+                on_result(i, results[i])
+    return results
+
+
+def row_input(q):
+    """
+    The (paragraph, true_tokens) a record is queried with
+    """
+    true_tokens = None
+    if "true_tokens" in q:
+        true_tokens = q["true_tokens"]
+    return q['text'], true_tokens
+
+
+def eval_dataset(val, model, algorithm, sleep_between_queries=None, print_every=10, concurrency=None,
+                 batch_size=None, pack_token_budget=None, checkpoint=None, run_index=0, metrics=None):
+    """
+    If concurrency is given the model must support acall (e.g. AsyncOpenAIGPT) and that many rows are queried at
+    once, if batch_size is given the model must support batch_query (HugginFaceModel) and rows are generated in
+    batches, if pack_token_budget is given several rows are packed into each request up to that many tokens.
+    In every mode the rows are then scored in their original order so the results match the serial loop.
+    checkpoint: a Checkpoint, every row is logged to it as it finishes and rows it already holds for run_index are
+    taken from it instead of being queried again
+    metrics: a SpanMetrics to accumulate the span counts into, a new one by default
+    val is a DataFrame or any iterable of records with the same fields (e.g. data.stream_ob2). The serial loop takes
+    the records one at a time, so a stream is never held in memory. The concurrency, batch_size and
+    pack_token_budget paths are not constant memory: they read every record up front to schedule the queries
+    """
     algorithm.set_model_fn(model)
     columns = ["text", "entities", "truth", "pred", "meta", "f1"]
     data = []
-    preds, truths = [], []
-    for i, info in tqdm(enumerate(val.iterrows()), total=len(val)):
-        index, q = info
-        para = q['text']
+    if metrics is None:
+        metrics = SpanMetrics()
+    if isinstance(val, pd.DataFrame):
+        records = (q for index, q in val.iterrows())
+    else:
+        records = val
+    total = len(val) if hasattr(val, "__len__") else None
+    results = None
+    if concurrency is not None or batch_size is not None or pack_token_budget is not None:
+        records = list(records)
+        rows = [row_input(q) for q in records]
+        todo = list(range(len(rows)))
+        on_result = None
+        if checkpoint is not None:
+            results = checkpoint.finished(run_index, [para for para, true_tokens in rows])
+            todo = [i for i in range(len(rows)) if i not in results]
+            if len(results) > 0:
+                print(f"Resuming from {checkpoint.path}: {len(results)} rows already done, {len(todo)} to go")
+
+            def on_result(j, result):
+                checkpoint.log_row(run_index, todo[j], rows[todo[j]][0], result)
+        todo_rows = [rows[i] for i in todo]
+        if concurrency is not None:
+            outputs = asyncio.run(perform_spans_async(algorithm, todo_rows, concurrency=concurrency,
+                                                      sleep_between_queries=sleep_between_queries,
+                                                      on_result=on_result))
+        elif batch_size is not None:
+            outputs = perform_spans_batched(algorithm, todo_rows, batch_size=batch_size, on_result=on_result)
+        else:
+            outputs = perform_spans_packed(algorithm, todo_rows, token_budget=pack_token_budget,
+                                           on_result=on_result)
+        results = dict(results or {})
+        results.update(zip(todo, outputs))
+        iterator = enumerate(records)
+    else:
+        if checkpoint is not None and len(checkpoint.rows.get(run_index, {})) > 0:
+            print(f"Resuming from {checkpoint.path}: {len(checkpoint.rows[run_index])} rows logged for this run")
+        iterator = tqdm(enumerate(records), total=total)
+    for i, q in iterator:
+        para, true_tokens = row_input(q)
         entities = q['entities']
         subdata = [para, entities, q['exact_types']]
-        algorithm.set_para(para)
-        if sleep_between_queries is not None:
-            time.sleep(sleep_between_queries)
-        types = None
-        flag = False
-        while not flag:
-            try:
-                true_tokens = None
-                if "true_tokens" in val.columns:
-                    true_tokens = q["true_tokens"]
-                span_pred, meta = algorithm.perform_span(true_tokens=true_tokens, verbose=False)
-                p = [span_pred]
-                t = [q['exact_types']]
-                preds.append(span_pred)
-                truths.append(q['exact_types'])
-                mini_f1 = f1_score(t, p)
-                subdata.extend([span_pred, meta, mini_f1])
-                data.append(subdata)
-                f1_micro = f1_score(truths, preds, average="micro")
-                flag = True
-            except openai.error.RateLimitError:
-                time.sleep(0.5)
-            except IndexError:
-                flag = True
+        record = None if checkpoint is None or results is not None else checkpoint.finished_row(run_index, i, para)
+        if results is not None and i in results:
+            result = results[i]
+        elif record is not None:
+            result = Checkpoint.result(record)
+        else:
+            result = perform_span(algorithm, para, true_tokens=true_tokens,
+                                  sleep_between_queries=sleep_between_queries)
+            if checkpoint is not None:
+                checkpoint.log_row(run_index, i, para, result)
+        if result is not None:
+            span_pred, meta = result
+            mini_f1 = metrics.add(q['exact_types'], span_pred)
+            subdata.extend([span_pred, meta, mini_f1])
+            data.append(subdata)
         if print_every is not None:
             if i % print_every == 0:
-                f1_micro = f1_score(truths, preds, average="micro")
-                f1_macro = f1_score(truths, preds, average="macro")
-                print(f"Iteration {i}: micro f1: {f1_micro}, macro f1: {f1_macro}")
-    f1_micro = f1_score(truths, preds, average="micro")
-    f1_macro = f1_score(truths, preds, average="macro")
+                print(f"Iteration {i}: micro f1: {metrics.micro_f1()}, macro f1: {metrics.macro_f1()}")
+    f1_micro = metrics.micro_f1()
+    f1_macro = metrics.macro_f1()
     print(f"Finally: micro f1: {f1_micro}, macro f1: {f1_macro}")
     df = pd.DataFrame(data=data, columns=columns)
     return f1_micro, f1_macro, df
 
 
-def complete_eval(dataset, model, algorithm, n_runs=2, sleep_between_queries=None, limit=None):
+def eval_kwargs(kwargs):
+    """
+    Drops the arguments that only the eval_<dataset> functions use, the rest are passed through to eval_dataset
+    """
+    kwargs = dict(kwargs)
+    kwargs.pop("add_info", None)
+    return kwargs
+
+
+def complete_eval(dataset, model, algorithm, n_runs=2, sleep_between_queries=None, limit=None, checkpoint=None,
+                  shard=None, **kwargs):
+    """
+    shard: a Shard, only its part of the (sampled) rows is evaluated and every run is recorded on it
+    """
     micros = []
     macros = []
     for i in range(n_runs):
-        if limit is not None:
+        if limit is not None and shard is not None:
+            small_dataset = shard.sample(i, dataset, limit)
+        elif limit is not None and checkpoint is not None:
+            small_dataset = checkpoint.sample(i, dataset, limit)
+        elif limit is not None:
             small_dataset = dataset.sample(limit)
         else:
             small_dataset = dataset
-        f1_micro, f1_macro, df = eval_dataset(small_dataset, model, algorithm, sleep_between_queries=sleep_between_queries)
+        metrics = SpanMetrics()
+        if shard is not None:
+            small_dataset = shard.select(small_dataset)
+        f1_micro, f1_macro, df = eval_dataset(small_dataset, model, algorithm, sleep_between_queries=sleep_between_queries,
+                                              checkpoint=checkpoint, run_index=i, metrics=metrics, **kwargs)
+        if shard is not None:
+            shard.add_run(i, metrics, df)
         micros.append(f1_micro)
         macros.append(f1_macro)
     micros = np.array(micros)
@@ -85,7 +295,7 @@ def eval_conll(model, algorithm, n_runs=2, sleep_between_queries=None, limit=Non
     config.set_config(algorithm, exemplar=exemplar, coT=coT, defn=defn, tf=tf)
     conll = load_conll2003("test")
     return complete_eval(conll, model, algorithm, n_runs=n_runs, sleep_between_queries=sleep_between_queries,
-                         limit=limit)
+                         limit=limit, **eval_kwargs(kwargs))
 
 
 def eval_genia(model, algorithm, n_runs=2, sleep_between_queries=None, limit=None, exemplar=True, coT=True,
@@ -103,7 +313,7 @@ def eval_genia(model, algorithm, n_runs=2, sleep_between_queries=None, limit=Non
     config.set_config(algorithm, exemplar=exemplar, coT=coT, defn=defn, tf=tf)
     genia = load_genia()
     return complete_eval(genia, model, algorithm, n_runs=n_runs, sleep_between_queries=sleep_between_queries,
-                         limit=limit)
+                         limit=limit, **eval_kwargs(kwargs))
 
 
 def eval_tweetner(model, algorithm, n_runs=2, sleep_between_queries=None, limit=None, exemplar=True, coT=True,
@@ -121,7 +331,7 @@ def eval_tweetner(model, algorithm, n_runs=2, sleep_between_queries=None, limit=
     config.set_config(algorithm, exemplar=exemplar, coT=coT, defn=defn, tf=tf)
     tweetner = load_tweetner("validation")
     return complete_eval(tweetner, model, algorithm, n_runs=n_runs, sleep_between_queries=sleep_between_queries,
-                         limit=limit)
+                         limit=limit, **eval_kwargs(kwargs))
 
 
 def eval_fabner(model, algorithm, n_runs=2, sleep_between_queries=None, limit=None, exemplar=True, coT=True,
@@ -139,7 +349,7 @@ def eval_fabner(model, algorithm, n_runs=2, sleep_between_queries=None, limit=No
     config.set_config(algorithm, exemplar=exemplar, coT=coT, defn=defn, tf=tf)
     fabner = load_fabner("test")
     return complete_eval(fabner, model, algorithm, n_runs=n_runs, sleep_between_queries=sleep_between_queries,
-                         limit=limit)
+                         limit=limit, **eval_kwargs(kwargs))
 
 
 def eval_cross_ner(model, algorithm, n_runs=2, sleep_between_queries=None, limit=None, exemplar=True, coT=True,
@@ -163,7 +373,7 @@ def eval_cross_ner(model, algorithm, n_runs=2, sleep_between_queries=None, limit
     config.set_config(algorithm, exemplar=exemplar, coT=coT, defn=defn, tf=tf)
     dataset = load_cross_ner(category=category, split="test")
     return complete_eval(dataset, model, algorithm, n_runs=n_runs, sleep_between_queries=sleep_between_queries,
-                         limit=limit)
+                         limit=limit, **eval_kwargs(kwargs))
 
 
 def eval_few_nerd_intra(model, algorithm, n_runs=2, sleep_between_queries=None, limit=None, exemplar=True, coT=True,
@@ -186,130 +396,265 @@ def eval_few_nerd_intra(model, algorithm, n_runs=2, sleep_between_queries=None,
     config.set_config(algorithm, exemplar=exemplar, coT=coT, defn=defn, tf=tf)
     dataset = load_few_nerd(category="intra", split=split)
     return complete_eval(dataset, model, algorithm, n_runs=n_runs, sleep_between_queries=sleep_between_queries,
-                         limit=limit)
+                         limit=limit, **eval_kwargs(kwargs))
 
 
-def run(dataset="conll", subdataset=None, gpt=True, exemplar=True, coT=True, defn=True, tf=True, name_meta=""):
-    print(f"Running for: {dataset}, {subdataset}")
-    res_path = "results"
-    gpt_limit = 20
-    gpt_nruns = 1
-    other_limit = 200
-    other_nruns = 2
-    Algorithm_class = Algorithm
+def run_checkpoint(dataset, subdataset, model, exemplar, coT, defn, tf, name_meta, checkpoint, resume):
+    if not (checkpoint or resume):
+        return None
+    return Checkpoint.for_run(dataset, subdataset, model, exemplar=exemplar, coT=coT, defn=defn, tf=tf,
+                              name_meta=name_meta, resume=resume)
+
 
+def get_eval_fn(dataset):
     if dataset == "conll":
-        eval_fn = eval_conll
+        return eval_conll
     elif dataset == "genia":
-        eval_fn = eval_genia
+        return eval_genia
     elif dataset == "crossner":
-        eval_fn = eval_cross_ner
+        return eval_cross_ner
     elif dataset == "fewnerd":
-        eval_fn = eval_few_nerd_intra
+        return eval_few_nerd_intra
     elif dataset == "tweetner":
-        eval_fn = eval_tweetner
+        return eval_tweetner
     elif dataset == "fabner":
-        eval_fn = eval_fabner
+        return eval_fabner
     else:
         raise ValueError(f"Unknown Dataset: {dataset}")
 
+
+def run(dataset="conll", subdataset=None, gpt=True, exemplar=True, coT=True, defn=True, tf=True, name_meta="",
+        concurrency=None, cache=None, seed=None, batch_size=None, pack_token_budget=None, checkpoint=False,
+        resume=False, shard=None, n_shards=None, budget=False, autogen=True):
+    """
+    cache: a ResponseCache (or True for the default one) to answer repeated prompts from disk
+    seed: seeds the exemplar and row sampling so that a rerun sends the same prompts and hits the cache
+    checkpoint: log every finished row under checkpoints/ as it completes
+    resume: continue from that log, rows already in it are not queried again (implies checkpoint)
+    shard, n_shards: only evaluate shard (0 to n_shards - 1) of the rows and save them under results/shards/ for
+    shard.merge_shards, every shard must be given the same seed (required) so they sample the same rows and
+    exemplars. With autogen the exemplar annotations also come from the model, share a cache or turn it off so
+    every shard sends the same prompts
+    budget: size the max tokens of every answer to its paragraph (a TokenBudget, or True for the default one)
+    instead of using the model's fixed max_tokens / max_new_tokens
+    autogen: have the model annotate the sampled exemplars (config.autogenerate_annotations)
+    """
+    if n_shards is not None and seed is None:
+        raise ValueError("Sharded runs need a seed, every shard must sample the same rows and exemplars")
+    print(f"Running for: {dataset}, {subdataset}")
+    if seed is not None:
+        np.random.seed(seed)
+    if cache is True:
+        cache = ResponseCache()
+    if budget is True:
+        budget = TokenBudget()
+    elif budget is False:
+        budget = None
+    part = None
+    if n_shards is not None:
+        part = Shard(shard, n_shards, name=f"{name_meta}{dataset}{subdataset}", seed=seed)
+        name_meta = f"{name_meta}shard{shard}of{n_shards}_"
+    res_path = "results"
+    gpt_limit = 20
+    gpt_nruns = 1
+    other_limit = 200
+    other_nruns = 2
+    Algorithm_class = Algorithm
+    eval_fn = get_eval_fn(dataset)
+
     if gpt:
-        model = OpenAIGPT()
-        micros, macros, df = eval_fn(model, Algorithm_class(), n_runs=gpt_nruns,
-                                                      sleep_between_queries=model.seconds_per_query,
+        if concurrency is not None:
+            model = AsyncOpenAIGPT()
+        else:
+            model = OpenAIGPT()
+        if cache is not None:
+            model = CachedModel(model, cache)
+        log = run_checkpoint(dataset, subdataset, model, exemplar, coT, defn, tf, name_meta, checkpoint, resume)
+        micros, macros, df = eval_fn(model, Algorithm_class(budget=budget), n_runs=gpt_nruns,
+                                                      sleep_between_queries=None,
                                                       limit=gpt_limit,
                                                       exemplar=exemplar, coT=coT, defn=defn, tf=tf,
-                                                      add_info=subdataset)
+                                                      add_info=subdataset, concurrency=concurrency,
+                                                      pack_token_budget=pack_token_budget, checkpoint=log,
+                                                      shard=part, autogen=autogen)
     else:
         model = Alpaca(size='base')
-        micros, macros, df = eval_fn(model, Algorithm_class(), n_runs=other_nruns,
+        if cache is not None:
+            model = CachedModel(model, cache)
+        log = run_checkpoint(dataset, subdataset, model, exemplar, coT, defn, tf, name_meta, checkpoint, resume)
+        micros, macros, df = eval_fn(model, Algorithm_class(budget=budget), n_runs=other_nruns,
                                                       sleep_between_queries=None, exemplar=exemplar,
                                                       coT=coT, defn=defn, tf=tf,
-                                                      limit=other_limit, add_info=subdataset)
+                                                      limit=other_limit, add_info=subdataset,
+                                                      batch_size=batch_size, checkpoint=log, shard=part,
+                                                      autogen=autogen)
     print(f"Final Results For {name_meta} | {dataset} {'('+subdataset+')' if subdataset is not None else ''}) "
           f"|CoT {coT} | Exemplar {exemplar} (tf {tf}) |Defn {defn}")
     print(f"Micro f1_means: {micros.mean()}")
     print(f"Micro f1_stds: {micros.std()}")
     print(f"Macro f1_means: {macros.mean()}")
     print(f"Macro f1_stds: {macros.std()}")
+    if cache is not None:
+        print(f"Response cache: {cache.stats()}")
+    if budget is not None:
+        print(f"Answer token budget: {budget.stats()}")
+    if part is not None:
+        part.save()
+        return micros, macros
     save_path = f"results/{name_meta}{dataset}{subdataset}.csv"
     df.to_csv(save_path, index=False)
     return micros, macros
 
 
-def run_all_datasets(gpt=False, exemplar=True, coT=True, defn=True, tf=True,
-                     name_meta="",
-                     dataset_exclude=[], subdataset_exclude=[]):
-    d = {}
-    datasets = ["conll", "genia", "crossner", "fewnerd", "tweetner", "fabner"]
-    subdatasets = {"crossner": ['politics', 'literature', 'ai', 'science', 'music'],
+def compare_type_memo(model, dataset="conll", subdataset=None, limit=100, seed=0, memo=None, cache=None):
+    """
+    Evaluates MultiAlgorithm twice on the same rows, typing every phrase with the model and then with a TypeMemo
+    (memo, a default one if None), and prints the memo's hit rate and the micro / macro f1 delta it causes.
+    The model is wrapped in a CachedModel (on cache, a new ResponseCache by default) so the second pass gets the
+    same answer lists and only the memo makes a difference. Only configs with type exemplars (conll) can run
+    MultiAlgorithm
+    """
+    if memo is None:
+        memo = TypeMemo()
+    if cache is None:
+        cache = ResponseCache()
+    model = CachedModel(model, cache)
+    scores = {}
+    for name, type_memo in [("model", None), ("memo", memo)]:
+        np.random.seed(seed)
+        micros, macros, df = get_eval_fn(dataset)(model, MultiAlgorithm(type_memo=type_memo), n_runs=1, limit=limit,
+                                                  add_info=subdataset)
+        scores[name] = (micros.mean(), macros.mean())
+    micro_delta = scores["memo"][0] - scores["model"][0]
+    macro_delta = scores["memo"][1] - scores["model"][1]
+    print(f"Type memo: {memo.stats()}")
+    print(f"Micro f1 delta: {micro_delta}")
+    print(f"Macro f1 delta: {macro_delta}")
+    return memo.stats(), micro_delta, macro_delta
+
+
+all_datasets = ["conll", "genia", "crossner", "fewnerd", "tweetner", "fabner"]
+all_subdatasets = {"crossner": ['politics', 'literature', 'ai', 'science', 'music'],
                    'fewnerd': ["test"]}
-    for dataset in datasets:
+
+
+def dataset_keys(dataset_exclude=[], subdataset_exclude=[]):
+    """
+    (dataset, subdataset, name in the results table) for every dataset and subdataset that is not excluded
+    """
+    keys = []
+    for dataset in all_datasets:
         if dataset in dataset_exclude:
             continue
-        sub = subdatasets.get(dataset, None)
+        sub = all_subdatasets.get(dataset, None)
         if sub is None:
-            micro, macro = run(gpt=gpt, dataset=dataset, coT=coT, exemplar=exemplar, defn=defn, tf=tf,
-                               name_meta=name_meta)
-            d[dataset] = [(macro * 100).mean(), (macro * 100).std(), (micro * 100).mean(), (micro * 100).std()]
+            keys.append((dataset, None, dataset))
         else:
             for s in sub:
                 if s in subdataset_exclude:
                     continue
-                macro, micro = run(gpt=gpt, dataset=dataset, subdataset=s,
-                                   coT=coT, exemplar=exemplar, defn=defn, tf=tf, name_meta=name_meta)
-                d[f"{dataset}_{s}"] = [(macro * 100).mean(), (macro * 100).std(),
-                                       (micro * 100).mean(), (micro * 100).std()]
+                keys.append((dataset, s, f"{dataset}_{s}"))
+    return keys
+
+
+def summarize(micro, macro):
+    return [(macro * 100).mean(), (macro * 100).std(), (micro * 100).mean(), (micro * 100).std()]
+
+
+def run_all_datasets(gpt=False, exemplar=True, coT=True, defn=True, tf=True,
+                     name_meta="",
+                     dataset_exclude=[], subdataset_exclude=[], n_workers=None, **kwargs):
+    """
+    n_workers: run the datasets in parallel on that many processes (see sweep_configurations)
+    """
+    if n_workers is not None:
+        key = (defn, exemplar, coT, tf)
+        return sweep_configurations([key], gpt=gpt, name_meta=name_meta, dataset_exclude=dataset_exclude,
+                                    subdataset_exclude=subdataset_exclude, n_workers=n_workers, **kwargs)[key]
+    d = {}
+    for dataset, subdataset, name in dataset_keys(dataset_exclude, subdataset_exclude):
+        micro, macro = run(gpt=gpt, dataset=dataset, subdataset=subdataset, coT=coT, exemplar=exemplar, defn=defn,
+                           tf=tf, name_meta=name_meta, **kwargs)
+        d[name] = summarize(micro, macro)
     return d
 
 
+def sweep_configurations(configurations, gpt=False, name_meta="", dataset_exclude=[], subdataset_exclude=[],
+                         n_workers=None, devices=None, requests_per_minute=20, tokens_per_minute=40000, **kwargs):
+    """
+    Expands every (defn, exemplar, coT, tf) configuration and dataset into a job and runs them on a process pool,
+    all workers share one OpenAI rate limit and local models get their own devices (see sweep.sweep).
+    With several configurations each one saves its results csv under its own name_meta.
+    Returns {configuration: {dataset: summary}} like the sequential loops
+    """
+    jobs = []
+    keys = []
+    for defn, exemplar, coT, tf in configurations:
+        meta = name_meta
+        if len(configurations) > 1:
+            meta = f"{name_meta}defn{defn}_exemplar{exemplar}_coT{coT}_tf{tf}_"
+        for dataset, subdataset, name in dataset_keys(dataset_exclude, subdataset_exclude):
+            jobs.append(dict(gpt=gpt, dataset=dataset, subdataset=subdataset, exemplar=exemplar, coT=coT, defn=defn,
+                             tf=tf, name_meta=meta, **kwargs))
+            keys.append(((defn, exemplar, coT, tf), name))
+    results = sweep(jobs, n_workers=n_workers, devices=devices, requests_per_minute=requests_per_minute,
+                    tokens_per_minute=tokens_per_minute)
+    res_d = {key: {} for key in configurations}
+    for (key, name), (micro, macro) in zip(keys, results):
+        res_d[key][name] = summarize(micro, macro)
+    return res_d
+
+
+def print_ablations(res_d):
+    print(f"Ablations Done.... \nFinal Results For All: f1 Macro Mean, f1 Macro Std, f1 Micro Mean, f1 Micro Std")
+    for key in res_d:
+        print(f"Defn: {key[0]}\tExemplar: {key[1]}\tCoT: {key[2]}\ttf:{key[3]}")
+        for dataset_key in res_d[key]:
+            print(f"\t{dataset_key}")
+            formatted = [f"{i:.3f}" for i in res_d[key][dataset_key]]
+            print(f"\t\t{formatted}")
+
+
+def ablate_configurations(configurations, gpt=False, dataset_exclude=[], subdataset_exclude=[], n_workers=None,
+                          **kwargs):
+    if n_workers is not None:
+        res_d = sweep_configurations(configurations, gpt=gpt, dataset_exclude=dataset_exclude,
+                                     subdataset_exclude=subdataset_exclude, n_workers=n_workers, **kwargs)
+    else:
+        res_d = {}
+        for defn, exemplar, cot, tf in configurations:
+            key = (defn, exemplar, cot, tf)
+            res_d[key] = run_all_datasets(gpt=gpt, exemplar=exemplar, coT=cot, defn=defn, tf=tf,
+                                          dataset_exclude=dataset_exclude, subdataset_exclude=subdataset_exclude,
+                                          **kwargs)
+    print_ablations(res_d)
+    return res_d
+
+
 def ablate_all(gpt=False, vary_cot=True, vary_exemplar=True, vary_tf=True, vary_defn=True,
-               dataset_exclude=["genia"], subdataset_exclude=[]):
+               dataset_exclude=["genia"], subdataset_exclude=[], **kwargs):
     cot_options = [True, False] if vary_cot else [True]
     exemplar_options = [True, False] if vary_exemplar else [True]
     tf_options = [True, False] if vary_tf else [True]
     defn_options = [True, False] if vary_defn else [True]
     # first take off cot then tf then example then defn
-    res_d = {}
-    for defn in defn_options:
-        for exemplar in exemplar_options:
-            for cot in cot_options:
-                for tf in tf_options:
-                    key = (defn, exemplar, cot, tf)
-                    res_d[key] = run_all_datasets(gpt=gpt, exemplar=exemplar, coT=cot, defn=defn, tf=tf,
-                     dataset_exclude=dataset_exclude, subdataset_exclude=subdataset_exclude)
-
-    print(f"Ablations Done.... \nFinal Results For All: f1 Macro Mean, f1 Macro Std, f1 Micro Mean, f1 Micro Std")
+    configurations = []
     for defn in defn_options:
         for exemplar in exemplar_options:
             for cot in cot_options:
                 for tf in tf_options:
-                    key = (defn, exemplar, cot, tf)
-                    print(f"Defn: {key[0]}\tExemplar: {key[1]}\tCoT: {key[2]}\ttf:{key[3]}")
-                    for dataset_key in res_d[key]:
-                        print(f"\t{dataset_key}")
-                        formatted = [f"{i:.3f}" for i in res_d[key][dataset_key]]
-                        print(f"\t\t{formatted}")
+                    configurations.append((defn, exemplar, cot, tf))
+    ablate_configurations(configurations, gpt=gpt, dataset_exclude=dataset_exclude,
+                          subdataset_exclude=subdataset_exclude, **kwargs)
     return
 
 
-def ablate_best(gpt=False, dataset_exclude=["genia"], subdataset_exclude=["politics", "literature", "train", "dev"]):
+def ablate_best(gpt=False, dataset_exclude=["genia"], subdataset_exclude=["politics", "literature", "train", "dev"],
+                **kwargs):
     configurations = [(True, True, True, True), (False, True, True, True),
                       (True, False, True, True), (True, True, False, True), (True, True, True, False)]
-    res_d = {}
-    for defn, exemplar, cot, tf in configurations:
-        key = (defn, exemplar, cot, tf)
-        res_d[key] = run_all_datasets(gpt=gpt, exemplar=exemplar, coT=cot, defn=defn, tf=tf,
-         dataset_exclude=dataset_exclude, subdataset_exclude=subdataset_exclude)
-
-    print(f"Ablations Done.... \nFinal Results For All: f1 Macro Mean, f1 Macro Std, f1 Micro Mean, f1 Micro Std")
-    for defn, exemplar, cot, tf in configurations:
-        key = (defn, exemplar, cot, tf)
-        print(f"Defn: {key[0]}\tExemplar: {key[1]}\tCoT: {key[2]}\ttf:{key[3]}")
-        for dataset_key in res_d[key]:
-            print(f"\t{dataset_key}")
-            formatted = [f"{i:.3f}" for i in res_d[key][dataset_key]]
-            print(f"\t\t{formatted}")
+    ablate_configurations(configurations, gpt=gpt, dataset_exclude=dataset_exclude,
+                          subdataset_exclude=subdataset_exclude, **kwargs)
     return
 
 
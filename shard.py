@@ -0,0 +1,92 @@
+import json
+import os
+import sys
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from metrics import SpanMetrics
+
+shard_root = os.path.join("results", "shards")
+
+
+class Shard:
+    """
+    One of n_shards slices of an evaluation, so a large split can be spread over several processes or machines.
+    Every shard samples the same rows (with seed) and keeps those whose index hashes to it, then saves its rows
+    and its raw per type span counts for merge_shards
+    """
+    def __init__(self, index, n_shards, name, seed=0, root=shard_root):
+        assert 0 <= index < n_shards
+        self.index = index
+        self.n_shards = n_shards
+        self.name = name
+        self.seed = seed
+        self.root = root
+        self.runs = {}
+
+    @staticmethod
+    def shard_of(label, n_shards):
+        return zlib.crc32(str(label).encode("utf-8")) % n_shards  # unlike hash(), the same in every process
+
+    def sample(self, run, dataset, limit):
+        return dataset.sample(limit, random_state=self.seed + run)
+
+    def select(self, dataset):
+        keep = [Shard.shard_of(label, self.n_shards) == self.index for label in dataset.index]
+        selected = dataset[keep]
+        print(f"Shard {self.index}/{self.n_shards}: {len(selected)} of {len(dataset)} rows")
+        return selected
+
+    def add_run(self, run, metrics, df):
+        self.runs[run] = (metrics, df)
+
+    def path(self, extension):
+        return os.path.join(self.root, f"{self.name}_shard{self.index}of{self.n_shards}.{extension}")
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        dfs = []
+        for run, (metrics, df) in self.runs.items():
+            df = df.copy()
+            df.insert(0, "run", run)
+            dfs.append(df)
+        pd.concat(dfs).to_csv(self.path("csv"), index=False)
+        counts = {run: metrics.to_dict() for run, (metrics, df) in self.runs.items()}
+        with open(self.path("json"), "w") as f:
+            json.dump({"n_shards": self.n_shards, "runs": counts}, f)
+
+
+def merge_shards(name, n_shards, root=shard_root, results_dir="results"):
+    """
+    Combines the n_shards saved shards of name into results/<name>.csv (rows of the last run grouped by shard,
+    like run.run saves) and the exact micro / macro f1 of every run from the summed span counts
+    """
+    runs = {}
+    dfs = []
+    for index in range(n_shards):
+        shard = Shard(index, n_shards, name, root=root)
+        with open(shard.path("json")) as f:
+            saved = json.load(f)
+        for run, counts in saved["runs"].items():
+            metrics = runs.setdefault(int(run), SpanMetrics())
+            metrics.merge(SpanMetrics.from_dict(counts))
+        dfs.append(pd.read_csv(shard.path("csv")))
+    df = pd.concat(dfs)
+    last_run = max(runs)
+    df = df[df["run"] == last_run].drop(columns="run")
+    df.to_csv(os.path.join(results_dir, f"{name}.csv"), index=False)
+    micros = np.array([runs[run].micro_f1() for run in sorted(runs)])
+    macros = np.array([runs[run].macro_f1() for run in sorted(runs)])
+    print(f"Merged {n_shards} shards of {name}: {runs[last_run].n_rows} rows in the last run")
+    print(f"Micro f1_means: {micros.mean()}")
+    print(f"Micro f1_stds: {micros.std()}")
+    print(f"Macro f1_means: {macros.mean()}")
+    print(f"Macro f1_stds: {macros.std()}")
+    return micros, macros
+
+
+if __name__ == "__main__":
+    # python shard.py <name> <n_shards>
+    merge_shards(sys.argv[1], int(sys.argv[2]))
@@ -0,0 +1,76 @@
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import utils
+from ratelimit import SharedRateLimiter
+
+
+def device_groups(n_workers, devices=None):
+    """
+    Splits the devices (utils.Parameters.devices by default) into one disjoint group per worker, or returns None
+    if there are fewer devices than workers (every worker then keeps the default devices)
+    """
+    if devices is None:
+        devices = utils.Parameters.devices
+    if "cpu" in devices or len(devices) < n_workers:
+        return None
+    per_worker = len(devices) // n_workers
+    return [devices[i*per_worker:(i+1)*per_worker] for i in range(n_workers)]
+
+
+def init_worker(limiter, slots, n_workers, groups):
+    """
+    Runs once in every worker process: installs the shared rate limiter and pins the worker to its own devices
+    (local models) and its own share of the cpu cores
+    """
+    import models
+
+    models.OpenAIGPT.rate_limiter = limiter
+    with slots.get_lock():
+        slot = slots.value
+        slots.value += 1
+    if groups is not None:
+        utils.Parameters.devices = groups[slot]
+    if hasattr(os, "sched_setaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+        own = cores[slot::n_workers] if len(cores) >= n_workers else cores
+        os.sched_setaffinity(0, own)
+        os.environ["OMP_NUM_THREADS"] = str(len(own))
+        if "torch" in sys.modules:
+            sys.modules["torch"].set_num_threads(len(own))
+
+
+def run_job(fn, job):
+    """
+    Runs one job, by default one (configuration, dataset, subdataset) with run.run which makes its own Algorithm
+    """
+    if fn is None:
+        import run
+        fn = run.run
+    return fn(**job)
+
+
+def sweep(jobs, n_workers=None, devices=None, requests_per_minute=20, tokens_per_minute=40000, fn=None):
+    """
+    Runs every job (a dict of run.run arguments, or of fn's arguments) across a pool of n_workers processes.
+    All workers share one requests / tokens per minute budget for the OpenAI models.
+    Returns the result ((micros, macros) for run.run) of every job, in the order of jobs
+    """
+    if n_workers is None:
+        n_workers = min(len(jobs), os.cpu_count() or 1)
+    context = multiprocessing.get_context("spawn")  # forking after CUDA is initialised is not safe
+    limiter = SharedRateLimiter(requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute,
+                                context=context)
+    slots = context.Value("i", 0)
+    groups = device_groups(n_workers, devices)
+    results = [None for job in jobs]
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=context, initializer=init_worker,
+                             initargs=(limiter, slots, n_workers, groups)) as executor:
+        futures = {executor.submit(run_job, fn, job): i for i, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+            print(f"Finished {len(results) - results.count(None)}/{len(jobs)}: {jobs[i]}")
+    return results
@@ -0,0 +1,96 @@
+import random
+import string
+import zlib
+from collections import Counter
+
+
+class TypeMemo:
+    """
+    Entity types the model already gave for a phrase, so MultiAlgorithm.get_types only asks it about new or
+    ambiguous ones. Keyed on (config, normalized phrase) plus a hash of the context words on either side of the
+    phrase if context > 0. A key is answered from the memo once the model has typed it at least min_count times and
+    its most common type has at least min_agreement of those answers. audit_rate of those hits are still sent to the
+    model and counted in, so a phrase that turns out to be ambiguous loses its confidence and goes back to the model
+    """
+    def __init__(self, context=0, min_count=2, min_agreement=0.9, audit_rate=0.0, seed=0):
+        self.context = context
+        self.min_count = min_count
+        self.min_agreement = min_agreement
+        self.audit_rate = audit_rate
+        self.rng = random.Random(seed)
+        self.types = {}  # key -> Counter of the types the model answered
+        self.hits = 0
+        self.misses = 0
+        self.audits = 0
+        self.audit_agreements = 0
+        self.auditing = set()  # keys sent to the model although the memo had an answer
+
+    @staticmethod
+    def normalize(phrase):
+        return " ".join(phrase.lower().split()).strip(string.punctuation + " ")
+
+    def key(self, config, phrase, para):
+        phrase = TypeMemo.normalize(phrase)
+        key = (zlib.crc32(config.encode("utf-8")), phrase)
+        if self.context > 0:
+            words = [TypeMemo.normalize(word) for word in para.split()]
+            n = len(phrase.split())
+            window = ""
+            for i in range(len(words) - n + 1):
+                if " ".join(words[i:i+n]) == phrase:  # the first occurrence of the phrase
+                    window = " ".join(words[max(i - self.context, 0):i] + ["|"] + words[i+n:i+n+self.context])
+                    break
+            key = key + (zlib.crc32(window.encode("utf-8")),)
+        return key
+
+    def confidence(self, key):
+        """
+        (most common type, share of the model's answers that gave it, number of answers), None if never answered
+        """
+        counts = self.types.get(key)
+        if not counts:
+            return None
+        entity_type, count = counts.most_common(1)[0]
+        total = sum(counts.values())
+        return entity_type, count / total, total
+
+    def get(self, key):
+        """
+        The type of key if the memo is confident about it, None if the model has to be asked
+        """
+        confidence = self.confidence(key)
+        if confidence is None or confidence[2] < self.min_count or confidence[1] < self.min_agreement:
+            self.misses += 1
+            return None
+        if self.audit_rate > 0 and self.rng.random() < self.audit_rate:
+            self.audits += 1
+            self.misses += 1
+            self.auditing.add(key)
+            return None
+        self.hits += 1
+        return confidence[0]
+
+    def put(self, key, entity_type):
+        """
+        Counts in the type the model answered for key
+        """
+        if key in self.auditing:
+            self.auditing.discard(key)
+            self.audit_agreements += self.confidence(key)[0] == entity_type
+        if entity_type == -1:  # no type could be read from the answer
+            return
+        self.types.setdefault(key, Counter())[entity_type] += 1
+
+    def __len__(self):
+        return len(self.types)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0
+
+    def stats(self):
+        stats = {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate(), "entries": len(self)}
+        if self.audits > 0:
+            stats["audits"] = self.audits
+            stats["audit_agreement"] = self.audit_agreements / self.audits
+        return stats
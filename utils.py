@@ -1,8 +1,29 @@
 
 import string
 import re
+from collections import Counter
+from functools import lru_cache
 from numpy.random import choice
-from nltk.corpus import stopwords
+
+
+trivial_answers = ("", " ", ".", "-")
+
+
+@lru_cache(maxsize=None)
+def get_stopwords():
+    """
+    English stopwords, read from the nltk corpus on first use only (importing nltk alone takes seconds)
+    """
+    from nltk.corpus import stopwords
+    return frozenset(stopwords.words('english'))
+
+
+@lru_cache(maxsize=None)
+def get_trivial_answers():
+    """
+    Answers that are never entities: blanks, lone punctuation and stopwords
+    """
+    return frozenset(trivial_answers) | get_stopwords()
 
 
 def find_nth_str(haystack, needle, n):
@@ -36,6 +57,35 @@ def find_nth_list_subset(haystack, needle, n):
         return found[n-1]
 
 
+class PrefixedPrompt(str):
+    """
+    A prompt string that remembers which part of it is the fixed prefix (definition and exemplars) and which part
+    is the per paragraph suffix, so models can reuse work done on the prefix. Behaves as the full string otherwise
+    """
+    def __new__(cls, prefix, suffix):
+        prompt = super().__new__(cls, prefix + suffix)
+        prompt.prefix = prefix
+        prompt.suffix = suffix
+        return prompt
+
+    def __getnewargs__(self):
+        return self.prefix, self.suffix
+
+
+class Completion(str):
+    """
+    The text of a model response that also carries the response's finish_reason ("length" when it was cut off at
+    max_tokens), so a caller can check its own response instead of state shared by every request of the model
+    """
+    def __new__(cls, text, finish_reason=None):
+        completion = super().__new__(cls, text)
+        completion.finish_reason = finish_reason
+        return completion
+
+    def __getnewargs__(self):
+        return str(self), self.finish_reason
+
+
 def separate_single_multi(l):
     singles, multis = [], []
     for item in l:
@@ -57,35 +107,241 @@ def verbose(func):
     return inner
 
 
-class AnswerMapping:
+class AnswerParser:
+    """
+    Precompiled single pass parser of a numbered answer list ("1. entity | True | explanation (type)" per line, or
+    all on one line) into (entity, true, explanation, type) records: entity lower cased, true a bool, explanation
+    None when the item has none and type the text in the explanation's first brackets (or None).
+    Lines it cannot read are counted in the parser's diagnostics instead of printed
+    """
+    numbered = re.compile(r"\d+[.)]")
+
+    def __init__(self):
+        self.diagnostics = Counter()
+
     @staticmethod
-    @verbose
-    def get_numbered_list_items(output, verbose=False, indent_level=0):
+    def strip_number(line):
+        line = line.lstrip("0123456789.")
+        while line[:1].isnumeric() or line[:1] == ".":  # non ascii numerals, e.g. "1.²"
+            line = line[1:]
+        return line.strip()
+
+    def numbered_line(self, line):
+        """
+        The item on a line of a multi line output without its number, None if the line has no item
+        """
+        c = line.strip()
+        if c == "":
+            return None
+        if AnswerParser.numbered.match(c) is None:
+            if c.lower() != "answer:":
+                self.diagnostics["unmatched line"] += 1
+            return None
+        return AnswerParser.strip_number(c)
+
+    def items(self, output, strict=False):
+        """
+        The numbered items of output, with their numbers removed. strict applies the rules of the answer lists
+        parse reads to single line output: nothing unless it has a 1 and no part that mentions an answer
+        """
         final = []
         if "\n" in output:
-            candidates = output.split("\n")
-            for cand in candidates:
+            match = AnswerParser.numbered.match
+            for line in output.split("\n"):
+                c = line.strip()
+                if c == "":
+                    continue
+                if match(c) is None:
+                    if c.lower() != "answer:":
+                        self.diagnostics["unmatched line"] += 1
+                    continue
+                item = c.lstrip("0123456789.")
+                if item[:1].isnumeric():
+                    item = AnswerParser.strip_number(item)
+                final.append(item.strip())
+        elif not strict:
+            for cand in AnswerParser.numbered.split(output):
                 c = cand.strip()
-                if c.lower().strip() in ["", "answer:"]:
-                    pass
-                elif re.match(r"\d+[.)]+ *", c):
-                    start = 0
-                    while c[start].isnumeric() or c[start] == '.':
-                        start += 1
-                    final.append(c[start:].strip())
-                else:
-                    print(f"Unable to match nonempty {c}")
-                    pass
-        else:
-            candidates = re.split(r"\d+[.)]", output)
-            for cand in candidates:
+                if c != "" and c.lower() != "answer:":
+                    final.append(c)
+        elif "1" in output:
+            for cand in AnswerParser.numbered.split(output):
                 c = cand.strip()
-                if c.lower().strip() in ["", "answer:"]:
-                    pass
-                else:
+                if c != "" and "answer" not in c.lower():
                     final.append(c)
         return final
 
+    def records(self, options, separator="|"):
+        """
+        The (entity, true, explanation, type) record of each item
+        """
+        records = []
+        for option in options:
+            split = option.split(separator)
+            n = len(split)
+            if n == 1:
+                records.append((option.lower(), True, None, None))
+                continue
+            status = split[1].strip().lower()
+            explanation = None
+            if n == 3:
+                explanation = split[2].strip()
+            elif n > 3:
+                self.diagnostics["more than 3 values"] += 1
+            elif status != "true" and status != "false":
+                status, explanation = "true", split[1].strip()
+            entity_type = None
+            if explanation is not None:
+                start = explanation.find("(")
+                if start >= 0:
+                    end = explanation.find(")")
+                    if end >= 0:
+                        entity_type = explanation[start + 1:end]
+            records.append((split[0].strip().lower(), status == "true", explanation, entity_type))
+        return records
+
+    def parse(self, output, separator="|"):
+        """
+        The (entity, true, explanation, type) record of every item of output, in order
+        """
+        return self.records(self.items(output, strict=True), separator)
+
+    def parse_batch(self, outputs, separator="|"):
+        return [self.parse(output, separator) for output in outputs]
+
+
+class AnswerStream:
+    """
+    Incremental AnswerParser for a streamed output: feed it the pieces as they arrive and it returns the records of
+    the lines completed so far. Over the whole output these are the same records as AnswerParser.parse.
+    finished is set once a line that is neither an item, blank nor "Answer:" follows the items (as soon as the line
+    being written can no longer become one), i.e. the model has moved on from the list
+    """
+    first_item = re.compile(r"(?:^|\s)1([.)])\s")
+    list_markers = re.compile(r"\s(?:Paragraph|Sentence|Q|Answer)\s*\d*\s*:", re.IGNORECASE)
+
+    def __init__(self, separator="|"):
+        self.separator = separator
+        self.parser = AnswerParser()
+        self.pieces = []
+        self.pending = ""  # the line still being written
+        self.multiline = False
+        self.n_records = 0
+        self.finished = False
+
+    def output(self):
+        return "".join(self.pieces)
+
+    def feed(self, text):
+        self.pieces.append(text)
+        self.pending += text
+        records = []
+        if "\n" in text:
+            self.multiline = True
+            *lines, self.pending = self.pending.split("\n")
+            records = self.parse_lines(lines)
+        if self.n_records > 0 and not self.finished and not AnswerStream.may_be_item(self.pending):
+            self.finished = True  # no need to wait for the end of a line that can not turn into an item any more
+        return records
+
+    @staticmethod
+    def may_be_item(line):
+        """
+        Whether a line still being written can turn out an item, blank or "Answer:"
+        """
+        c = line.strip().lower()
+        return c == "" or "answer:".startswith(c) or c.isdigit() or AnswerParser.numbered.match(c) is not None
+
+    def parse_lines(self, lines):
+        items = []
+        for line in lines:
+            item = self.parser.numbered_line(line)
+            if item is not None:
+                items.append(item)
+            elif self.n_records + len(items) > 0 and line.strip().lower() not in ("", "answer:"):
+                self.finished = True
+        self.n_records += len(items)
+        return self.parser.records(items, self.separator)
+
+    def close(self):
+        """
+        The records of the last line, or of the whole output if it turned out to be a single line
+        """
+        if not self.multiline:
+            return self.parser.parse(self.pending, self.separator)
+        records = self.parse_lines([self.pending])
+        self.pending = ""
+        return records
+
+    @staticmethod
+    def list_end(output):
+        """
+        Index at which the answer list of a (partial) output is over, None while it may still go on. For multiline
+        output that is the first line after the items that is not one (see finished). Single line output (T5 can not
+        write newlines) is over where the model starts the list again from 1. or moves on to a new paragraph,
+        question or answer
+        """
+        if "\n" in output:
+            parser = AnswerParser()
+            n_items = 0
+            start = 0
+            for line in output.split("\n"):
+                if parser.numbered_line(line) is not None:
+                    n_items += 1
+                elif n_items > 0 and line.strip().lower() not in ("", "answer:"):
+                    if start + len(line) < len(output) or not AnswerStream.may_be_item(line):
+                        return start
+                start += len(line) + 1
+            return None
+        first = AnswerStream.first_item.search(output)
+        if first is None:
+            return None
+        ends = [m.start() for m in AnswerStream.first_item.finditer(output, first.end()) if m.group(1) == first.group(1)]
+        marker = AnswerStream.list_markers.search(output, first.end())
+        if marker is not None:
+            ends.append(marker.start())
+        return min(ends) if len(ends) > 0 else None
+
+
+class ListEnd:
+    """
+    Incremental AnswerStream.list_end: feed it the generated text piece by piece, it returns True once list_end of
+    all the text so far is found. Every piece is only looked at once (with a few characters before it)
+    """
+    lookback = 32  # a list marker ending in a piece may start in the text before it
+
+    def __init__(self):
+        self.stream = AnswerStream()
+        self.first = None
+        self.ended = False
+
+    def feed(self, text):
+        if self.ended or text == "":
+            return self.ended
+        start = max(0, len(self.stream.pending) - ListEnd.lookback)
+        self.stream.feed(text)
+        if self.stream.multiline:
+            self.ended = self.stream.finished
+            return self.ended
+        output = self.stream.pending  # no line is complete yet, this is all of the output
+        if self.first is None:
+            self.first = AnswerStream.first_item.search(output, start)
+            if self.first is None:
+                return False
+        start = max(start, self.first.end())
+        repeats = (m for m in AnswerStream.first_item.finditer(output, start) if m.group(1) == self.first.group(1))
+        self.ended = next(repeats, None) is not None or AnswerStream.list_markers.search(output, start) is not None
+        return self.ended
+
+
+class AnswerMapping:
+    parser = AnswerParser()  # counts the lines of the outputs below it could not read
+
+    @staticmethod
+    @verbose
+    def get_numbered_list_items(output, verbose=False, indent_level=0):
+        return AnswerMapping.parser.items(output)
+
     @staticmethod
     @verbose
     def get_true_or_false(output, default=True, verbose=False, indent_level=0):
@@ -107,46 +363,13 @@ class AnswerMapping:
     @staticmethod
     @verbose
     def exemplar_format_list(output, verbose=False, indent_level=0, separator='|', true_only=True, identify_types=False):
-        if "\n" in output:
-            listed = AnswerMapping.get_numbered_list_items(output, verbose=False, indent_level=indent_level+1)
-        else:
-            listed = []
-            if "1" in output:
-                split = re.split(r"\d+[.)]", output)
-                for item in split:
-                    if item.strip().lower() == "" or "answer" in item.strip().lower():
-                        pass
-                    else:
-                        listed.append(item.strip())
         final = []
         typestring = []
-        for option in listed:
-            if separator in option:
-                split = option.split(separator)
-                explanation = None
-                if len(split) == 1:
-                    print(f"Got only one value for {option} with separator '{separator}'")
-                    continue
-                elif len(split) == 2:
-                    entity, depends = split
-                    if depends.strip().lower() in ["true", "false"]:
-                        status = depends
-                    else:
-                        status = "true"
-                        explanation = depends
-                elif len(split) == 3:
-                    entity, status, explanation = split
-                else:
-                    entity, status = split[0], split[1]
-                    print(f"Got more than 3 values for {option} with separator '{separator}'")
-                if status.strip().lower() == "true" or not true_only:
-                    if explanation is not None:
-                        typestring.append(explanation.strip())
-                    final.append(entity.strip().lower())
-                else:
-                    pass
-            else:
-                final.append(option.strip().lower())
+        for entity, true, explanation, entity_type in AnswerMapping.parser.parse(output, separator):
+            if true or not true_only:
+                if explanation is not None:
+                    typestring.append(explanation)
+                final.append(entity)
         if not identify_types:
             return final
         else: